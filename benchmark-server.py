@@ -0,0 +1,1378 @@
+#!/usr/bin/env python3
+"""
+SCPI Equipment Emulator - Benchmarks
+
+Measures the emulator in server-py-ver2.3.py from the outside: servers are
+started on free local ports and driven over real TCP sockets.
+
+Usage:
+    python benchmark-server.py framing [--iterations N] [--server-mode thread|async]
+    python benchmark-server.py burst [--sizes 100,1000,10000,100000] [--chunk-size BYTES]
+    python benchmark-server.py validation [--csv detailed_instruments.csv] [--rounds N]
+    python benchmark-server.py stress [--clients N] [--iterations N] [--concurrency lock|actor|session]
+    python benchmark-server.py connect [--csv pna-commands.csv] [--connections N]
+    python benchmark-server.py load [--csv pna-commands.csv] [--clients N] [--duration S]
+                                    [--mix exact=60,set=30,chain=10] [--json results.json]
+    python benchmark-server.py metrics [--csv pna-commands.csv] [--rounds N]
+    python benchmark-server.py trace [--points 201,10001,100001] [--repeats N]
+    python benchmark-server.py cache [--csv pna-commands.csv] [--rounds N]
+    python benchmark-server.py parser [--units N] [--rounds N]
+    python benchmark-server.py mnemonic [--csv pna-commands.csv] [--rounds N]
+    python benchmark-server.py workers [--workers N] [--instruments N] [--batch N] [--duration S]
+    python benchmark-server.py reuseport [--replicas N] [--clients N] [--batch N] [--duration S]
+    python benchmark-server.py startup [--rows N] [--instruments N]
+    python benchmark-server.py snapshot [--rows N] [--instruments N]
+    python benchmark-server.py importtime [--repeats N] [--budget-ms MS]
+    python benchmark-server.py reload [--rows N] [--instruments N]
+    python benchmark-server.py lifecycle [--instruments N] [--restarts N] [--server-mode thread|async]
+    python benchmark-server.py block [--points N] [--iterations N] [--server-mode thread|async]
+"""
+
+import argparse
+import gc
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EMULATOR_PATH = os.path.join(BASE_DIR, 'server-py-ver2.3.py')
+
+
+def load_emulator():
+    """Import server-py-ver2.3.py as a module"""
+    spec = importlib.util.spec_from_file_location('scpi_emulator', EMULATOR_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['scpi_emulator'] = module
+    spec.loader.exec_module(module)
+    logging.getLogger().setLevel(logging.WARNING)
+    return module
+
+
+emulator = load_emulator()
+
+
+def make_instrument(name='Bench Instrument'):
+    """Small instrument used by the protocol benchmarks"""
+    instrument = emulator.SCPIInstrument(name, name.lower().replace(' ', '_'))
+    instrument.add_command('VOLT (.+)', 'OK', 'range:0,10')
+    instrument.add_command('VOLT?', '5.0')
+    instrument.add_command('MEAS:VOLT:DC?', '1.234567E+00')
+    instrument.link_stateful_commands()
+    return instrument
+
+
+def start_server(instrument, manager, framing=None):
+    """Start a server for the instrument on a free local port"""
+    if manager.event_loop is not None:
+        server = emulator.AsyncSCPIServer(instrument, manager, '127.0.0.1', 0, framing,
+                                          event_loop=manager.event_loop)
+    else:
+        server = emulator.SCPIServer(instrument, manager, '127.0.0.1', 0, framing)
+    if not server.start():
+        raise RuntimeError(f"Could not start server for {instrument.name}")
+    return server
+
+
+def read_reply(sock, timeout):
+    """Read one newline-terminated reply, or None on timeout"""
+    sock.settimeout(timeout)
+    data = b''
+    try:
+        while not data.endswith(b'\n'):
+            chunk = sock.recv(4096)
+            if not chunk:
+                return None
+            data += chunk
+    except socket.timeout:
+        return None
+    return data
+
+
+def measure_round_trips(port, payload, iterations, timeout=2.0):
+    """Latencies in seconds of payload -> reply round trips on one connection"""
+    latencies = []
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        for _ in range(iterations):
+            start = time.perf_counter()
+            sock.sendall(payload)
+            if read_reply(sock, timeout) is None:
+                return None
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def read_block_reply(sock, timeout):
+    """Read one reply that may be a #<n><length> binary block; returns its size"""
+    sock.settimeout(timeout)
+    data = bytearray()
+    expected = None
+    while expected is None or len(data) < expected:
+        chunk = sock.recv(1 << 20)
+        if not chunk:
+            raise RuntimeError("Connection closed")
+        data += chunk
+        if expected is None:
+            if data[:1] == b'#' and len(data) >= 2 and len(data) >= 2 + int(data[1:2]):
+                digits = int(data[1:2])
+                expected = 2 + digits + int(data[2:2 + digits]) + 1
+            elif data[:1] != b'#' and data.endswith(b'\n'):
+                break
+    return len(data)
+
+
+def format_latency(latencies):
+    if latencies is None:
+        return 'no reply'
+    return (f"median {statistics.median(latencies) * 1e6:10.1f} us   "
+            f"max {max(latencies) * 1e6:10.1f} us")
+
+
+def bench_framing(args):
+    """Reply latency of terminated and unterminated queries per framing policy"""
+    manager = emulator.SCPIEmulatorManager(server_mode=args.server_mode)
+    policies = [
+        emulator.FramingPolicy('strict'),
+        emulator.FramingPolicy('eoi', args.eoi_timeout_us),
+        emulator.FramingPolicy('immediate'),
+    ]
+
+    print(f"Framing latency ({args.server_mode} server, {args.iterations} queries each)")
+    try:
+        for policy in policies:
+            server = start_server(make_instrument(), manager, policy)
+            terminated = measure_round_trips(server.port, b'MEAS:VOLT:DC?\n', args.iterations)
+            # A strict server never answers unterminated input; one probe is enough
+            unterminated_count = 1 if policy.mode == 'strict' else args.iterations
+            unterminated = measure_round_trips(server.port, b'MEAS:VOLT:DC?', unterminated_count, timeout=1.0)
+            server.stop()
+
+            print(f"  {str(policy):14} terminated:   {format_latency(terminated)}")
+            print(f"  {'':14} unterminated: {format_latency(unterminated)}")
+    finally:
+        manager.stop_all_servers()
+
+
+def legacy_frame(buffer, data):
+    """Terminator scan of the 2.3 receive loop, kept as a baseline"""
+    buffer += data
+    commands = []
+    while True:
+        terminator_pos = -1
+        terminator_len = 0
+        for term, length in [(b'\r\n', 2), (b'\n', 1), (b'\r', 1)]:
+            pos = buffer.find(term)
+            if pos != -1:
+                terminator_pos = pos
+                terminator_len = length
+                break
+        if terminator_pos == -1:
+            break
+        command_bytes = buffer[:terminator_pos]
+        buffer = buffer[terminator_pos + terminator_len:]
+        command = command_bytes.decode('utf-8').strip()
+        if command:
+            commands.append(command)
+    return buffer, commands
+
+
+def bench_burst(args):
+    """Per-command framing cost of one pipelined burst as the burst grows"""
+    sizes = [int(size) for size in args.sizes.split(',')]
+    print(f"Framing cost per command (burst delivered in {args.chunk_size} byte reads)")
+    print(f"  {'commands':>10} {'SCPIFramer':>14} {'2.3 loop':>14}")
+
+    for size in sizes:
+        burst = b''.join(b'SENS1:FREQ:START %de6\n' % i for i in range(size))
+        chunks = [burst[i:i + args.chunk_size] for i in range(0, len(burst), args.chunk_size)]
+
+        framer = emulator.SCPIFramer()
+        start = time.perf_counter()
+        count = 0
+        for chunk in chunks:
+            count += len(framer.feed(chunk))
+        framer_cost = (time.perf_counter() - start) / size
+        assert count == size
+
+        legacy = '(skipped)'
+        if size <= args.legacy_limit:
+            buffer = b''
+            start = time.perf_counter()
+            count = 0
+            for chunk in chunks:
+                buffer, commands = legacy_frame(buffer, chunk)
+                count += len(commands)
+            legacy = f"{(time.perf_counter() - start) / size * 1e6:11.2f} us"
+            assert count == size
+
+        print(f"  {size:>10} {framer_cost * 1e6:11.2f} us {legacy:>14}")
+
+
+def legacy_validate(param, validation):
+    """String-parsing validation of 2.3 (_validate_generic), kept as a baseline"""
+    if validation.startswith('range:'):
+        try:
+            _, range_str = validation.split(':', 1)
+            min_val, max_val = map(float, range_str.split(','))
+            value = float(param)
+            if not (min_val <= value <= max_val):
+                return f'-222,"Data out of range; expected {min_val} to {max_val}, got {value}"'
+        except ValueError:
+            return f'-104,"Data type error; cannot convert \'{param}\' to number"'
+    elif validation.startswith('enum:'):
+        _, enum_str = validation.split(':', 1)
+        valid_values = [v.strip().upper() for v in enum_str.split(',')]
+        if param.upper() not in valid_values:
+            return f'-108,"Parameter not allowed; expected one of {valid_values}, got \'{param}\'"'
+    elif validation == 'bool':
+        if param.upper() not in ['ON', 'OFF', '1', '0']:
+            return f'-108,"Invalid boolean; expected ON/OFF/1/0, got \'{param}\'"'
+    return None
+
+
+class LegacyRule:
+    """Validator that re-parses its rule string on every call"""
+
+    def __init__(self, rule):
+        self.rule = rule
+
+    def __call__(self, param):
+        return legacy_validate(param, self.rule)
+
+
+def valid_parameter(validator):
+    """A parameter string the validator accepts"""
+    if isinstance(validator, emulator.RangeValidator):
+        return repr((validator.min_val + validator.max_val) / 2)
+    if isinstance(validator, emulator.EnumValidator):
+        return sorted(validator.values)[0]
+    return 'ON'
+
+
+def set_commands(instrument):
+    """One valid set command per validated parameterized command"""
+    commands = []
+    for pattern, validator in instrument.validators.items():
+        if pattern.endswith(' (.+)') and not isinstance(validator, emulator.MalformedRangeValidator):
+            commands.append(f"{pattern[:-len(' (.+)')]} {valid_parameter(validator)}")
+    return commands
+
+
+def set_command_rate(instruments, rounds):
+    """Set commands per second through process_command"""
+    workload = [(instrument, set_commands(instrument)) for instrument in instruments]
+    total = sum(len(commands) for _, commands in workload) * rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for instrument, commands in workload:
+            for command in commands:
+                instrument.process_command(command)
+    return total / (time.perf_counter() - start)
+
+
+def bench_validation(args):
+    """Set-command rate with rules parsed per call versus compiled once"""
+    manager = emulator.SCPIEmulatorManager()
+    if not manager.load_from_file(args.csv):
+        raise SystemExit(f"Could not load {args.csv}")
+    instruments = [data['instrument'] for data in manager.instruments.values()]
+    print(f"Set-command rate on {args.csv} ({sum(len(set_commands(i)) for i in instruments)} "
+          f"validated set commands x {args.rounds} rounds)")
+
+    compiled = set_command_rate(instruments, args.rounds)
+
+    for instrument in instruments:
+        instrument.validators = {pattern: LegacyRule(instrument.validation_rules[pattern])
+                                 for pattern in instrument.validators}
+        instrument.link_stateful_commands()
+    legacy = set_command_rate(instruments, args.rounds)
+
+    print(f"  rules parsed per call (2.3): {legacy:12,.0f} commands/s")
+    print(f"  compiled validators:         {compiled:12,.0f} commands/s  ({compiled / legacy:.2f}x)")
+
+
+def bench_stress(args):
+    """Hammer one instrument from many clients and check it stays consistent"""
+    manager = emulator.SCPIEmulatorManager(server_mode=args.server_mode)
+    instrument = make_instrument()
+    instrument.set_concurrency(args.concurrency)
+    server = start_server(instrument, manager)
+
+    barrier = threading.Barrier(args.clients + 1)
+    failures = []
+    latencies = []
+
+    def client(client_id):
+        try:
+            with socket.create_connection(('127.0.0.1', server.port)) as sock:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.sendall(b'*OPC?\n')
+                read_reply(sock, 5.0)  # connected and device-cleared
+                barrier.wait()
+                barrier.wait()  # counters reset
+
+                own = []
+                value = None
+                for i in range(args.iterations):
+                    value = f'5.{client_id:04d}{i:06d}'
+                    start = time.perf_counter()
+                    sock.sendall(f'VOLT {value};VOLT?\n'.encode())
+                    reply = read_reply(sock, 5.0)
+                    own.append(time.perf_counter() - start)
+                    # A chained set/query runs as one unit, so it must see its own value
+                    if reply != f'OK;{value}\n'.encode():
+                        failures.append(f"client {client_id}: expected OK;{value}, got {reply!r}")
+                        break
+                latencies.extend(own)
+                barrier.wait()  # all clients done
+
+                if args.concurrency == 'session':
+                    sock.sendall(b'VOLT?\n')
+                    reply = read_reply(sock, 5.0)
+                    if reply != f'{value}\n'.encode():
+                        failures.append(f"client {client_id}: session state leaked, got {reply!r}")
+        except Exception as e:
+            failures.append(f"client {client_id}: {e}")
+            barrier.abort()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        barrier.wait()
+        with instrument.lock:
+            instrument.command_count = 0
+        start = time.perf_counter()
+        barrier.wait()
+        barrier.wait()
+        elapsed = time.perf_counter() - start
+    except threading.BrokenBarrierError:
+        elapsed = None
+    for thread in threads:
+        thread.join()
+    server.stop()
+    manager.stop_all_servers()
+
+    expected = args.clients * args.iterations
+    # Session clients send one more query after the timed run
+    expected_count = expected + (args.clients if args.concurrency == 'session' else 0)
+    if elapsed is not None and instrument.command_count != expected_count:
+        failures.append(f"command_count {instrument.command_count}, expected {expected_count}")
+    if args.concurrency != 'session' and instrument.error_queue:
+        failures.append(f"unexpected errors: {instrument.error_queue[:3]}")
+
+    print(f"Stress: {args.clients} clients x {args.iterations} chained set/query messages "
+          f"({args.concurrency} concurrency, {args.server_mode} server)")
+    if elapsed is not None:
+        latencies.sort()
+        print(f"  throughput {expected / elapsed:12,.0f} messages/s")
+        print(f"  latency    p50 {latencies[len(latencies) // 2] * 1e6:8.1f} us   "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:8.1f} us")
+    if failures:
+        print(f"  INCONSISTENT ({len(failures)} failures)")
+        for failure in failures[:10]:
+            print(f"    {failure}")
+        sys.exit(1)
+    print("  consistent")
+
+
+def connect_latencies(port, connections):
+    """Seconds from connect() to the first reply, one fresh connection each"""
+    latencies = []
+    for _ in range(connections):
+        start = time.perf_counter()
+        with socket.create_connection(('127.0.0.1', port)) as sock:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.sendall(b'*IDN?\n')
+            if read_reply(sock, 5.0) is None:
+                raise RuntimeError("No reply to *IDN?")
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_connect(args):
+    """Connect-to-first-reply latency of short-lived client connections"""
+    manager = emulator.SCPIEmulatorManager(server_mode=args.server_mode)
+    if not manager.load_from_file(args.csv):
+        raise SystemExit(f"Could not load {args.csv}")
+    # The instrument with the largest command table
+    instrument = max((data['instrument'] for data in manager.instruments.values()),
+                     key=lambda instrument: len(instrument.commands))
+    server = start_server(instrument, manager)
+
+    print(f"Connect to first reply, {args.connections} connections to '{instrument.name}' "
+          f"({len(instrument.commands)} commands, {args.server_mode} server)")
+    try:
+        print(f"  device clear:              {format_latency(connect_latencies(server.port, args.connections))}")
+
+        # What every connect cost when device clear relinked the whole command table
+        device_clear = instrument.visa_device_clear
+
+        def relinking_device_clear():
+            device_clear()
+            instrument.link_stateful_commands()
+
+        instrument.visa_device_clear = relinking_device_clear
+        print(f"  device clear with relink:  {format_latency(connect_latencies(server.port, args.connections))}")
+    finally:
+        server.stop()
+        manager.stop_all_servers()
+
+
+class Workload:
+    """Commands of one instrument that always produce a reply, by kind"""
+
+    KINDS = ('exact', 'set', 'chain')
+
+    def __init__(self, instrument):
+        self.instrument = instrument
+        self.queries = [command for command in instrument.commands
+                        if command.endswith('?') and '(' not in command and self._replies(command)]
+        self.sets = [command for command in self._set_commands() if self._replies(command)]
+
+    def _set_commands(self):
+        commands = []
+        for header, pattern in self.instrument._header_index.items():
+            validator = self.instrument.validators.get(pattern)
+            if isinstance(validator, emulator.MalformedRangeValidator):
+                continue
+            commands.append(f"{header} {valid_parameter(validator) if validator else '1'}")
+        return commands
+
+    def _replies(self, command):
+        return bool(self.instrument.process_command(command))
+
+    def message(self, kind, rng, chain_length):
+        if kind == 'set' and self.sets:
+            return rng.choice(self.sets)
+        if kind == 'chain' and self.sets:
+            parts = [rng.choice(self.sets) for _ in range(chain_length - 1)]
+            return ';'.join(parts + [rng.choice(self.queries)])
+        return rng.choice(self.queries)
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in Workload.KINDS:
+            raise SystemExit(f"Unknown command kind '{kind}' in --mix; expected {list(Workload.KINDS)}")
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def latency_summary(latencies, elapsed):
+    latencies = sorted(latencies)
+    summary = {'messages': len(latencies), 'throughput': len(latencies) / elapsed if elapsed else 0.0}
+    for name, fraction in (('p50', 0.50), ('p99', 0.99), ('p999', 0.999)):
+        value = percentile(latencies, fraction)
+        summary[f'{name}_us'] = round(value * 1e6, 1) if value is not None else None
+    return summary
+
+
+def bench_load(args):
+    """Throughput and latency percentiles of N concurrent clients on a CSV's instruments"""
+    weights = parse_mix(args.mix)
+    kinds = list(weights)
+    manager = emulator.SCPIEmulatorManager(server_mode=args.server_mode, concurrency=args.concurrency)
+    if not manager.load_from_file(args.csv):
+        raise SystemExit(f"Could not load {args.csv}")
+    for data in manager.instruments.values():
+        data['port'] = 0
+    workloads = [Workload(data['instrument']) for data in manager.instruments.values()]
+    workloads = [workload for workload in workloads if workload.queries]
+    if not workloads:
+        raise SystemExit(f"No instrument in {args.csv} has a query that replies")
+    if not manager.start_all_servers('127.0.0.1'):
+        raise SystemExit("Could not start the SCPI servers")
+    ports = {server.instrument.id: server.port for server in manager.servers.values()}
+
+    results = {kind: [] for kind in kinds}
+    failures = []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(args.clients + 1)
+
+    def client(client_id):
+        rng = random.Random(args.seed + client_id)
+        workload = workloads[client_id % len(workloads)]
+        own = {kind: [] for kind in kinds}
+        try:
+            with socket.create_connection(('127.0.0.1', ports[workload.instrument.id])) as sock:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.sendall(b'*OPC?\n')
+                read_reply(sock, 5.0)
+                start_barrier.wait()
+                deadline = time.perf_counter() + args.duration
+                while time.perf_counter() < deadline:
+                    kind = rng.choices(kinds, weights=[weights[k] for k in kinds])[0]
+                    payload = (workload.message(kind, rng, args.chain_length) + '\n').encode()
+                    start = time.perf_counter()
+                    sock.sendall(payload)
+                    if read_reply(sock, 5.0) is None:
+                        raise RuntimeError(f"no reply to {payload!r}")
+                    own[kind].append(time.perf_counter() - start)
+        except Exception as e:
+            with lock:
+                failures.append(f"client {client_id}: {e}")
+            start_barrier.abort()
+        with lock:
+            for kind in kinds:
+                results[kind].extend(own[kind])
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    try:
+        start_barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    manager.stop_all_servers()
+
+    report = {
+        'benchmark': 'load',
+        'emulator': os.path.basename(EMULATOR_PATH),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'csv': os.path.basename(args.csv),
+            'clients': args.clients,
+            'duration': args.duration,
+            'mix': weights,
+            'chain_length': args.chain_length,
+            'server_mode': args.server_mode,
+            'concurrency': args.concurrency,
+            'seed': args.seed,
+        },
+        'total': latency_summary([value for kind in kinds for value in results[kind]], elapsed),
+        'by_kind': {kind: latency_summary(results[kind], elapsed) for kind in kinds},
+        'failures': failures,
+    }
+
+    print(f"Load: {args.clients} clients for {args.duration:g} s on {len(workloads)} instruments "
+          f"from {os.path.basename(args.csv)} ({args.server_mode} server)")
+    for name, summary in [('total', report['total'])] + list(report['by_kind'].items()):
+        print(f"  {name:6} {summary['messages']:9,} msgs {summary['throughput']:12,.0f} msg/s   "
+              f"p50 {summary['p50_us'] or 0:9.1f} us  p99 {summary['p99_us'] or 0:9.1f} us  "
+              f"p999 {summary['p999_us'] or 0:9.1f} us")
+    for failure in failures[:10]:
+        print(f"  FAILED {failure}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json}")
+    if failures:
+        sys.exit(1)
+
+
+def bench_block(args):
+    """Latency of a large data query in ASCII and as REAL,32/REAL,64 binary blocks"""
+    rng = random.Random(1)
+    values = ','.join(f'{rng.uniform(-1, 1):.9f}' for _ in range(2 * args.points))
+    instrument = make_instrument()
+    instrument.add_command('CALC:DATA? SDATA', 'block:' + values)
+    manager = emulator.SCPIEmulatorManager(server_mode=args.server_mode)
+    server = start_server(instrument, manager)
+
+    print(f"CALC:DATA? SDATA, {args.points} complex points ({args.server_mode} server, "
+          f"{args.iterations} queries each)")
+    try:
+        with socket.create_connection(('127.0.0.1', server.port)) as sock:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            for data_format in ('ASC', 'REAL,32', 'REAL,64'):
+                sock.sendall(f'FORM:DATA {data_format}\n'.encode('ascii'))
+                latencies = []
+                for _ in range(args.iterations):
+                    start = time.perf_counter()
+                    sock.sendall(b'CALC:DATA? SDATA\n')
+                    size = read_block_reply(sock, 10.0)
+                    latencies.append(time.perf_counter() - start)
+                print(f"  {data_format:8} {size:>10,} bytes   {format_latency(latencies)}")
+    finally:
+        server.stop()
+        manager.stop_all_servers()
+
+
+def bench_trace(args):
+    """Cost of a generated S-parameter trace query: first generation versus repeats"""
+    instrument = emulator.SCPIInstrument('Trace Bench', 'trace_bench')
+    instrument.add_command('SENS1:SWE:POIN (.+)', 'OK')
+    instrument.add_command('SENS1:SWE:POIN?', '201')
+    instrument.add_command('CALC1:DATA? SDAT', 'trace:sparam')
+    instrument.link_stateful_commands()
+    backend = 'NumPy' if emulator.load_numpy() is not None else 'pure Python'
+
+    print(f"CALC1:DATA? SDAT, generated with {backend} ({args.repeats} repeats each)")
+    for points in [int(p) for p in args.points.split(',')]:
+        for data_format in ('ASC', 'REAL,64'):
+            emulator.generate_trace.cache_clear()
+            instrument.process_command(f'SENS1:SWE:POIN {points};FORM:DATA {data_format}')
+            start = time.perf_counter()
+            instrument.process_command('CALC1:DATA? SDAT')
+            first = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(args.repeats):
+                instrument.process_command('CALC1:DATA? SDAT')
+            repeat = (time.perf_counter() - start) / args.repeats
+            print(f"  {points:>7} points {data_format:8} first {first * 1e3:9.2f} ms   "
+                  f"repeat {repeat * 1e6:8.1f} us")
+
+
+def bench_cache(args):
+    """Exact-query rate with cached, pre-encoded replies versus running every handler"""
+    manager = emulator.SCPIEmulatorManager()
+    if not manager.load_from_file(args.csv):
+        raise SystemExit(f"Could not load {args.csv}")
+    workloads = [Workload(data['instrument']) for data in manager.instruments.values()]
+    commands = [(w.instrument, query) for w in workloads for query in w.queries]
+
+    def uncached(instrument, command):
+        response = instrument.process_command(command)
+        return response, emulator.encode_response(response)
+
+    rates = {}
+    for name, execute in (('handler + encode', uncached), ('reply cache', None)):
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            for instrument, command in commands:
+                if execute is None:
+                    instrument.execute(command)
+                else:
+                    execute(instrument, command)
+        rates[name] = len(commands) * args.rounds / (time.perf_counter() - start)
+
+    print(f"Exact queries on {args.csv} ({len(commands)} queries x {args.rounds} rounds)")
+    baseline = rates['handler + encode']
+    for name, rate in rates.items():
+        print(f"  {name:17} {rate:12,.0f} queries/s  ({rate / baseline:.2f}x)")
+
+
+def free_ports(count):
+    """Local ports that were free a moment ago"""
+    sockets = [socket.socket() for _ in range(count)]
+    try:
+        for sock in sockets:
+            sock.bind(('127.0.0.1', 0))
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
+def wait_for_ports(ports, timeout=60):
+    deadline = time.perf_counter() + timeout
+    for port in ports:
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if time.perf_counter() > deadline:
+                    raise RuntimeError(f"Port {port} did not open within {timeout}s")
+                time.sleep(0.1)
+
+
+def drive_port(port, duration, batch):
+    """Pipelined set/query pairs against one port for duration seconds; returns commands sent"""
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    payload = b''.join(f'VOLT {i % 10};VOLT?\n'.encode() for i in range(batch))
+    commands = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        sock.sendall(payload)
+        replies = 0
+        while replies < batch:
+            data = sock.recv(65536)
+            if not data:
+                raise RuntimeError(f"Port {port} closed the connection")
+            replies += data.count(b'\n')
+        commands += 2 * batch
+    sock.close()
+    return commands
+
+
+def serve_and_drive(csv_path, server_args, ports, duration, batch):
+    """Run the emulator as a script and drive it with one client process per entry of ports
+    
+    Returns the aggregate command rate.
+    """
+    server = subprocess.Popen(
+        [sys.executable, EMULATOR_PATH, '--load', csv_path, '--start', '--host', '127.0.0.1', '--no-metrics',
+         *server_args],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=os.path.dirname(csv_path))
+    try:
+        wait_for_ports(set(ports))
+        with multiprocessing.Pool(len(ports)) as pool:
+            start = time.perf_counter()
+            counts = pool.starmap(drive_port, [(port, duration, batch) for port in ports])
+            elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return sum(counts) / elapsed
+
+
+def write_psu_csv(path, ports, extra_header='', extra_value=''):
+    with open(path, 'w', newline='') as f:
+        f.write(f'Equipment,Port,Command,Response,Validation{extra_header}\n')
+        for i, port in enumerate(ports):
+            f.write(f'Bench PSU {i},{port},VOLT (.+),OK,"range:0,10"{extra_value}\n,,VOLT?,5.0,\n')
+
+
+def bench_workers(args):
+    """Aggregate command rate over many instruments: one process versus --workers processes"""
+    with tempfile.TemporaryDirectory() as directory:
+        ports = free_ports(args.instruments)
+        csv_path = os.path.join(directory, 'workers.csv')
+        write_psu_csv(csv_path, ports)
+
+        print(f"{args.instruments} instruments, one client process each, "
+              f"{args.batch} pipelined VOLT x;VOLT? per write, {args.duration}s")
+        baseline = None
+        for workers in sorted({1, args.workers}):
+            rate = serve_and_drive(csv_path, ['--workers', str(workers)], ports, args.duration, args.batch)
+            baseline = baseline or rate
+            print(f"  --workers {workers:<3} {rate:12,.0f} commands/s  ({rate / baseline:.2f}x)")
+
+
+def bench_reuseport(args):
+    """Many clients on one instrument: one process versus --replicas processes on a shared port"""
+    with tempfile.TemporaryDirectory() as directory:
+        ports = free_ports(1)
+        csv_path = os.path.join(directory, 'reuseport.csv')
+        write_psu_csv(csv_path, ports)
+
+        print(f"One instrument, {args.clients} client processes, "
+              f"{args.batch} pipelined VOLT x;VOLT? per write, {args.duration}s")
+        baseline = None
+        for replicas in sorted({1, args.replicas}):
+            # Replicated instruments keep state per connection; compare like with like
+            server_args = ['--replicas', str(replicas), '--concurrency', 'session']
+            rate = serve_and_drive(csv_path, server_args, ports * args.clients, args.duration, args.batch)
+            baseline = baseline or rate
+            print(f"  --replicas {replicas:<3} {rate:12,.0f} commands/s  ({rate / baseline:.2f}x)")
+
+
+def write_rack_csv(path, rows, instruments):
+    """Synthetic configuration: instruments with set/query pairs, validated sets and plain queries"""
+    rng = random.Random(1)
+    per_instrument = max(rows // instruments, 1)
+    with open(path, 'w', newline='') as f:
+        f.write('Equipment,Port,Command,Response,Validation\n')
+        for i in range(instruments):
+            f.write(f'Rack Instrument {i},{20000 + i},*TST?,0,\n')
+            for j in range(1, per_instrument):
+                kind = j % 4
+                if kind == 0:
+                    f.write(f',,SOUR{j}:VOLT (.+),OK,"range:0,{j}"\n')
+                elif kind == 1:
+                    f.write(f',,SOUR{j - 1}:VOLT?,1.0,\n')
+                elif kind == 2:
+                    f.write(f',,MEAS{j}:CURR?,{rng.random():.6E},\n')
+                else:
+                    f.write(f',,CONF{j}:MODE (.+),OK,enum:AUTO,MAN\n')
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where unknown"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def bench_startup(args):
+    """Time to load a synthetic configuration of --rows rows, and the row reader on its own"""
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, 'rack.csv')
+        start = time.perf_counter()
+        write_rack_csv(csv_path, args.rows, args.instruments)
+        print(f"{args.rows:,} rows for {args.instruments} instruments "
+              f"({os.path.getsize(csv_path) / 1e6:.0f} MB, written in {time.perf_counter() - start:.1f}s)")
+
+        rss_before = peak_rss_mb()
+        manager = emulator.SCPIEmulatorManager()
+        start = time.perf_counter()
+        if not manager.load_from_file(csv_path):
+            raise SystemExit(f"Could not load {csv_path}")
+        elapsed = time.perf_counter() - start
+        rss_after = peak_rss_mb()
+        memory = f", peak RSS +{rss_after - rss_before:.0f} MB" if rss_before is not None else ''
+        print(f"  load_from_file      {elapsed:7.2f}s  ({args.rows / elapsed:,.0f} rows/s{memory})")
+        del manager
+
+        start = time.perf_counter()
+        for _ in emulator.ExcelReader.iter_csv_rows(csv_path):
+            pass
+        print(f"  iter_csv_rows       {time.perf_counter() - start:7.2f}s  (streamed lists)")
+        start = time.perf_counter()
+        emulator.ExcelReader.read_csv(csv_path)
+        print(f"  read_csv            {time.perf_counter() - start:7.2f}s  (list of stripped dicts)")
+
+
+def write_rack_xlsx(csv_path, xlsx_path):
+    """The CSV written by write_rack_csv as an Excel sheet (needs openpyxl)"""
+    import csv
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    with open(csv_path, newline='') as f:
+        for row in csv.reader(f):
+            sheet.append(row)
+    workbook.save(xlsx_path)
+
+
+def bench_snapshot(args):
+    """Load time from the source file versus from its compiled snapshot, for CSV and (with openpyxl) Excel"""
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, 'rack.csv')
+        write_rack_csv(csv_path, args.rows, args.instruments)
+        sources = [csv_path]
+        try:
+            xlsx_path = os.path.join(directory, 'rack.xlsx')
+            write_rack_xlsx(csv_path, xlsx_path)
+            sources.append(xlsx_path)
+        except ImportError:
+            print("openpyxl not installed: timing CSV only")
+        print(f"{args.rows:,} rows for {args.instruments} instruments")
+
+        snapshot = emulator.DefinitionSnapshot
+
+        def read_rows(rows):
+            # With the collector paused, as load_from_file reads them
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                for _ in rows:
+                    pass
+                return time.perf_counter() - start
+            finally:
+                gc.enable()
+
+        def load(source):
+            gc.collect()
+            start = time.perf_counter()
+            if not emulator.SCPIEmulatorManager().load_from_file(source):
+                raise SystemExit(f"Could not load {source}")
+            return time.perf_counter() - start
+
+        for source in sources:
+            name = os.path.basename(source)
+            parsed = load(source)
+            source_rows = read_rows(snapshot.iter_source_definitions(source))
+
+            start = time.perf_counter()
+            snapshot_path = snapshot.compile(source)
+            compiled = time.perf_counter() - start
+
+            loaded = load(source)
+            snapshot_rows = read_rows(snapshot.open_definitions(source))
+
+            print(f"  {name} ({os.path.getsize(source) / 1e6:.1f} MB, "
+                  f"snapshot {os.path.getsize(snapshot_path) / 1e6:.1f} MB, compiled in {compiled:.2f}s)")
+            print(f"    load_from_file  source {parsed:7.2f}s  snapshot {loaded:7.2f}s  ({parsed / loaded:.1f}x)")
+            print(f"    reading only    source {source_rows:7.2f}s  snapshot {snapshot_rows:7.2f}s  "
+                  f"({source_rows / snapshot_rows:.1f}x)")
+
+
+def bench_reload(args):
+    """Hot reload time, and how long a caller of the edited instrument and of another one waits meanwhile"""
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, 'rack.csv')
+        write_rack_csv(csv_path, args.rows, args.instruments)
+        manager = emulator.SCPIEmulatorManager()
+        start = time.perf_counter()
+        if not manager.load_from_file(csv_path):
+            raise SystemExit(f"Could not load {csv_path}")
+        print(f"{args.rows:,} rows for {args.instruments} instruments, loaded in {time.perf_counter() - start:.2f}s")
+
+        edited, other = [manager.instruments[inst_id]['instrument'] for inst_id in list(manager.instruments)[:2]]
+        with open(csv_path) as f:
+            lines = f.readlines()
+
+        def caller(instrument, stop, worst):
+            # A client sending a command every millisecond
+            while not stop.wait(0.001):
+                start = time.perf_counter()
+                instrument.process_command('*TST?')
+                worst[0] = max(worst[0], time.perf_counter() - start)
+
+        for label, line in (('unchanged', None), ('one row edited', ',,EXTRA:CMD?,1,\n')):
+            if line is not None:
+                lines[2] = line
+                with open(csv_path, 'w') as f:
+                    f.writelines(lines)
+            stop = threading.Event()
+            worst = {edited: [0.0], other: [0.0]}
+            callers = [threading.Thread(target=caller, args=(instrument, stop, worst[instrument]))
+                       for instrument in (edited, other)]
+            for thread in callers:
+                thread.start()
+            time.sleep(0.1)
+            summary = manager.reload_from_file(csv_path)
+            stop.set()
+            for thread in callers:
+                thread.join()
+            print(f"  {label:<15} reload {summary['seconds'] * 1000:8.1f} ms  ({len(summary['changed'])} changed); "
+                  f"longest command: edited instrument {worst[edited][0] * 1000:.1f} ms, "
+                  f"other {worst[other][0] * 1000:.1f} ms")
+
+
+def bench_lifecycle(args):
+    """Time to bring --instruments servers up and down one by one versus through the manager, and to restart one
+    
+    Stopping is timed with idle clients and, in thread mode, with clients
+    that keep sending a command running for --drain-ms (a SLOW? handler that
+    sleeps), so every server has one to drain. Async servers run commands on
+    the event loop itself, one at a time, so that case is not timed for them.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, 'rack.csv')
+        ports = free_ports(args.instruments)
+        write_psu_csv(csv_path, ports)
+        manager = emulator.SCPIEmulatorManager(server_mode=args.server_mode)
+        if not manager.load_from_file(csv_path):
+            raise SystemExit(f"Could not load {csv_path}")
+        for data in manager.instruments.values():
+            data['instrument'].commands['SLOW?'] = lambda: time.sleep(args.drain_ms / 1000) or '1'
+        manager.host = '127.0.0.1'
+        if manager.event_loop is not None:
+            manager.event_loop.start()
+        print(f"{args.instruments} instruments, --server-mode {args.server_mode}")
+
+        def busy_client(client):
+            try:
+                while client.sendall(b'SLOW?\n') is None and client.recv(64):
+                    pass
+            except OSError:
+                pass
+
+        for label in ('one by one', 'manager'):
+            for draining in (False, True) if args.server_mode == 'thread' else (False,):
+                start = time.perf_counter()
+                if label == 'manager':
+                    manager.start_all_servers('127.0.0.1')
+                else:
+                    for inst_id in manager.instruments:
+                        manager._start_server(inst_id)
+                started = time.perf_counter() - start
+                wait_for_ports(ports)
+
+                # Clients on every port, so stopping has connections to drain
+                clients = [socket.create_connection(('127.0.0.1', port)) for port in ports]
+                busy = [threading.Thread(target=busy_client, args=(client,), daemon=True)
+                        for client in clients if draining]
+                for thread in busy:
+                    thread.start()
+                time.sleep(0.05 if draining else 0)
+                start = time.perf_counter()
+                if label == 'manager':
+                    manager.stop_all_servers()
+                else:
+                    for server in list(manager.servers.values()):
+                        server.stop()
+                    manager.servers.clear()
+                stopped = time.perf_counter() - start
+                for client in clients:
+                    client.close()
+                for thread in busy:
+                    thread.join()
+                if draining:
+                    print(f"  {label:<10}  stop, clients busy with {args.drain_ms:g} ms commands "
+                          f"{stopped * 1000:8.1f} ms")
+                else:
+                    print(f"  {label:<10}  start {started * 1000:8.1f} ms   stop {stopped * 1000:8.1f} ms")
+
+        manager.start_all_servers('127.0.0.1')
+        wait_for_ports(ports)
+        client = socket.create_connection(('127.0.0.1', ports[0]))
+        inst_id = next(iter(manager.instruments))
+        times = []
+        for _ in range(args.restarts):
+            start = time.perf_counter()
+            if not manager.restart_server(inst_id):
+                raise SystemExit(f"Restarting {inst_id} failed")
+            client.close()
+            client = socket.create_connection(('127.0.0.1', ports[0]))
+            client.sendall(b'VOLT?\n')
+            client.recv(64)
+            times.append(time.perf_counter() - start)
+        client.close()
+        manager.stop_all_servers()
+        print(f"  restart one instrument, back to its first reply: median {statistics.median(times) * 1000:.1f} ms, "
+              f"max {max(times) * 1000:.1f} ms over {args.restarts} restarts")
+
+
+IMPORT_PROBE = """
+import importlib.util, sys, time
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('scpi_emulator', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+elapsed = time.perf_counter() - start
+print(elapsed, ','.join(name for name in sys.argv[2:] if name in sys.modules) or '-')
+"""
+
+# Imported only by the dashboard, async mode, --workers and parallel start/stop
+LAZY_IMPORTS = ('flask', 'flask_socketio', 'asyncio', 'multiprocessing', 'concurrent.futures')
+
+
+def median_run(command, repeats, cwd):
+    """Median wall time in seconds of running command to completion"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def bench_importtime(args):
+    """Cold start of headless command lines, and the module import on its own
+    
+    Fails when the import pulls in one of LAZY_IMPORTS or takes longer than --budget-ms.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        imports = []
+        for _ in range(args.repeats):
+            output = subprocess.run([sys.executable, '-c', IMPORT_PROBE, EMULATOR_PATH] + list(LAZY_IMPORTS),
+                                    cwd=directory, capture_output=True, text=True, check=True).stdout.split()
+            imports.append(float(output[0]))
+            if output[1] != '-':
+                raise SystemExit(f"Importing the emulator imported {output[1]}")
+        import_ms = statistics.median(imports) * 1000
+        print(f"module import               {import_ms:7.1f} ms  (none of {', '.join(LAZY_IMPORTS)} imported)")
+
+        csv_path = os.path.join(directory, 'bench.csv')
+        write_psu_csv(csv_path, free_ports(3))
+        baseline = median_run([sys.executable, '-c', 'pass'], args.repeats, directory)
+        print(f"python -c pass              {baseline * 1000:7.1f} ms")
+        for label, arguments in (('--help', ['--help']),
+                                 ('--create-example', ['--create-example']),
+                                 ('--load bench.csv', ['--load', csv_path])):
+            elapsed = median_run([sys.executable, EMULATOR_PATH] + arguments, args.repeats, directory)
+            print(f"{label:<27} {elapsed * 1000:7.1f} ms  (+{(elapsed - baseline) * 1000:.1f} ms over the interpreter)")
+
+        if import_ms > args.budget_ms:
+            raise SystemExit(f"Module import took {import_ms:.1f} ms, over the {args.budget_ms:g} ms budget")
+
+
+def long_form(header):
+    """The header with every node that has a known long form spelled out"""
+    trie = emulator.MnemonicTrie
+    nodes = []
+    parent = ''
+    for node in header.rstrip('?').split(':'):
+        mnemonic = node.rstrip('0123456789')
+        long_form = trie.LONG_FORMS.get(mnemonic) or trie.CONTEXT_LONG_FORMS.get((parent, mnemonic), mnemonic)
+        nodes.append(long_form + node[len(mnemonic):])
+        parent = mnemonic
+    return ':'.join(nodes) + ('?' if header.endswith('?') else '')
+
+
+def bench_mnemonic(args):
+    """Dispatch rate of headers as written in the CSV versus their long forms"""
+    start = time.perf_counter()
+    manager = emulator.SCPIEmulatorManager()
+    if not manager.load_from_file(args.csv):
+        raise SystemExit(f"Could not load {args.csv}")
+    load_time = time.perf_counter() - start
+    workloads = [Workload(data['instrument']) for data in manager.instruments.values()]
+    written = [(w.instrument, query) for w in workloads for query in w.queries]
+    spelled_out = [(instrument, long_form(query)) for instrument, query in written]
+    spelled_out = [(instrument, query) for instrument, query in spelled_out if query not in instrument.commands]
+
+    print(f"Queries on {args.csv} ({len(written)} as written, {len(spelled_out)} with long forms, "
+          f"{args.rounds} rounds; loaded in {load_time * 1000:.1f} ms)")
+    for name, commands in (('as written', written), ('long forms', spelled_out)):
+        if not commands:
+            continue
+        unmatched = sum(1 for instrument, command in commands if not instrument._process_single_command(command))
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            for instrument, command in commands:
+                instrument._process_single_command(command)
+        rate = len(commands) * args.rounds / (time.perf_counter() - start)
+        print(f"  {name:11} {rate:12,.0f} queries/s  ({unmatched} without a reply)")
+    check_mnemonics(manager)
+
+
+# Long forms that must reach a command, and mistaken ones that must not
+MNEMONIC_CHECKS = (
+    ('TRIGGER:DELAY 7', 'TRIG:DEL?', '7'),
+    ('TRIGGER:DELETE 9', 'TRIG:DEL?', '7'),
+)
+
+
+def check_mnemonics(manager):
+    """Check that ambiguous short forms resolve by context and that headers keep their keys"""
+    instrument = emulator.SCPIInstrument('check', 'Check')
+    instrument.add_command('CH[12]:SCAL (.+)', 'OK')
+    instrument.add_command('SENSe1:SWEep:POINts (.+)', 'OK')
+    instrument.add_command('SENSe1:SWEep:POINts?', '201')
+    instrument.link_stateful_commands()
+    for command, expected in (('CH1:SCAL 5', 'OK'), ('CH2:SCAL 5', 'OK'), ('SENSE:SWEEP:POINTS 11', 'OK'),
+                              ('SENS1:SWE:POIN?', '11')):
+        reply = instrument.process_command(command)
+        if reply != expected:
+            raise SystemExit(f"{command} gave {reply!r}, not {expected!r}")
+    if 'SENS1:SWE:POIN_VALUE' not in instrument.state:
+        raise SystemExit(f"Mixed-case header stored under {sorted(instrument.state)}, not SENS1:SWE:POIN")
+    
+    for data in manager.instruments.values():
+        instrument = data['instrument']
+        if instrument._mnemonic_trie().match('TRIG:DEL?') is None:
+            continue
+        for command, query, expected in MNEMONIC_CHECKS:
+            instrument.process_command(command)
+            reply = instrument.process_command(query)
+            if reply != expected:
+                raise SystemExit(f"{instrument.name}: {command} then {query} gave {reply!r}, not {expected!r}")
+        instrument.process_command('*CLS')
+        print(f"  {instrument.name}: TRIGGER:DELAY resolves to TRIG:DEL, TRIGGER:DELETE does not")
+
+
+def legacy_process_chain(instrument, message):
+    """The 2.3 chain handling: str.split on every ';', every unit from the root"""
+    responses = []
+    for command in message.split(';'):
+        response = instrument._process_single_command(command.strip())
+        if response:
+            responses.append(response)
+    return ';'.join(responses)
+
+
+def chain_rate(process, instrument, message, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        process(instrument, message)
+    return rounds / (time.perf_counter() - start)
+
+
+def bench_parser(args):
+    """Long compound messages: splitting and processing versus the 2.3 str.split loop"""
+    instrument = emulator.SCPIInstrument('Parser Bench', 'parser_bench', error_queue_depth=1 << 20)
+    for name in ('STAR', 'STOP', 'CENT', 'SPAN'):
+        instrument.add_command(f'SENS1:FREQ:{name} (.+)', 'OK')
+        instrument.add_command(f'SENS1:FREQ:{name}?', '1E9')
+    instrument.add_command('MMEM:LOAD (.+)', 'OK')
+    instrument.link_stateful_commands()
+
+    units = args.units
+    names = ['STAR', 'STOP', 'CENT', 'SPAN'] * units
+    absolute = ';'.join(f'SENS1:FREQ:{names[i]} {i}E6' for i in range(units))
+    relative = 'SENS1:FREQ:' + ';'.join(f'{names[i]} {i}E6' for i in range(units))
+    quoted = ';'.join(f'MMEM:LOAD "trace;{i}.csv"' for i in range(units))
+
+    def process(instrument, message):
+        return instrument._process_command(message)
+
+    print(f"Compound messages of {units} units ({args.rounds} messages each)")
+    for label, message in (('absolute headers', absolute), ('quoted strings', quoted)):
+        split_rate = chain_rate(lambda _, m: m.split(';'), None, message, args.rounds)
+        parse_rate = chain_rate(lambda _, m: emulator.split_program_message(m), None, message, args.rounds)
+        legacy = chain_rate(legacy_process_chain, instrument, message, args.rounds)
+        current = chain_rate(process, instrument, message, args.rounds)
+        print(f"  {label}:")
+        print(f"    split    str.split {split_rate * units:12,.0f} units/s   "
+              f"parser {parse_rate * units:12,.0f} units/s")
+        print(f"    process  2.3 loop  {legacy * units:12,.0f} units/s   "
+              f"parser {current * units:12,.0f} units/s")
+
+    for label, process_message in (('2.3 loop', legacy_process_chain), ('parser', process)):
+        instrument.error_queue.clear()
+        process_message(instrument, relative)
+        process_message(instrument, quoted)
+        print(f"  errors from relative headers and quoted ';' with the {label}: {len(instrument.error_queue)}")
+
+
+def bench_metrics(args):
+    """In-process command rate with stage latency recording on and off"""
+    rates = {}
+    for metrics in (False, True):
+        manager = emulator.SCPIEmulatorManager(metrics=metrics)
+        if not manager.load_from_file(args.csv):
+            raise SystemExit(f"Could not load {args.csv}")
+        workloads = [Workload(data['instrument']) for data in manager.instruments.values()]
+        commands = [(w.instrument, command) for w in workloads for command in w.queries + w.sets]
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            for instrument, command in commands:
+                instrument.process_command(command)
+        rates[metrics] = len(commands) * args.rounds / (time.perf_counter() - start)
+
+    print(f"Command rate on {args.csv} ({len(commands)} commands x {args.rounds} rounds)")
+    print(f"  metrics off: {rates[False]:12,.0f} commands/s")
+    print(f"  metrics on:  {rates[True]:12,.0f} commands/s  "
+          f"({(1 / rates[True] - 1 / rates[False]) * 1e9:+.0f} ns per command)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SCPI Equipment Emulator benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    framing = subparsers.add_parser('framing', help='Reply latency per framing policy')
+    framing.add_argument('--iterations', type=int, default=20, help='Queries per policy (default: 20)')
+    framing.add_argument('--server-mode', choices=['thread', 'async'], default='thread')
+    framing.add_argument('--eoi-timeout-us', type=int, default=emulator.FramingPolicy.DEFAULT_EOI_TIMEOUT_US,
+                         help='Idle timeout for the eoi policy (default: 300000)')
+    framing.set_defaults(func=bench_framing)
+
+    burst = subparsers.add_parser('burst', help='Framing cost per command as a pipelined burst grows')
+    burst.add_argument('--sizes', default='100,1000,10000,100000', help='Comma separated burst sizes in commands')
+    burst.add_argument('--chunk-size', type=int, default=1 << 20, help='Bytes per simulated read (default: 1 MiB)')
+    burst.add_argument('--legacy-limit', type=int, default=20000,
+                       help='Largest burst also run through the quadratic 2.3 loop (default: 20000)')
+    burst.set_defaults(func=bench_burst)
+
+    validation = subparsers.add_parser('validation', help='Set-command rate before/after compiled validation')
+    validation.add_argument('--csv', default=os.path.join(BASE_DIR, 'detailed_instruments.csv'),
+                            help='Instrument definitions to load (default: detailed_instruments.csv)')
+    validation.add_argument('--rounds', type=int, default=2000, help='Passes over all set commands (default: 2000)')
+    validation.set_defaults(func=bench_validation)
+
+    stress = subparsers.add_parser('stress', help='Many clients on one instrument: throughput and consistency')
+    stress.add_argument('--clients', type=int, default=32, help='Concurrent client connections (default: 32)')
+    stress.add_argument('--iterations', type=int, default=500, help='Messages per client (default: 500)')
+    stress.add_argument('--concurrency', choices=emulator.SCPIInstrument.CONCURRENCY_MODES, default='lock')
+    stress.add_argument('--server-mode', choices=['thread', 'async'], default='thread')
+    stress.set_defaults(func=bench_stress)
+
+    connect = subparsers.add_parser('connect', help='Connect-to-first-reply latency')
+    connect.add_argument('--csv', default=os.path.join(BASE_DIR, 'pna-commands.csv'),
+                         help='Instrument definitions to load (default: pna-commands.csv)')
+    connect.add_argument('--connections', type=int, default=200, help='Connections to open (default: 200)')
+    connect.add_argument('--server-mode', choices=['thread', 'async'], default='thread')
+    connect.set_defaults(func=bench_connect)
+
+    load = subparsers.add_parser('load', help='Concurrent load: throughput and p50/p99/p999 latency')
+    load.add_argument('--csv', default=os.path.join(BASE_DIR, 'pna-commands.csv'),
+                      help='Instrument definitions to load (default: pna-commands.csv)')
+    load.add_argument('--clients', type=int, default=8, help='Concurrent client connections (default: 8)')
+    load.add_argument('--duration', type=float, default=5.0, help='Seconds to run (default: 5)')
+    load.add_argument('--mix', default='exact=60,set=30,chain=10',
+                      help='Relative weights of exact queries, parameterized sets and chained messages')
+    load.add_argument('--chain-length', type=int, default=3, help='Commands per chained message (default: 3)')
+    load.add_argument('--server-mode', choices=['thread', 'async'], default='thread')
+    load.add_argument('--concurrency', choices=emulator.SCPIInstrument.CONCURRENCY_MODES, default='lock')
+    load.add_argument('--seed', type=int, default=1, help='Random seed for the command mix (default: 1)')
+    load.add_argument('--json', help='Write the results to this JSON file')
+    load.set_defaults(func=bench_load)
+
+    block = subparsers.add_parser('block', help='Large data query as ASCII versus binary blocks')
+    block.add_argument('--points', type=int, default=100001, help='Complex points per trace (default: 100001)')
+    block.add_argument('--iterations', type=int, default=20, help='Queries per format (default: 20)')
+    block.add_argument('--server-mode', choices=['thread', 'async'], default='thread')
+    block.set_defaults(func=bench_block)
+
+    trace = subparsers.add_parser('trace', help='Generated trace queries: first generation versus cached repeats')
+    trace.add_argument('--points', default='201,10001,100001', help='Comma separated sweep point counts')
+    trace.add_argument('--repeats', type=int, default=1000, help='Repeated queries per size (default: 1000)')
+    trace.set_defaults(func=bench_trace)
+
+    cache = subparsers.add_parser('cache', help='Exact-query rate with and without the reply cache')
+    cache.add_argument('--csv', default=os.path.join(BASE_DIR, 'pna-commands.csv'),
+                       help='Instrument definitions to load (default: pna-commands.csv)')
+    cache.add_argument('--rounds', type=int, default=500, help='Passes over all queries (default: 500)')
+    cache.set_defaults(func=bench_cache)
+
+    workers = subparsers.add_parser('workers', help='Aggregate rate with instruments sharded across processes')
+    workers.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                         help='Worker processes to compare with one process (default: CPU count)')
+    workers.add_argument('--instruments', type=int, default=8, help='Instruments, one client each (default: 8)')
+    workers.add_argument('--batch', type=int, default=50, help='Pipelined command pairs per write (default: 50)')
+    workers.add_argument('--duration', type=float, default=5.0, help='Seconds per measurement (default: 5)')
+    workers.set_defaults(func=bench_workers)
+
+    reuseport = subparsers.add_parser('reuseport', help='One instrument served by SO_REUSEPORT replicas')
+    reuseport.add_argument('--replicas', type=int, default=os.cpu_count() or 2,
+                           help='Replica processes to compare with one process (default: CPU count)')
+    reuseport.add_argument('--clients', type=int, default=16, help='Client processes (default: 16)')
+    reuseport.add_argument('--batch', type=int, default=50, help='Pipelined command pairs per write (default: 50)')
+    reuseport.add_argument('--duration', type=float, default=5.0, help='Seconds per measurement (default: 5)')
+    reuseport.set_defaults(func=bench_reuseport)
+
+    startup = subparsers.add_parser('startup', help='Load time of a synthetic configuration')
+    startup.add_argument('--rows', type=int, default=1000000, help='Configuration rows (default: 1000000)')
+    startup.add_argument('--instruments', type=int, default=100, help='Instruments (default: 100)')
+    startup.set_defaults(func=bench_startup)
+
+    snapshot = subparsers.add_parser('snapshot', help='Load time from the source file versus its --compile snapshot')
+    snapshot.add_argument('--rows', type=int, default=200000, help='Configuration rows (default: 200000)')
+    snapshot.add_argument('--instruments', type=int, default=100, help='Instruments (default: 100)')
+    snapshot.set_defaults(func=bench_snapshot)
+
+    lifecycle = subparsers.add_parser('lifecycle', help='Start, stop and restart time of many instrument servers')
+    lifecycle.add_argument('--instruments', type=int, default=50, help='Instruments (default: 50)')
+    lifecycle.add_argument('--restarts', type=int, default=20, help='Restarts of one instrument (default: 20)')
+    lifecycle.add_argument('--drain-ms', type=float, default=20,
+                           help='Run time of the command each client has in flight when draining (default: 20)')
+    lifecycle.add_argument('--server-mode', choices=['thread', 'async'], default='thread')
+    lifecycle.set_defaults(func=bench_lifecycle)
+
+    reload = subparsers.add_parser('reload', help='Hot reload time and the stall it causes for clients')
+    reload.add_argument('--rows', type=int, default=100000, help='Configuration rows (default: 100000)')
+    reload.add_argument('--instruments', type=int, default=100, help='Instruments (default: 100)')
+    reload.set_defaults(func=bench_reload)
+
+    importtime = subparsers.add_parser('importtime', help='Headless cold-start time and module import time')
+    importtime.add_argument('--repeats', type=int, default=10, help='Runs per command line (default: 10)')
+    importtime.add_argument('--budget-ms', type=float, default=80.0,
+                            help='Exit with an error when the module import takes longer (default: 80)')
+    importtime.set_defaults(func=bench_importtime)
+
+    mnemonic = subparsers.add_parser('mnemonic', help='Dispatch rate of CSV headers versus their long forms')
+    mnemonic.add_argument('--csv', default=os.path.join(BASE_DIR, 'pna-commands.csv'),
+                          help='Instrument definitions to load (default: pna-commands.csv)')
+    mnemonic.add_argument('--rounds', type=int, default=500, help='Passes over all queries (default: 500)')
+    mnemonic.set_defaults(func=bench_mnemonic)
+
+    parser_bench = subparsers.add_parser('parser', help='Compound message parsing versus str.split')
+    parser_bench.add_argument('--units', type=int, default=100, help='Units per compound message (default: 100)')
+    parser_bench.add_argument('--rounds', type=int, default=2000, help='Messages per measurement (default: 2000)')
+    parser_bench.set_defaults(func=bench_parser)
+
+    metrics = subparsers.add_parser('metrics', help='Cost of recording stage latency histograms')
+    metrics.add_argument('--csv', default=os.path.join(BASE_DIR, 'pna-commands.csv'),
+                         help='Instrument definitions to load (default: pna-commands.csv)')
+    metrics.add_argument('--rounds', type=int, default=200, help='Passes over all commands (default: 200)')
+    metrics.set_defaults(func=bench_metrics)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,8 +11,17 @@ New Features:
 - Configuration upload via web interface
 """
 
+from array import array
+import cmath
+import math
+import random
 import csv
+import gc
+import hashlib
+import marshal
+import mmap
 import socket
+import struct
 import threading
 import time
 import argparse
@@ -21,137 +30,461 @@ import re
 import logging
 import signal
 import json
+import queue
 from pathlib import Path
 from datetime import datetime
 import traceback
+import weakref
 from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
 import os
 
-# Flask imports
-try:
-    from flask import Flask, render_template, jsonify, request, send_from_directory
-    from flask_socketio import SocketIO, emit
-    HAS_FLASK = True
-except ImportError:
-    HAS_FLASK = False
-    print("Flask not installed. Web dashboard will be disabled.")
-    print("Install with: pip install flask flask-socketio")
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('scpi_emulator.log'),
-        logging.StreamHandler()
-    ]
-)
+# asyncio.BufferedProtocol, queue.SimpleQueue and time.perf_counter_ns
+if sys.version_info < (3, 7):
+    sys.exit("The SCPI emulator needs Python 3.7 or newer")
+
 logger = logging.getLogger(__name__)
 
+
+def configure_logging(verbose=False):
+    """Log to the console and scpi_emulator.log (called by main() and worker processes)"""
+    logging.basicConfig(
+        level=logging.DEBUG if verbose else logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('scpi_emulator.log', delay=True),
+            logging.StreamHandler()
+        ]
+    )
+
+
+class RateCounter:
+    """Events in a sliding window, counted in one-second buckets
+    
+    add() is O(1); count() looks at a fixed number of buckets.
+    """
+
+    __slots__ = ('window', 'seconds', 'counts')
+
+    def __init__(self, window=60):
+        self.window = window
+        self.seconds = [0] * window
+        self.counts = [0] * window
+
+    def add(self, timestamp):
+        second = int(timestamp)
+        slot = second % self.window
+        if self.seconds[slot] != second:
+            self.seconds[slot] = second
+            self.counts[slot] = 0
+        self.counts[slot] += 1
+
+    def count(self, timestamp):
+        oldest = int(timestamp) - self.window
+        return sum(count for second, count in zip(self.seconds, self.counts) if second > oldest)
+
+
+class CommandLogShard:
+    """Preallocated ring of recent commands for one instrument"""
+
+    __slots__ = ('lock', 'size', 'next', 'filled', 'timestamps', 'commands',
+                 'responses', 'errors', 'total', 'error_count', 'rate')
+
+    def __init__(self, size):
+        self.lock = threading.Lock()
+        self.size = size
+        self.next = 0
+        self.filled = 0
+        self.timestamps = [0.0] * size
+        self.commands = [None] * size
+        self.responses = [None] * size
+        self.errors = [None] * size
+        self.total = 0
+        self.error_count = 0
+        self.rate = RateCounter()
+
+    def record(self, timestamp, command, response, error):
+        slot = self.next
+        self.timestamps[slot] = timestamp
+        self.commands[slot] = command
+        self.responses[slot] = response
+        self.errors[slot] = error
+        self.next = (slot + 1) % self.size
+        if self.filled < self.size:
+            self.filled += 1
+        
+        self.total += 1
+        if error:
+            self.error_count += 1
+        self.rate.add(timestamp)
+
+    def recent(self, limit):
+        """Newest-last (timestamp, command, response, error) tuples"""
+        count = min(limit, self.filled)
+        slots = [(self.next - count + i) % self.size for i in range(count)]
+        return [(self.timestamps[i], self.commands[i], self.responses[i], self.errors[i]) for i in slots]
+
+
 class CommandLogger:
-    """Tracks commands and responses for web dashboard"""
+    """Tracks commands and responses for web dashboard
+    
+    Each instrument logs into its own shard and lock, so instruments never
+    contend with each other. Entries are stored raw; dicts and time strings
+    are only built when the dashboard asks for them.
+    """
     
     def __init__(self, max_entries=1000):
-        self.entries = deque(maxlen=max_entries)
-        self.stats = {
-            'total_commands': 0,
-            'commands_per_minute': 0,
-            'last_minute_commands': deque(maxlen=60),
-            'errors': 0,
-            'start_time': time.time()
-        }
-        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.start_time = time.time()
+        self.shards = {}
+        self.lock = threading.Lock()  # only guards shard creation
+    
+    def _shard(self, instrument_name):
+        shard = self.shards.get(instrument_name)
+        if shard is None:
+            with self.lock:
+                shard = self.shards.setdefault(instrument_name, CommandLogShard(self.max_entries))
+        return shard
+    
+    def log_command(self, instrument_name, command, response, error=None, timestamp=None):
+        """Log a command/response pair, at timestamp if it was executed elsewhere"""
+        if timestamp is None:
+            timestamp = time.time()
+        shard = self._shard(instrument_name)
+        with shard.lock:
+            shard.record(timestamp, command, response, error)
     
-    def log_command(self, instrument_name, command, response, error=None):
-        """Log a command/response pair"""
-        timestamp = time.time()
+    def get_recent_entries(self, limit=50):
+        """Get recent command entries"""
+        entries = []
+        for instrument_name, shard in list(self.shards.items()):
+            with shard.lock:
+                recent = shard.recent(limit)
+            entries.extend((entry, instrument_name) for entry in recent)
         
+        entries.sort(key=lambda item: item[0][0])
+        return [{
+            'timestamp': timestamp,
+            'time_str': datetime.fromtimestamp(timestamp).strftime('%H:%M:%S'),
+            'instrument': instrument_name,
+            'command': command,
+            'response': response,
+            'error': error,
+            'is_error': error is not None
+        } for (timestamp, command, response, error), instrument_name in entries[-limit:]]
+    
+    def get_stats(self):
+        """Get system statistics"""
+        now = time.time()
+        total_commands = errors = commands_per_minute = 0
+        for shard in list(self.shards.values()):
+            with shard.lock:
+                total_commands += shard.total
+                errors += shard.error_count
+                commands_per_minute += shard.rate.count(now)
+        
+        uptime = now - self.start_time
+        return {
+            'total_commands': total_commands,
+            'commands_per_minute': commands_per_minute,
+            'errors': errors,
+            'uptime': round(uptime),
+            'uptime_str': str(datetime.fromtimestamp(uptime) - datetime.fromtimestamp(0)).split('.')[0]
+        }
+
+# Global command logger instance
+command_logger = CommandLogger()
+
+
+class DashboardEventQueue:
+    """Bounded hand-off of command events from the SCPI servers to the dashboard
+    
+    publish() runs on the instrument I/O path: it never waits for the
+    dashboard, only for a short lock that makes the size check, the append
+    and the drop count exact across client threads; when the queue is full
+    the event is dropped and counted. One publisher thread drains the queue
+    (popleft is atomic) every interval and sends the events as a single
+    'command_batch' emit.
+    """
+
+    def __init__(self, emit, maxsize=10000, interval=0.05, max_batch=500):
+        self.emit = emit
+        self.maxsize = maxsize
+        self.interval = interval
+        self.max_batch = max_batch
+        self.events = deque()
+        self.lock = threading.Lock()  # guards publishing into events and dropped
+        self.dropped = 0
+        self.published = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def publish(self, instrument_name, command, response, error=None):
+        """Queue a command event; returns False if it was dropped"""
+        event = (time.time(), instrument_name, command, response, error)
         with self.lock:
-            entry = {
+            if len(self.events) >= self.maxsize:
+                self.dropped += 1
+                return False
+            self.events.append(event)
+        return True
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='dashboard-events', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            while self._drain() == self.max_batch:
+                pass
+
+    def _drain(self):
+        """Emit up to max_batch queued events; returns how many were sent"""
+        batch = []
+        popleft = self.events.popleft
+        while len(batch) < self.max_batch:
+            try:
+                timestamp, instrument_name, command, response, error = popleft()
+            except IndexError:
+                break
+            batch.append({
                 'timestamp': timestamp,
                 'time_str': datetime.fromtimestamp(timestamp).strftime('%H:%M:%S'),
                 'instrument': instrument_name,
                 'command': command,
                 'response': response,
-                'error': error,
-                'is_error': error is not None
-            }
-            
-            self.entries.append(entry)
-            self.stats['total_commands'] += 1
-            
-            if error:
-                self.stats['errors'] += 1
-            
-            # Update commands per minute
-            current_minute = int(timestamp // 60)
-            self.stats['last_minute_commands'].append(current_minute)
-            
-            # Calculate commands per minute
-            if len(self.stats['last_minute_commands']) > 1:
-                minutes_span = max(1, len(set(self.stats['last_minute_commands'])))
-                self.stats['commands_per_minute'] = len(self.stats['last_minute_commands']) / minutes_span
+                'error': error
+            })
+        
+        if batch:
+            try:
+                self.emit('command_batch', {'events': batch, 'dropped': self.dropped})
+                self.published += len(batch)
+            except Exception as e:
+                logger.error(f"Failed to publish dashboard events: {e}")
+        return len(batch)
+
+    def get_stats(self):
+        return {
+            'queued': len(self.events),
+            'published': self.published,
+            'dropped': self.dropped
+        }
+
+class LatencyHistogram:
+    """Latency histogram with power-of-two nanosecond buckets
     
-    def get_recent_entries(self, limit=50):
-        """Get recent command entries"""
-        with self.lock:
-            return list(self.entries)[-limit:]
+    Bucket i counts the samples that take i bits, i.e. are below 2**i ns, so
+    observe() is one index and two additions on a list allocated up front.
+    Each histogram is written by one thread at a time (the caller holds a
+    lock or owns the histogram); readers may catch it mid-update, which is
+    fine for monitoring.
+    """
+
+    SIZE = 64
+
+    # Bucket bounds exported on /metrics: 2**10 ns (~1 us) to 2**30 ns (~1.07 s)
+    EXPORTED_BITS = range(10, 31)
+
+    __slots__ = ('counts', 'total_ns')
+
+    def __init__(self):
+        self.counts = [0] * self.SIZE
+        self.total_ns = 0
+
+    def observe(self, ns):
+        self.counts[ns.bit_length()] += 1
+        self.total_ns += ns
+
+    def merge(self, other):
+        """Add the samples of another histogram to this one"""
+        counts = self.counts
+        for i, n in enumerate(other.counts):
+            counts[i] += n
+        self.total_ns += other.total_ns
+
+
+class CommandMetrics:
+    """Latency histograms of one command header, one per processing stage
     
-    def get_stats(self):
-        """Get system statistics"""
+    dispatch - normalising the command text and finding the handler (exact,
+               header or free-form match), or the reply cache lookup
+    handler  - running the handler
+    """
+
+    STAGES = ('dispatch', 'handler')
+
+    __slots__ = STAGES
+
+    def __init__(self):
+        self.dispatch = LatencyHistogram()
+        self.handler = LatencyHistogram()
+
+
+class WriteMetrics:
+    """Socket write latency of one server, recorded per connection
+    
+    Each connection writes into its own histogram so connection threads never
+    share counters; closed connections are folded into a running total.
+    """
+
+    def __init__(self):
+        self.closed = LatencyHistogram()
+        self.open = []
+        self.lock = threading.Lock()
+
+    def connection_opened(self):
+        histogram = LatencyHistogram()
         with self.lock:
-            uptime = time.time() - self.stats['start_time']
-            return {
-                'total_commands': self.stats['total_commands'],
-                'commands_per_minute': round(self.stats['commands_per_minute'], 1),
-                'errors': self.stats['errors'],
-                'uptime': round(uptime),
-                'uptime_str': str(datetime.fromtimestamp(uptime) - datetime.fromtimestamp(0)).split('.')[0]
-            }
+            self.open.append(histogram)
+        return histogram
+
+    def connection_closed(self, histogram):
+        with self.lock:
+            if histogram in self.open:
+                self.open.remove(histogram)
+                self.closed.merge(histogram)
+
+    def snapshot(self):
+        """All write samples so far as one histogram"""
+        combined = LatencyHistogram()
+        with self.lock:
+            combined.merge(self.closed)
+            for histogram in self.open:
+                combined.merge(histogram)
+        return combined
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_histogram(lines, name, labels, histogram):
+    counts = list(histogram.counts)
+    bits = LatencyHistogram.EXPORTED_BITS
+    cumulative = sum(counts[:bits.start])
+    for i in bits:
+        cumulative += counts[i]
+        lines.append(f'{name}_bucket{{{labels},le="{(1 << i) / 1e9}"}} {cumulative}')
+    cumulative += sum(counts[bits.stop:])
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+    lines.append(f'{name}_sum{{{labels}}} {histogram.total_ns * 1e-9:.9f}')
+    lines.append(f'{name}_count{{{labels}}} {cumulative}')
+
+
+# Name, type and help text of each family served on /metrics, in output order
+METRIC_FAMILIES = (
+    ('scpi_command_stage_seconds', 'histogram', 'Time spent per command in each processing stage'),
+    ('scpi_socket_write_seconds', 'histogram', 'Time spent writing replies to client sockets'),
+    ('scpi_active_connections', 'gauge', 'Connected clients'),
+    ('scpi_queue_depth', 'gauge', 'Items waiting in an internal queue'),
+)
+
+
+def metric_samples(manager):
+    """Sample lines of each metric family, by family name"""
+    stage_lines = []
+    write_lines = []
+    connection_lines = []
+    queue_lines = []
+    
+    for inst_id, inst_data in list(manager.instruments.items()):
+        instrument = inst_data['instrument']
+        inst_label = f'instrument="{_escape_label(inst_id)}"'
+        if 'replica' in inst_data:
+            inst_label += f',replica="{inst_data["replica"]}"'
+        
+        if instrument.metrics is not None:
+            for header, metrics in list(instrument.metrics.items()):
+                for stage in CommandMetrics.STAGES:
+                    labels = f'{inst_label},header="{_escape_label(header)}",stage="{stage}"'
+                    _format_histogram(stage_lines, 'scpi_command_stage_seconds', labels, getattr(metrics, stage))
+        
+        server = manager.servers.get(inst_id)
+        if server is not None:
+            if server.write_metrics is not None:
+                _format_histogram(write_lines, 'scpi_socket_write_seconds', inst_label,
+                                  server.write_metrics.snapshot())
+            connection_lines.append(f'scpi_active_connections{{{inst_label}}} {len(server.clients)}')
+        
+        if instrument.actor is not None:
+            queue_lines.append(f'scpi_queue_depth{{{inst_label},queue="actor"}} {instrument.actor.depth}')
+    
+    dashboard = getattr(manager, 'web_dashboard', None)
+    if dashboard is not None and hasattr(dashboard, 'events'):
+        queue_lines.append(f'scpi_queue_depth{{queue="dashboard_events"}} {len(dashboard.events.events)}')
+    
+    return {
+        'scpi_command_stage_seconds': stage_lines,
+        'scpi_socket_write_seconds': write_lines,
+        'scpi_active_connections': connection_lines,
+        'scpi_queue_depth': queue_lines
+    }
+
+
+def render_metrics(samples):
+    """Metric samples (see metric_samples) in Prometheus text exposition format"""
+    lines = []
+    for name, kind, help_text in METRIC_FAMILIES:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples.get(name, ()))
+    return '\n'.join(lines) + '\n'
 
-# Global command logger instance
-command_logger = CommandLogger()
 
 class ExcelReader:
-    """Simple Excel reader using only standard library"""
+    """Simple Excel reader using only standard library
+    
+    iter_excel_rows() and iter_csv_rows() stream a file: they first yield the
+    tuple of stripped column names, then every row as a list of raw strings
+    padded to the number of columns, so callers resolve column indices once
+    and strip only the fields they use.
+    """
 
     @staticmethod
-    def read_excel_as_csv(excel_path):
-        """Convert Excel to CSV format and read it"""
+    def iter_excel_rows(excel_path):
+        """Column names, then rows of an Excel sheet (see class docstring)"""
+        try:
+            import openpyxl
+        except ImportError:
+            logger.error("openpyxl not available. Please convert Excel to CSV format.")
+            logger.info("To install openpyxl: pip install openpyxl")
+            return
+        
         try:
-            try:
-                import openpyxl
-            except ImportError:
-                logger.error("openpyxl not available. Please convert Excel to CSV format.")
-                logger.info("To install openpyxl: pip install openpyxl")
-                return []
-            
             workbook = openpyxl.load_workbook(excel_path, read_only=True)
-            worksheet = workbook.active
-            
-            headers = []
-            for cell in worksheet[1]:
-                headers.append(cell.value or '')
-            
-            data = []
-            for row in worksheet.iter_rows(min_row=2, values_only=True):
-                row_dict = {}
-                for i, value in enumerate(row):
-                    if i < len(headers):
-                        row_dict[headers[i]] = str(value) if value is not None else ''
-                data.append(row_dict)
-            
-            workbook.close()
-            return data
+            try:
+                rows = workbook.active.iter_rows(values_only=True)
+                header = next(rows, None)
+                if header is None:
+                    return
+                columns = tuple(str(value).strip() if value is not None else '' for value in header)
+                yield columns
+                width = len(columns)
+                for values in rows:
+                    row = ['' if value is None else str(value) for value in values[:width]]
+                    if len(row) < width:
+                        row.extend([''] * (width - len(row)))
+                    yield row
+            finally:
+                workbook.close()
         except Exception as e:
             logger.error(f"Error reading Excel file: {e}")
-            return []
 
     @staticmethod
-    def read_csv(csv_path):
-        """Read CSV file using standard library"""
+    def iter_csv_rows(csv_path):
+        """Column names, then rows of a CSV file (see class docstring)"""
         try:
-            data = []
             with open(csv_path, 'r', newline='', encoding='utf-8') as csvfile:
                 sample = csvfile.read(1024)
                 csvfile.seek(0)
@@ -167,49 +500,950 @@ class ExcelReader:
                 
                 logger.debug(f"Using delimiter: '{delimiter}'")
                 
-                reader = csv.DictReader(csvfile, delimiter=delimiter)
-                for row_num, row in enumerate(reader, 2):
-                    try:
-                        clean_row = {}
-                        for key, value in row.items():
-                            clean_key = key.strip() if key else ''
-                            if value is None:
-                                clean_value = ''
-                            elif isinstance(value, str):
-                                clean_value = value.strip()
-                            else:
-                                clean_value = str(value).strip()
-                            clean_row[clean_key] = clean_value
-                        data.append(clean_row)
-                    except Exception as e:
-                        logger.error(f"Error processing row {row_num}: {e}")
-                        continue
-            
-            return data
-        
+                reader = csv.reader(csvfile, delimiter=delimiter)
+                header = next(reader, None)
+                if header is None:
+                    return
+                columns = tuple(name.strip() for name in header)
+                yield columns
+                
+                width = len(columns)
+                last = width - 1
+                # An unquoted "range:0,10" in a trailing Validation column
+                # spills into extra fields; put it back together
+                rejoin_validation = columns[last] == 'Validation'
+                for row in reader:
+                    length = len(row)
+                    if length == width:
+                        yield row
+                    elif length > width:
+                        if rejoin_validation and row[last]:
+                            row[last] = ','.join(row[last:]).rstrip(', ')
+                        del row[width:]
+                        yield row
+                    elif row:
+                        row.extend([''] * (width - length))
+                        yield row
         except Exception as e:
             logger.error(f"Error reading CSV file: {e}")
+
+    @staticmethod
+    def _read_dicts(rows):
+        columns = next(rows, None)
+        if columns is None:
             return []
+        return [dict(zip(columns, [value.strip() for value in row])) for row in rows]
+
+    @staticmethod
+    def read_excel_as_csv(excel_path):
+        """Read an Excel sheet as a list of dicts with stripped keys and values"""
+        return ExcelReader._read_dicts(ExcelReader.iter_excel_rows(excel_path))
+
+    @staticmethod
+    def read_csv(csv_path):
+        """Read a CSV file as a list of dicts with stripped keys and values"""
+        return ExcelReader._read_dicts(ExcelReader.iter_csv_rows(csv_path))
+
+
+@contextmanager
+def gc_paused():
+    """Run a block with the garbage collector off
+    
+    Loading a configuration creates millions of long-lived objects, which
+    would trigger full collections over all of them; none of it is cyclic
+    garbage.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class DefinitionSnapshot:
+    """Compiled copy of a configuration file, written by --compile
+    
+    Holds one record per instrument in <file>.scpisnap next to the source:
+    its first row's settings columns, its (command, response, validation)
+    rows and its compiled command table (SCPIInstrument.compile_table), each
+    record a marshal block. Reading it memory-maps the file and unmarshals
+    one record at a time, so neither the CSV parser nor openpyxl is
+    involved, and the instrument is restored from its table without
+    add_command; only the handler closures are created. The snapshot
+    records the source's size, mtime and sha256: a source with a new mtime
+    but the same hash is still served from it, a changed source makes the
+    snapshot stale. VERSION changes with the record or table layout.
+    
+    Layout: MAGIC, a '<HQQ' prelude (format version, header offset, header
+    length), the instrument records, then the marshalled header.
+    """
+
+    MAGIC = b'SCPISNAP'
+    VERSION = 2
+    SUFFIX = '.scpisnap'
+    COLUMNS = ('Equipment', 'Port', 'Framing', 'Concurrency', 'Replicas', 'Command', 'Response', 'Validation')
+    _PRELUDE = struct.Struct('<HQQ')
+
+    @classmethod
+    def path_for(cls, source_path):
+        source_path = Path(source_path)
+        return source_path.with_name(source_path.name + cls.SUFFIX)
+
+    @staticmethod
+    def source_digest(source_path):
+        digest = hashlib.sha256()
+        with open(source_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def iter_source_rows(source_path):
+        """Column names, then rows of a .csv/.xlsx/.xls file, or None for other types"""
+        suffix = Path(source_path).suffix.lower()
+        if suffix in ('.xlsx', '.xls'):
+            return ExcelReader.iter_excel_rows(source_path)
+        if suffix == '.csv':
+            return ExcelReader.iter_csv_rows(source_path)
+        return None
+
+    @classmethod
+    def iter_source_definitions(cls, source_path):
+        """Instrument definitions of a .csv/.xlsx/.xls file, streamed
+        
+        Yields (row_num, first, rows) per instrument: first holds the
+        stripped COLUMNS of the row naming it, rows its (command, response,
+        validation) tuples. Raises ValueError when the file has no rows or
+        lacks a required column.
+        """
+        rows = cls.iter_source_rows(source_path)
+        if rows is None:
+            raise ValueError(f"Unsupported file type: {Path(source_path).suffix}")
+        columns = next(rows, None)
+        if not columns:
+            raise ValueError("No data found in file")
+        
+        # Validate required columns
+        required_cols = ['Equipment', 'Command', 'Response']
+        if not all(col in columns for col in required_cols):
+            raise ValueError(f"File missing required columns: {required_cols}; "
+                             f"available columns: {list(columns)}")
+        
+        # Column indices are resolved once; rows are plain lists
+        column_index = {name: columns.index(name) for name in cls.COLUMNS if name in columns}
+        equipment_col = column_index['Equipment']
+        command_col = column_index['Command']
+        response_col = column_index['Response']
+        validation_col = column_index.get('Validation')
+        
+        current = None
+        for row_num, row in enumerate(rows, 1):
+            if row[equipment_col].strip():
+                if current is not None:
+                    yield current
+                # First row of an instrument: its settings columns, as a dict
+                current = (row_num, {name: row[i].strip() for name, i in column_index.items()}, [])
+            
+            command = row[command_col].strip()
+            if current is not None and command:
+                response = row[response_col].strip()
+                if response:
+                    validation = row[validation_col].strip() if validation_col is not None else None
+                    current[2].append((command, response, validation))
+        
+        if current is not None:
+            yield current
+
+    @classmethod
+    def compile(cls, source_path):
+        """Write the snapshot of source_path and return its path
+        
+        Raises ValueError when the source cannot be read as definitions.
+        """
+        source_path = Path(source_path)
+        stat = source_path.stat()
+        
+        path = cls.path_for(source_path)
+        temp_path = path.with_name(path.name + f'.{os.getpid()}.tmp')
+        records = []
+        row_count = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(cls.MAGIC + cls._PRELUDE.pack(cls.VERSION, 0, 0))
+                with gc_paused():
+                    for row_num, first, rows in cls.iter_source_definitions(source_path):
+                        record = (row_num, first, tuple(rows), SCPIInstrument.compile_table(rows))
+                        record = cls._share_strings(record, {})
+                        records.append((f.tell(), f.write(marshal.dumps(record))))
+                        row_count += len(rows)
+                
+                header = {
+                    'cache_tag': sys.implementation.cache_tag,
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                    'sha256': cls.source_digest(source_path),
+                    'records': records,
+                    'rows': row_count
+                }
+                header_offset = f.tell()
+                header_length = f.write(marshal.dumps(header))
+                f.seek(len(cls.MAGIC))
+                f.write(cls._PRELUDE.pack(cls.VERSION, header_offset, header_length))
+            os.replace(temp_path, path)
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+        return path
+
+    @classmethod
+    def _share_strings(cls, value, strings):
+        """value with equal strings made one object, which marshal writes once"""
+        if isinstance(value, str):
+            return strings.setdefault(value, value)
+        if isinstance(value, tuple):
+            return tuple(cls._share_strings(item, strings) for item in value)
+        if isinstance(value, list):
+            return [cls._share_strings(item, strings) for item in value]
+        if isinstance(value, dict):
+            return {cls._share_strings(key, strings): cls._share_strings(item, strings)
+                    for key, item in value.items()}
+        return value
+
+    @classmethod
+    def _read_header(cls, mm):
+        magic_length = len(cls.MAGIC)
+        if mm[:magic_length] != cls.MAGIC:
+            raise ValueError("not a snapshot")
+        version, header_offset, header_length = cls._PRELUDE.unpack_from(mm, magic_length)
+        if version != cls.VERSION:
+            raise ValueError(f"format version {version}, expected {cls.VERSION}")
+        header = marshal.loads(mm[header_offset:header_offset + header_length])
+        if header['cache_tag'] != sys.implementation.cache_tag:
+            raise ValueError(f"written by {header['cache_tag']}")
+        return header
+
+    @classmethod
+    def open_definitions(cls, source_path):
+        """Instrument definitions of a fresh snapshot of source_path
+        
+        Yields (row_num, first, rows, table) per instrument, as
+        iter_source_definitions() plus the compiled table. Returns None when
+        there is no snapshot; raises ValueError when there is one but it is
+        stale or unreadable.
+        """
+        path = cls.path_for(source_path)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError("empty file")
+        try:
+            header = cls._read_header(mm)
+            stat = os.stat(source_path)
+            if stat.st_size != header['size']:
+                raise ValueError("source size changed")
+            if stat.st_mtime_ns != header['mtime_ns'] and cls.source_digest(source_path) != header['sha256']:
+                raise ValueError("source contents changed")
+        except ValueError:
+            mm.close()
+            raise
+        except Exception as e:
+            mm.close()
+            raise ValueError(f"unreadable: {e}")
+        return cls._iter_records(mm, header)
+
+    @staticmethod
+    def _iter_records(mm, header):
+        view = memoryview(mm)
+        try:
+            for offset, length in header['records']:
+                yield marshal.loads(view[offset:offset + length])
+        finally:
+            view.release()
+            mm.close()
+
+
+class RangeValidator:
+    """Validation rule 'range:min,max' with the bounds parsed once"""
+
+    __slots__ = ('min_val', 'max_val')
+
+    def __init__(self, min_val, max_val):
+        self.min_val = min_val
+        self.max_val = max_val
+
+    def __call__(self, param):
+        try:
+            value = float(param)
+        except ValueError:
+            return f'-104,"Data type error; cannot convert \'{param}\' to number"'
+        if not (self.min_val <= value <= self.max_val):
+            return f'-222,"Data out of range; expected {self.min_val} to {self.max_val}, got {value}"'
+        return None
+
+
+class EnumValidator:
+    """Validation rule 'enum:A,B,C' with the allowed values as a frozenset"""
+
+    __slots__ = ('values', 'expected')
+
+    def __init__(self, values):
+        self.values = frozenset(values)
+        self.expected = str(list(values))
+
+    def __call__(self, param):
+        if param.upper() not in self.values:
+            return f'-108,"Parameter not allowed; expected one of {self.expected}, got \'{param}\'"'
+        return None
+
+
+class BoolValidator:
+    """Validation rule 'bool'"""
+
+    __slots__ = ()
+
+    VALUES = frozenset(['ON', 'OFF', '1', '0'])
+
+    def __call__(self, param):
+        if param.upper() not in self.VALUES:
+            return f'-108,"Invalid boolean; expected ON/OFF/1/0, got \'{param}\'"'
+        return None
+
+
+class MalformedRangeValidator:
+    """A 'range:' rule whose bounds could not be parsed; rejects every value"""
+
+    __slots__ = ()
+
+    def __call__(self, param):
+        return f'-104,"Data type error; cannot convert \'{param}\' to number"'
+
+
+@lru_cache(maxsize=1024)
+def compile_validation(validation):
+    """Turn a Validation column entry into a validator, or None for no validation
+    
+    Validators are called with the parameter string and return an SCPI
+    error string, or None if the parameter is valid.
+    """
+    if not validation:
+        return None
+    
+    if validation.startswith('range:'):
+        try:
+            _, range_str = validation.split(':', 1)
+            min_val, max_val = map(float, range_str.split(','))
+        except ValueError:
+            logger.warning(f"Malformed validation rule '{validation}'; expected range:min,max")
+            return MalformedRangeValidator()
+        return RangeValidator(min_val, max_val)
+    elif validation.startswith('enum:'):
+        _, enum_str = validation.split(':', 1)
+        return EnumValidator([v.strip().upper() for v in enum_str.split(',')])
+    elif validation == 'bool':
+        return BoolValidator()
+    
+    return None
+
+
+class BinaryBlock:
+    """IEEE 488.2 definite-length arbitrary block response: #<n><length><payload>
+    
+    The payload stays a memoryview over the caller's buffer (bytes, an array
+    or a NumPy array) and is written to the socket after the small ASCII
+    header, never copied into a reply string.
+    """
+
+    __slots__ = ('header', 'payload')
+
+    def __init__(self, payload):
+        self.payload = memoryview(payload).cast('B')
+        length = str(self.payload.nbytes)
+        self.header = f'#{len(length)}{length}'.encode('ascii')
+
+    @classmethod
+    def from_values(cls, values, bits=32, byte_order='NORM'):
+        """Block of IEEE 754 floats; NORM is big-endian, SWAP little-endian"""
+        big_endian = byte_order == 'NORM'
+        if hasattr(values, 'dtype'):
+            # NumPy array: converted (or just viewed) without going through Python floats
+            dtype = ('>' if big_endian else '<') + ('f4' if bits == 32 else 'f8')
+            return cls(values.astype(dtype, order='C', copy=False).reshape(-1).view('u1'))
+        
+        data = array('f' if bits == 32 else 'd', values)
+        if big_endian == (sys.byteorder == 'little'):
+            data.byteswap()
+        return cls(data)
+
+    def __str__(self):
+        return f"{self.header.decode('ascii')}<{self.payload.nbytes} bytes>"
+
+
+def response_text(response):
+    """Printable form of a process_command() result, for logs and the dashboard"""
+    if isinstance(response, tuple):
+        return ';'.join(str(part) for part in response)
+    return str(response)
+
+
+def encode_response(response):
+    """Byte chunks of a reply, terminated with a newline
+    
+    A response is a str, a BinaryBlock, or a tuple of both for a chained
+    message that returned a block; blocks are passed through unencoded.
+    """
+    if isinstance(response, str):
+        return [(response + '\n').encode('utf-8')] if response else []
+    if isinstance(response, BinaryBlock):
+        return [response.header, response.payload, b'\n']
+    
+    chunks = []
+    text = ''
+    for part in response:
+        if isinstance(part, BinaryBlock):
+            chunks.append(text.encode('utf-8'))
+            chunks.append(part.header)
+            chunks.append(part.payload)
+            text = ';'
+        else:
+            text = f'{text}{part};'
+    chunks.append((text[:-1] + '\n').encode('utf-8'))
+    return [chunk for chunk in chunks if len(chunk)]
+
+
+_numpy = None
+
+
+def load_numpy():
+    """NumPy if it is installed, else None; imported on first use"""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            logger.info("NumPy not available; traces are generated in pure Python (pip install numpy)")
+            _numpy = False
+    return _numpy or None
+
+
+@lru_cache(maxsize=32)
+def generate_trace(kind, settings):
+    """Values of a synthetic trace; settings is a tuple of (name, value) pairs
+    
+    Noise comes from a fixed seed, so equal settings always give the same,
+    cached, trace. NumPy arrays are returned read-only.
+    """
+    params = dict(settings)
+    np = load_numpy()
+    
+    if kind == 'sparam':
+        # Band-pass resonator centred in the sweep plus 1 ns of delay, as interleaved re,im pairs
+        points, start, stop, noise = int(params['points']), params['start'], params['stop'], params['noise']
+        center = max((start + stop) / 2, 1.0)
+        if np is not None:
+            freq = np.maximum(np.linspace(start, stop, points), 1.0)
+            s21 = np.exp(-2j * np.pi * freq * 1e-9) / (1 + 10j * (freq / center - center / freq))
+            values = np.empty(2 * points)
+            values[0::2] = s21.real
+            values[1::2] = s21.imag
+        else:
+            step = (stop - start) / (points - 1) if points > 1 else 0.0
+            values = array('d')
+            for i in range(points):
+                freq = max(start + i * step, 1.0)
+                s21 = cmath.exp(-2j * math.pi * freq * 1e-9) / (1 + 10j * (freq / center - center / freq))
+                values.append(s21.real)
+                values.append(s21.imag)
+    elif kind == 'dmm':
+        points, level, noise = int(params['count']), params['level'], params['noise']
+        if np is not None:
+            values = np.full(points, level)
+        else:
+            values = array('d', [level]) * points
+    else:
+        points, amplitude, cycles, noise = int(params['points']), params['amplitude'], params['cycles'], params['noise']
+        if np is not None:
+            values = amplitude * np.sin(2 * np.pi * cycles / points * np.arange(points))
+        else:
+            phase = 2 * math.pi * cycles / points
+            values = array('d', (amplitude * math.sin(phase * i) for i in range(points)))
+    
+    if noise:
+        if np is not None:
+            values += np.random.default_rng(1).normal(0.0, noise, len(values))
+        else:
+            gauss = random.Random(1).gauss
+            for i in range(len(values)):
+                values[i] += gauss(0.0, noise)
+    if np is not None:
+        values.flags.writeable = False
+    return values
+
+
+class TraceGenerator:
+    """Synthetic data for a 'trace:<kind>[,name=value,...]' response
+    
+    Each setting is a literal number or follows a stateful command: by
+    default the shortest linked command whose header ends in one of the
+    setting's suffixes (SENS1:SWE:POIN for points), or the command named in
+    the response, e.g. 'trace:sparam,points=SENS2:SWE:POIN,noise=0.01'.
+    """
+
+    # As on a PNA-X; bounds the 32 cached traces to about 50 MB
+    MAX_POINTS = 100001
+
+    # kind -> setting -> (header suffixes it follows, default)
+    KINDS = {
+        'sparam': {
+            'points': (('SWE:POIN',), 201),
+            'start': (('FREQ:STAR', 'FREQ:START'), 1e9),
+            'stop': (('FREQ:STOP',), 2e9),
+            'noise': ((), 1e-3),
+        },
+        'dmm': {
+            'count': (('SAMP:COUN',), 1),
+            'level': ((), 1.0),
+            'noise': ((), 1e-4),
+        },
+        'waveform': {
+            'points': (('SWE:POIN', 'ACQ:POIN', 'HOR:RECO', 'WAV:POIN'), 1000),
+            'amplitude': ((), 1.0),
+            'cycles': ((), 5.0),
+            'noise': ((), 1e-2),
+        },
+    }
+
+    def __init__(self, spec):
+        kind, *overrides = [part.strip() for part in spec.split(',')]
+        self.kind = kind.lower()
+        if self.kind not in self.KINDS:
+            raise ValueError(f"Unknown trace kind '{kind}'; expected one of {list(self.KINDS)}")
+        
+        self.defaults = {name: default for name, (_, default) in self.KINDS[self.kind].items()}
+        self.sources = {}  # setting -> header it was explicitly told to follow
+        for override in overrides:
+            name, _, value = override.partition('=')
+            name = name.strip().lower()
+            if name not in self.defaults:
+                raise ValueError(f"Unknown setting '{name}' for {self.kind} traces")
+            try:
+                self.defaults[name] = float(value)
+            except ValueError:
+                self.sources[name] = value.strip().upper()
+        
+        # (setting, state key, default) per setting that follows a command; see bind()
+        self.bindings = ()
+
+    def bind(self, instrument):
+        """Resolve which stateful commands the settings follow"""
+        bases = instrument.default_values
+        bindings = []
+        for name, (suffixes, _) in self.KINDS[self.kind].items():
+            base = self.sources.get(name)
+            if base is None:
+                matches = [b for b in bases if any(b == suffix or b.endswith(':' + suffix) for suffix in suffixes)]
+                base = min(matches, key=len) if matches else None
+            if base is not None:
+                bindings.append((name, f'{base}_VALUE', bases.get(base, self.defaults[name])))
+        self.bindings = tuple(bindings)
+
+    def settings(self, state):
+        """Current settings as a hashable, sorted tuple"""
+        settings = dict(self.defaults)
+        for name, key, default in self.bindings:
+            try:
+                settings[name] = float(state.get(key, default))
+            except (TypeError, ValueError):
+                pass
+        for name in ('points', 'count'):
+            if name in settings:
+                settings[name] = max(1, min(int(settings[name]), self.MAX_POINTS))
+        return tuple(sorted(settings.items()))
+
+
+# The only characters that change the state of the program message splitter
+_MESSAGE_SPECIALS = re.compile('[;"\']')
+
+
+def split_program_message(message):
+    """Split a program message into its units at the ';' outside quoted strings
+    
+    A two-state machine (in or out of a string) stepping only over ';', '"'
+    and "'"; SCPI's doubled quotes ("") just leave and re-enter the string.
+    Without quotes this is a plain str.split.
+    """
+    if '"' not in message and "'" not in message:
+        return message.split(';')
+    
+    units = []
+    start = 0
+    quote = None
+    for match in _MESSAGE_SPECIALS.finditer(message):
+        char = match.group()
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char == ';':
+            units.append(message[start:match.start()])
+            start = match.end()
+        else:
+            quote = char
+    units.append(message[start:])
+    return units
+
+
+class MnemonicTrie:
+    """Matches short and long forms of command headers against the CSV headers
+
+    Headers are added as written: the upper-case part of a mixed-case node is
+    its short form (SENSe -> SENS, SENSE), all-upper nodes get their other form
+    from LONG_FORMS or, for short forms whose meaning depends on the node
+    before them, CONTEXT_LONG_FORMS; [optional] nodes may be left out, and a
+    numeric suffix of 1 may be left out (SENS:FREQ reaches SENS1:FREQ). Every
+    alternative is expanded into the trie when the header is added, so
+    match() is one dict lookup per node of the received header.
+    """
+
+    # Long forms of common SCPI mnemonics, for headers written in short form.
+    # Short forms with more than one long form (DEL, RES, STAT, ...) are in
+    # CONTEXT_LONG_FORMS instead, or nowhere (MOD: MODulation or MODE); a CSV
+    # can always spell a node in mixed case (TRIGger:DELay).
+    LONG_FORMS = {
+        'ABOR': 'ABORT', 'ACQ': 'ACQUIRE', 'AMPL': 'AMPLITUDE', 'APER': 'APERTURE',
+        'AUT': 'AUTO', 'AVER': 'AVERAGE', 'BAND': 'BANDWIDTH', 'BORD': 'BORDER',
+        'BWID': 'BANDWIDTH', 'CALC': 'CALCULATE', 'CAL': 'CALIBRATION', 'CENT': 'CENTER',
+        'CHAN': 'CHANNEL', 'COND': 'CONDITION', 'CONF': 'CONFIGURE', 'CORR': 'CORRECTION',
+        'COUN': 'COUNT', 'COUP': 'COUPLING', 'CURR': 'CURRENT', 'DISP': 'DISPLAY',
+        'ENAB': 'ENABLE', 'ERR': 'ERROR', 'EVEN': 'EVENT', 'FORM': 'FORMAT',
+        'FREQ': 'FREQUENCY', 'FUNC': 'FUNCTION', 'HOR': 'HORIZONTAL', 'IMM': 'IMMEDIATE',
+        'INIT': 'INITIATE', 'INP': 'INPUT', 'LEV': 'LEVEL', 'LIM': 'LIMIT', 'MARK': 'MARKER',
+        'MEAS': 'MEASURE', 'MEM': 'MEMORY', 'MMEM': 'MMEMORY', 'NPLC': 'NPLCYCLES',
+        'OFFS': 'OFFSET', 'OPER': 'OPERATION', 'OUTP': 'OUTPUT', 'POIN': 'POINTS',
+        'POW': 'POWER', 'PROT': 'PROTECTION', 'QUES': 'QUESTIONABLE', 'RANG': 'RANGE',
+        'SAMP': 'SAMPLE', 'SCAL': 'SCALE', 'SEL': 'SELECT', 'SENS': 'SENSE', 'SOUR': 'SOURCE',
+        'STAR': 'START', 'SWE': 'SWEEP', 'SYST': 'SYSTEM', 'TRAC': 'TRACE', 'TRIG': 'TRIGGER',
+        'TYP': 'TYPE', 'VERS': 'VERSION', 'VOLT': 'VOLTAGE', 'WIND': 'WINDOW',
+    }
+    # Long forms of ambiguous short forms by (node before, node), in short
+    # form without suffix; '' is the root. TRIG:DEL is DELay, MMEM:DEL DELete.
+    CONTEXT_LONG_FORMS = {
+        ('TRIG', 'DEL'): 'DELAY', ('ARM', 'DEL'): 'DELAY', ('MMEM', 'DEL'): 'DELETE',
+        ('STAT', 'DEL'): 'DELETE', ('MEAS', 'RES'): 'RESISTANCE', ('CONF', 'RES'): 'RESISTANCE',
+        ('DC', 'RES'): 'RESOLUTION', ('AC', 'RES'): 'RESOLUTION', ('MEAS', 'PER'): 'PERIOD',
+        ('CONF', 'PER'): 'PERIOD', ('INIT', 'CONT'): 'CONTINUOUS', ('', 'STAT'): 'STATUS',
+        ('AM', 'STAT'): 'STATE', ('FM', 'STAT'): 'STATE', ('PM', 'STAT'): 'STATE',
+        ('BURS', 'STAT'): 'STATE', ('AVER', 'STAT'): 'STATE', ('CORR', 'STAT'): 'STATE',
+        ('WIND', 'STAT'): 'STATE', ('OUTP', 'STAT'): 'STATE', ('PROT', 'STAT'): 'STATE',
+        ('SEC', 'STAT'): 'STATE', ('MEM', 'STAT'): 'STATE', ('CALC', 'PAR'): 'PARAMETER',
+        ('PAR', 'DEF'): 'DEFINE',
+    }
+    SHORT_FORMS = {long: short for short, long in LONG_FORMS.items()}
+    SHORT_FORMS.update({long: short for (_, short), long in CONTEXT_LONG_FORMS.items()})
+
+    # A node as written: optional brackets, mnemonic, numeric suffix
+    _NODE = re.compile(r'(\[)?:?([A-Za-z_]+)(?:\[(\d+)\]|(\d*))\]?')
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, header, target):
+        """Make every short/long form of header match target
+
+        header is the CSV header as written, e.g. [SENSe]:FREQuency:STARt?;
+        terminals are stored under ':' and ':?', which no node can equal.
+        """
+        query = header.endswith('?')
+        if query:
+            header = header[:-1]
+        nodes = []
+        parent = ''
+        for match in self._NODE.finditer(header):
+            optional, mnemonic, optional_suffix, suffix = match.groups()
+            forms = self._forms(mnemonic, parent)
+            parent = forms[0]
+            if optional_suffix is not None:
+                suffixes = ('', optional_suffix)
+            elif suffix in ('', '1'):
+                suffixes = ('', '1')
+            else:
+                suffixes = (suffix,)
+            nodes.append(([form + s for form in forms for s in suffixes], bool(optional)))
+        if nodes:
+            self._insert(self._root, nodes, 0, ':?' if query else ':', target)
+
+    def _forms(self, mnemonic, parent):
+        """Short form first, then the long form if there is one
+        
+        parent is the short form of the node before, for CONTEXT_LONG_FORMS.
+        """
+        if mnemonic.isupper() or mnemonic.islower():
+            mnemonic = mnemonic.upper()
+            long_form = self.LONG_FORMS.get(mnemonic) or self.CONTEXT_LONG_FORMS.get((parent, mnemonic))
+            if long_form is not None:
+                return (mnemonic, long_form)
+            short_form = self.SHORT_FORMS.get(mnemonic)
+            return (short_form, mnemonic) if short_form else (mnemonic,)
+        short_form = ''.join(char for char in mnemonic if char.isupper())
+        return (short_form, mnemonic.upper())
+
+    @staticmethod
+    def command_key(header):
+        """The command key of a header written in SCPI notation
+        
+        [optional] brackets are dropped and mixed-case nodes keep their short
+        form, so SENSe1:SWEep:POINts? is stored as SENS1:SWE:POIN?, the key
+        (and state key) an all-caps CSV row would have.
+        """
+        if '[' not in header and header.isupper():
+            return header.lstrip(':')
+        nodes = []
+        for node in header.replace('[', '').replace(']', '').split(':'):
+            if not (node.isupper() or node.islower()):
+                node = ''.join(char for char in node if not char.islower())
+            nodes.append(node.upper())
+        return ':'.join(nodes).lstrip(':')
+
+    def _insert(self, node, nodes, i, terminal, target):
+        if i == len(nodes):
+            node.setdefault(terminal, target)
+            return
+        forms, optional = nodes[i]
+        if optional:
+            self._insert(node, nodes, i + 1, terminal, target)
+        for form in forms:
+            self._insert(node.setdefault(form, {}), nodes, i + 1, terminal, target)
+
+    def match(self, header):
+        """The target added for an upper-case header, or None"""
+        terminal = ':'
+        if header.endswith('?'):
+            header = header[:-1]
+            terminal = ':?'
+        node = self._root
+        for token in header.split(':'):
+            node = node.get(token)
+            if node is None:
+                return None
+        return node.get(terminal)
+
+
+def pure_query(*reads):
+    """Mark a query handler whose reply depends only on the given state keys
+    
+    SCPIInstrument caches the encoded replies of such handlers until one of
+    those keys is set (see SCPIInstrument.execute).
+    """
+    def mark(handler):
+        handler._reads = reads
+        return handler
+    return mark
+
+
+class ErrorQueue(deque):
+    """SCPI error queue holding at most maxlen entries
+    
+    When an error arrives at a full queue, the newest entry is replaced with
+    -350,"Queue overflow" and later errors are discarded until SYST:ERR? makes
+    room, as IEEE 488.2 and SCPI require. Reads take the oldest entry. The
+    constructor is deque's, so copy(), copy.copy() and pickling keep the depth.
+    """
+
+    __slots__ = ()
+
+    DEFAULT_DEPTH = 20
+    OVERFLOW = '-350,"Queue overflow"'
+
+    def __init__(self, iterable=(), maxlen=DEFAULT_DEPTH):
+        super().__init__(iterable, max(1, maxlen))
+
+    def append(self, error):
+        if len(self) < self.maxlen:
+            super().append(error)
+        elif self[-1] != self.OVERFLOW:
+            self[-1] = self.OVERFLOW
+
+
+class SCPISession:
+    """Instrument state owned by one client connection ('session' concurrency)"""
+
+    __slots__ = ('state', 'error_queue', '__weakref__')
+
+    def __init__(self, error_queue_depth=ErrorQueue.DEFAULT_DEPTH):
+        self.state = {}
+        self.error_queue = ErrorQueue(maxlen=error_queue_depth)
+
+
+class InstrumentActor:
+    """Worker thread that executes an instrument's commands one at a time
+    
+    Callers block until their command has run; each calling thread reuses
+    one reply queue, so a request costs two queue operations. A request
+    submitted once the actor is stopping is not queued behind the stop
+    sentinel, where nothing would answer it, but run on the calling thread.
+    """
+
+    def __init__(self, instrument):
+        self.instrument = instrument
+        self.requests = queue.SimpleQueue()
+        self._local = threading.local()
+        # Orders submit() against stop(): a request is queued before the
+        # sentinel or sees stopped
+        self._stop_lock = threading.Lock()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name=f'actor-{instrument.id}', daemon=True)
+        self.thread.start()
+
+    @property
+    def depth(self):
+        """Commands waiting to run"""
+        return self.requests.qsize()
+
+    def submit(self, run, command, session=None):
+        """Run run(command, session) on the actor thread and return its result"""
+        reply = getattr(self._local, 'reply', None)
+        if reply is None:
+            reply = self._local.reply = queue.SimpleQueue()
+        
+        with self._stop_lock:
+            queued = not self.stopped
+            if queued:
+                self.requests.put((run, command, session, reply))
+        if not queued:
+            # run() takes the instrument lock, as in 'lock' mode
+            return run(command, session)
+        ok, result = reply.get()
+        if ok:
+            return result
+        raise result
+
+    def stop(self):
+        with self._stop_lock:
+            self.stopped = True
+            self.requests.put(None)
+
+    def _run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            run, command, session, reply = request
+            try:
+                reply.put((True, run(command, session)))
+            except Exception as e:
+                reply.put((False, e))
 
 
 class SCPIInstrument:
-    """Represents a single SCPI instrument with its command set"""
+    """Represents a single SCPI instrument with its command set
+    
+    How concurrent clients share the instrument is set by its concurrency mode:
+    
+    lock    - commands of all clients run one at a time under the instrument's
+              lock and share one state and error queue (default)
+    actor   - like lock, but commands are handed to a per-instrument worker
+              thread through a queue and run in arrival order
+    session - every connection gets its own state and error queue, so clients
+              never observe each other's settings
+    
+    A chained message ("A;B?") always runs as one unit in every mode.
+    """
+
+    # "HEADER (.+)" commands are dispatched by header lookup instead of regex
+    _HEADER_PATTERN = re.compile(r'([A-Z0-9_:*?]+) \(\.\+\)')
+
+    # Where the literal part of a free-form pattern's header ends
+    _REGEX_START = re.compile(r'[\\(\[{|.+^$]')
+
+    # Headers the mnemonic trie understands: nodes with suffixes, and whole
+    # [optional] nodes ([:SOURce], [SENSe]:); other brackets, such as the
+    # character class in CH[12]:SCAL, are regex and stay in the key
+    _MNEMONIC_HEADER = re.compile(r'(?:\[:?[A-Za-z]\w*\]|:?[A-Za-z]\w*)(?:\[:[A-Za-z]\w*\]|:\[[A-Za-z]\w*\]|:[A-Za-z]\w*)*\??')
+    RESOLVED_HEADERS_SIZE = 4096
 
-    def __init__(self, name, instrument_id):
+    CONCURRENCY_MODES = ('lock', 'actor', 'session')
+
+    # FORM:DATA parameters and the canonical form FORM:DATA? reports
+    DATA_FORMATS = {
+        'ASC': 'ASC,0', 'ASCII': 'ASC,0', 'ASC,0': 'ASC,0', 'ASCII,0': 'ASC,0',
+        'REAL': 'REAL,32', 'REAL,32': 'REAL,32', 'REAL,64': 'REAL,64',
+    }
+    BYTE_ORDERS = {'NORM': 'NORM', 'NORMAL': 'NORM', 'SWAP': 'SWAP', 'SWAPPED': 'SWAP'}
+    BUILTIN_FORMAT_COMMANDS = ('FORM:DATA (.+)', 'FORM (.+)', 'FORM:DATA?', 'FORM?', 'FORM:BORD (.+)', 'FORM:BORD?')
+
+    # CSV responses starting with this are data, returned in the FORM:DATA format
+    BLOCK_PREFIX = 'block:'
+    TRACE_PREFIX = 'trace:'
+
+    # Metrics key of commands that matched nothing
+    UNDEFINED_HEADER = '(undefined)'
+
+    # Cached replies kept before the reply cache starts over
+    RESPONSE_CACHE_SIZE = 4096
+
+    def __init__(self, name, instrument_id, concurrency='lock', metrics=True,
+                 error_queue_depth=ErrorQueue.DEFAULT_DEPTH):
         self.name = name
         self.id = instrument_id
         self.commands = {}
         self.state = {}
-        self.error_queue = []
+        self.error_queue_depth = error_queue_depth
+        self.error_queue = ErrorQueue(maxlen=error_queue_depth)
         self.last_command = ""
         self.command_count = 0
         
+        # Encoded replies of pure queries on the shared state, by command as
+        # received, and the cached commands reading each state key
+        self._response_cache = {}
+        self._cache_readers = {}
+        
+        self.lock = threading.RLock()
+        self.concurrency = 'lock'
+        self.actor = None
+        # Sessions of connected 'session' clients, reset by replace_commands()
+        self._sessions = weakref.WeakSet()
+        self.set_concurrency(concurrency)
+        
         # Store validation info separately to survive device clear
         self.validation_rules = {}
+        self.trace_generators = []
+        self.validators = {}
         self.default_values = {}
         
-        # Add standard IEEE 488.2 commands
+        # Set when SET/QUERY pairs are linked; cleared when commands are added
+        self._linked = False
+        
+        # Dispatch index over parameterized commands (see _index_command)
+        self._header_index = {}
+        self._free_form_keys = []
+        self._free_form_matcher = None
+        self._known_headers = None
+        self._resolved_headers = None
+        
+        # Literal headers as written, and the short/long form trie over them;
+        # the trie is only built on the first dispatch miss
+        self._mnemonic_headers = []
+        self._mnemonics = None
+        
+        # Stage latency histograms by matched command key, None when disabled
+        self.metrics = {} if metrics else None
+        
+        self._add_builtin_commands()
+
+    def _add_builtin_commands(self):
+        """Add standard IEEE 488.2 and FORMat commands"""
         self._add_ieee488_commands()
+        self._add_format_commands()
+        for key in self.commands:
+            header = key.partition(' ')[0]
+            if not header.startswith('*'):
+                self._mnemonic_headers.append((header, header))
 
     def _add_ieee488_commands(self):
         """Add standard IEEE 488.2 mandatory commands"""
@@ -218,9 +1452,9 @@ class SCPIInstrument:
             '*ESE': self._event_status_enable,
             '*ESE?': self._event_status_enable_query,
             '*ESR?': self._event_status_register_query,
-            '*IDN?': lambda: f"SCPI_Emulator,{self.name},{self.id},2.3.0",
+            '*IDN?': pure_query()(lambda: f"SCPI_Emulator,{self.name},{self.id},2.3.0"),
             '*OPC': lambda: '1',
-            '*OPC?': lambda: '1',
+            '*OPC?': pure_query()(lambda: '1'),
             '*RST': self._reset,
             '*SRE': self._service_request_enable,
             '*SRE?': self._service_request_enable_query,
@@ -228,81 +1462,460 @@ class SCPIInstrument:
             '*TST?': self._self_test,
             '*WAI': lambda: '',
             'SYST:ERR?': self._system_error_query,
-            'SYST:VERS?': lambda: '1999.0',
+            'SYST:ERR:NEXT?': self._system_error_query,
+            'SYST:ERR:COUN?': self._system_error_count_query,
+            'SYST:ERR:ALL?': self._system_error_all_query,
+            'SYST:VERS?': pure_query()(lambda: '1999.0'),
+        })
+
+    def _add_format_commands(self):
+        """Add FORMat commands selecting how data queries return their values"""
+        self.commands.update({
+            'FORM:DATA (.+)': self._format_data,
+            'FORM (.+)': self._format_data,
+            'FORM:DATA?': self._format_data_query,
+            'FORM?': self._format_data_query,
+            'FORM:BORD (.+)': self._format_byte_order,
+            'FORM:BORD?': self._format_byte_order_query,
         })
+        for key in self.BUILTIN_FORMAT_COMMANDS:
+            self._index_command(key)
+
+    def _format_data(self, value):
+        data_format = self.DATA_FORMATS.get(value.replace(' ', ''))
+        if data_format is None:
+            self.error_queue.append(f'-224,"Illegal parameter value; FORM:DATA {value}"')
+            return ''
+        self._set_state('FORM:DATA', data_format)
+        return ''
+
+    @pure_query('FORM:DATA')
+    def _format_data_query(self):
+        return self.state.get('FORM:DATA', 'ASC,0')
+
+    def _format_byte_order(self, value):
+        byte_order = self.BYTE_ORDERS.get(value.strip())
+        if byte_order is None:
+            self.error_queue.append(f'-224,"Illegal parameter value; FORM:BORD {value}"')
+            return ''
+        self._set_state('FORM:BORD', byte_order)
+        return ''
+
+    @pure_query('FORM:BORD')
+    def _format_byte_order_query(self):
+        return self.state.get('FORM:BORD', 'NORM')
+
+    def format_data(self, values):
+        """Reply to a data query in the current FORM:DATA and FORM:BORD
+        
+        ASCii returns comma separated NR3 numbers; REAL,32 and REAL,64 return
+        a BinaryBlock.
+        """
+        data_format = self.state.get('FORM:DATA', 'ASC,0')
+        if data_format == 'ASC,0':
+            return ','.join([format(float(value), '+.9E') for value in values])
+        return BinaryBlock.from_values(values, 64 if data_format == 'REAL,64' else 32,
+                                       self.state.get('FORM:BORD', 'NORM'))
 
     def _clear_status(self):
         self.error_queue.clear()
         self.state.clear()
+        self._clear_response_cache()
         return ''
 
+    def _set_state(self, key, value):
+        """Store a setting and drop the cached replies that read it"""
+        self.state[key] = value
+        if key in self._cache_readers:
+            self._invalidate(key)
+
+    def _invalidate(self, key):
+        for command in self._cache_readers.pop(key, ()):
+            self._response_cache.pop(command, None)
+
+    def _clear_response_cache(self):
+        self._response_cache.clear()
+        self._cache_readers.clear()
+
+    def _cache_response(self, command, response, reads, key):
+        """Remember the encoded reply of a pure query (called under the lock)
+        
+        key is the matched command key, under which cache hits are timed.
+        """
+        if len(self._response_cache) >= self.RESPONSE_CACHE_SIZE:
+            self._clear_response_cache()
+        for state_key in reads:
+            self._cache_readers.setdefault(state_key, set()).add(command)
+        self._response_cache[command] = (response, encode_response(response), key)
+
+    def set_concurrency(self, mode):
+        """Switch the concurrency mode (see class docstring)"""
+        if mode not in self.CONCURRENCY_MODES:
+            raise ValueError(f"Unknown concurrency mode '{mode}'; expected one of {list(self.CONCURRENCY_MODES)}")
+        
+        if mode == 'actor' and self.actor is None:
+            self.actor = InstrumentActor(self)
+        elif mode != 'actor' and self.actor is not None:
+            self.actor.stop()
+            self.actor = None
+        self.concurrency = mode
+        self._clear_response_cache()
+
+    def open_session(self):
+        """State for a new client connection, or None if clients share state"""
+        if self.concurrency == 'session':
+            session = SCPISession(self.error_queue_depth)
+            with self.lock:
+                self._sessions.add(session)
+            return session
+        return None
+
+    def _last_error(self, session):
+        """Newest entry of the error queue a command ran against, or None
+        
+        Called under the lock, before another client's command can add one.
+        """
+        error_queue = session.error_queue if session is not None else self.error_queue
+        return error_queue[-1] if error_queue else None
+
     def visa_device_clear(self):
-        """Simulate VISA Device Clear operation"""
-        logger.info(f"[VISA-CLR] VISA Device Clear for {self.name}")
+        """Simulate VISA Device Clear operation
         
-        self.state.clear()
-        self.error_queue.clear()
-        self.last_command = ""
-        self.command_count = 0
+        Swaps in a fresh state and error queue; the command table is only
+        relinked if commands were added since it was last linked.
+        """
+        logger.info(f"[VISA-CLR] VISA Device Clear for {self.name}")
         
-        self.link_stateful_commands()
+        with self.lock:
+            self.state = {}
+            self.error_queue = ErrorQueue(maxlen=self.error_queue_depth)
+            self.last_command = ""
+            self.command_count = 0
+            self._clear_response_cache()
+            
+            if not self._linked:
+                self.link_stateful_commands()
 
     def _reset(self):
         self.state.clear()
         self.error_queue.clear()
+        self._clear_response_cache()
         return ''
 
     def _event_status_enable(self, value=None):
         if value is not None:
-            self.state['ese'] = int(value)
+            self._set_state('ese', int(value))
         return ''
 
+    @pure_query('ese')
     def _event_status_enable_query(self):
         return str(self.state.get('ese', 0))
 
+    @pure_query('esr')
     def _event_status_register_query(self):
         return str(self.state.get('esr', 0))
 
     def _service_request_enable(self, value=None):
         if value is not None:
-            self.state['sre'] = int(value)
+            self._set_state('sre', int(value))
         return ''
 
+    @pure_query('sre')
     def _service_request_enable_query(self):
         return str(self.state.get('sre', 0))
 
+    @pure_query('stb')
     def _status_byte_query(self):
         return str(self.state.get('stb', 0))
 
+    @pure_query()
     def _self_test(self):
         return '0'
 
     def _system_error_query(self):
         if self.error_queue:
-            return self.error_queue.pop(0)
+            return self.error_queue.popleft()
         return '0,"No error"'
 
+    def _system_error_count_query(self):
+        return str(len(self.error_queue))
+
+    def _system_error_all_query(self):
+        if not self.error_queue:
+            return '0,"No error"'
+        errors = ','.join(self.error_queue)
+        self.error_queue.clear()
+        return errors
+
+    @classmethod
+    def definition_key(cls, command):
+        """Command key of a definition's command, and its mnemonic header
+        
+        The mnemonic header is (header as written, its key header) for a
+        literal header, None otherwise.
+        """
+        command = command.strip()
+        header, separator, rest = command.partition(' ')
+        mnemonic = None
+        if cls._MNEMONIC_HEADER.fullmatch(header):
+            target = MnemonicTrie.command_key(header)
+            mnemonic = (header, target)
+            command = target + separator + rest
+        command = command.upper()
+        if '{value}' in command:
+            command = command.replace('{value}', r'(.+)')
+        return command, mnemonic
+
     def add_command(self, command, response, validation=None):
-        """Add a command-response pair"""
-        command = command.strip().upper()
+        """Add a command-response pair
         
-        if '(.+)' in command or '{value}' in command:
-            pattern = command.replace('{value}', r'(.+)')
-            if '(.+)' not in pattern:
-                pattern = pattern.replace('(.+)', r'(.+)')
-            
-            if validation:
-                self.validation_rules[pattern] = validation
-            
-            self.commands[pattern] = self._create_parameterized_response(response, validation)
+        A literal header is kept for the mnemonic trie as written, so its case
+        marks the short form; the command key, and so the state key, is its
+        short form without [optional] brackets (MnemonicTrie.command_key).
+        """
+        key, mnemonic = self.definition_key(command)
+        if mnemonic is not None:
+            self._mnemonic_headers.append(mnemonic)
+            if self._mnemonics is not None:
+                self._mnemonics.add(*mnemonic)
+        self._linked = False
+        self._known_headers = None
+        self._resolved_headers = None
+        if self._response_cache:
+            self._clear_response_cache()
+        
+        self._add_handler(key, response, validation)
+        self._index_command(key)
+
+    def _add_handler(self, key, response, validation):
+        """Create the handler of a command key and its response"""
+        if '(.+)' in key:
+            validator = self._add_validation(key, validation)
+            handler = self._create_data_response(response)
+            self.commands[key] = handler or self._create_parameterized_response(response, validator)
         else:
-            self.commands[command] = lambda resp=response: str(resp)
+            handler = self._create_data_response(response)
+            self.commands[key] = handler or pure_query()(lambda resp=response: str(resp))
+
+    def _add_validation(self, key, validation):
+        """Register the validation rule of a parameterized key; returns its validator"""
+        if validation:
+            self.validation_rules[key] = validation
+        validator = compile_validation(validation)
+        if validator:
+            self.validators[key] = validator
+        return validator
+
+    @classmethod
+    def compile_table(cls, rows):
+        """The command table of (command, response, validation) rows, as plain data
+        
+        restore_table() rebuilds the instrument add_command() and
+        link_stateful_commands() would make of the rows, without parsing
+        headers, indexing commands or grouping SET/QUERY pairs again.
+        Written into snapshots by DefinitionSnapshot.compile().
+        """
+        instrument = cls('', '', metrics=False)
+        keys = []
+        for command, response, validation in rows:
+            instrument.add_command(command, response, validation)
+            keys.append(instrument.definition_key(command)[0])
+        pairs = instrument._stateful_pairs()
+        instrument.link_stateful_commands()
+        return {
+            'keys': keys,
+            'pairs': pairs,
+            'default_values': instrument.default_values,
+            'header_index': instrument._header_index,
+            'free_form_keys': instrument._free_form_keys,
+            'mnemonic_headers': instrument._mnemonic_headers
+        }
+
+    def restore_table(self, table, rows):
+        """Build the commands of a new instrument from compile_table() data of its rows"""
+        linked = {key for pair in table['pairs'] for key in pair[1:]}
+        for key, (command, response, validation) in zip(table['keys'], rows):
+            # Handlers replaced by stateful ones below are not created; traces
+            # still are, their generators are bound to the instrument
+            if key in linked and response[:6].lower() != self.TRACE_PREFIX:
+                if '(.+)' in key:
+                    self._add_validation(key, validation)
+                self.commands[key] = None
+                continue
+            self._add_handler(key, response, validation)
+        self.default_values = table['default_values']
+        self._header_index = table['header_index']
+        self._free_form_keys = table['free_form_keys']
+        self._free_form_matcher = None
+        self._mnemonic_headers = table['mnemonic_headers']
+        self._mnemonics = None
+        self._known_headers = None
+        self._resolved_headers = None
+        for base_name, set_cmd, query_cmd in table['pairs']:
+            self.commands[set_cmd] = self._create_stateful_set(base_name, self.validators.get(set_cmd))
+            self.commands[query_cmd] = self._create_stateful_query(base_name, self.default_values[base_name])
+        self._finish_linking()
+
+    # Attributes making up the command table, rebuilt by replace_commands()
+    COMMAND_TABLE = ('commands', 'validation_rules', 'trace_generators', 'validators', 'default_values',
+                     '_header_index', '_free_form_keys', '_free_form_matcher', '_known_headers',
+                     '_resolved_headers', '_mnemonic_headers', '_mnemonics', '_linked')
+
+    def replace_commands(self, rows, keep_state=True):
+        """Swap in the command table of (command, response, validation) rows
+        
+        The table is built without holding the lock, on a stand-in with a
+        copy of the instrument's attributes; handlers only read those when
+        they run. Under the lock the new table replaces the old one and the
+        stand-in is given the instrument's own attributes, so its handlers
+        act on the instrument: every command runs against either the old or
+        the new table, and connections stay open. Settings and the error
+        queue are kept unless keep_state is False, which also resets those
+        of every open 'session' connection.
+        """
+        staged = object.__new__(type(self))
+        staged.__dict__.update(self.__dict__)
+        staged.commands = {}
+        staged.validation_rules = {}
+        staged.trace_generators = []
+        staged.validators = {}
+        staged.default_values = {}
+        staged._header_index = {}
+        staged._free_form_keys = []
+        staged._free_form_matcher = None
+        staged._mnemonic_headers = []
+        staged._mnemonics = None
+        staged._response_cache = {}
+        staged._cache_readers = {}
+        staged._add_builtin_commands()
+        for command, response, validation in rows:
+            staged.add_command(command, response, validation)
+        staged.link_stateful_commands()
+        staged._mnemonic_trie()
+        staged._build_known_headers()
+        
+        with self.lock:
+            for name in self.COMMAND_TABLE:
+                setattr(self, name, getattr(staged, name))
+            staged.__dict__ = self.__dict__
+            
+            if not keep_state:
+                self.state = {}
+                self.error_queue = ErrorQueue(maxlen=self.error_queue_depth)
+                for session in self._sessions:
+                    session.state = {}
+                    session.error_queue = ErrorQueue(maxlen=self.error_queue_depth)
+            self._clear_response_cache()
+
+    def _create_data_response(self, response):
+        """Handler for a 'block:' or 'trace:' response, or None for other responses"""
+        prefix = response[:6].lower()
+        if prefix == self.BLOCK_PREFIX:
+            return self._create_block_response(response)
+        if prefix == self.TRACE_PREFIX:
+            try:
+                return self._create_trace_response(TraceGenerator(response[len(self.TRACE_PREFIX):]))
+            except ValueError as e:
+                logger.warning(f"{self.name}: {e}; using '{response}' as a plain response")
+        return None
+
+    def _create_block_response(self, response):
+        """Create a data query returning the values of a 'block:v1,v2,...' response
+        
+        Values are parsed once; the binary block of each format and byte order
+        is built on first use and reused.
+        """
+        text = response[len(self.BLOCK_PREFIX):].strip()
+        values = array('d', (float(value) for value in text.split(',') if value.strip()))
+        blocks = {}
+        
+        def block_response(*args):
+            data_format = self.state.get('FORM:DATA', 'ASC,0')
+            if data_format == 'ASC,0':
+                return text
+            key = (data_format, self.state.get('FORM:BORD', 'NORM'))
+            block = blocks.get(key)
+            if block is None:
+                block = blocks[key] = self.format_data(values)
+            return block
+        return pure_query('FORM:DATA', 'FORM:BORD')(block_response)
+
+    def _create_trace_response(self, generator):
+        """Create a data query returning a generated trace for the current settings
+        
+        The reply for the last settings and format is kept, so repeated queries
+        with nothing changed return it without generating or formatting.
+        """
+        self.trace_generators.append(generator)
+        last = [None, None]
+        
+        def trace_response(*args):
+            state = self.state
+            key = (generator.settings(state), state.get('FORM:DATA', 'ASC,0'), state.get('FORM:BORD', 'NORM'))
+            if last[0] != key:
+                last[1] = self.format_data(generate_trace(generator.kind, key[0]))
+                last[0] = key
+            return last[1]
+        return trace_response
+
+    def _index_command(self, key):
+        """Register a command key with the dispatch index"""
+        match = self._HEADER_PATTERN.fullmatch(key)
+        if match:
+            self._header_index[match.group(1)] = key
+        elif '(' in key and key not in self._free_form_keys:
+            self._free_form_keys.append(key)
+            self._free_form_matcher = None
+
+    def _build_free_form_matcher(self):
+        """Compile the free-form patterns into a single alternation"""
+        compiled = []
+        for key in self._free_form_keys:
+            try:
+                compiled.append((key, re.compile(key)))
+            except re.error as e:
+                logger.warning(f"Ignoring invalid command pattern '{key}' for {self.name}: {e}")
+        
+        # Each pattern becomes a named group; remember where its own groups sit
+        parts = []
+        group_spans = {}
+        offset = 0
+        for i, (key, regex) in enumerate(compiled):
+            name = f'_p{i}'
+            parts.append(f'(?P<{name}>{key})')
+            group_spans[name] = (key, offset + 1, offset + 1 + regex.groups)
+            offset += 1 + regex.groups
+        
+        try:
+            combined = re.compile('|'.join(parts)) if parts else None
+            self._free_form_matcher = (combined, group_spans, None)
+        except re.error:
+            # Patterns using their own named groups or backreferences cannot be merged
+            self._free_form_matcher = (None, None, compiled)
 
-    def _create_parameterized_response(self, response_template, validation=None):
+    def _match_free_form(self, command_upper):
+        """Return (key, args) of the first free-form pattern matching the command"""
+        if self._free_form_matcher is None:
+            self._build_free_form_matcher()
+        combined, group_spans, compiled = self._free_form_matcher
+        
+        if combined is not None:
+            match = combined.fullmatch(command_upper)
+            if match:
+                key, start, end = group_spans[match.lastgroup]
+                return key, match.groups()[start:end]
+        elif compiled:
+            for key, regex in compiled:
+                match = regex.fullmatch(command_upper)
+                if match:
+                    return key, match.groups()
+        return None, ()
+
+    def _create_parameterized_response(self, response_template, validator=None):
         """Create a function for parameterized responses"""
-        def parameterized_response(*args, template=response_template, val=validation):
+        def parameterized_response(*args, template=response_template, val=validator):
             if args and val:
-                error = self._validate_generic(args[0], val)
+                error = val(args[0])
                 if error:
                     self.error_queue.append(error)
                     return ''
@@ -314,52 +1927,25 @@ class SCPIInstrument:
             
             return response
         
-        parameterized_response._validation = validation
+        parameterized_response._validation = validator
         return parameterized_response
-    
-    def _validate_generic(self, param, validation):
-        """Generic validation"""
-        if not validation:
-            return None
-        
-        if validation.startswith('range:'):
-            try:
-                _, range_str = validation.split(':', 1)
-                min_val, max_val = map(float, range_str.split(','))
-                value = float(param)
-                if not (min_val <= value <= max_val):
-                    return f'-222,"Data out of range; expected {min_val} to {max_val}, got {value}"'
-            except ValueError:
-                return f'-104,"Data type error; cannot convert \'{param}\' to number"'
-        elif validation.startswith('enum:'):
-            try:
-                _, enum_str = validation.split(':', 1)
-                valid_values = [v.strip().upper() for v in enum_str.split(',')]
-                if param.upper() not in valid_values:
-                    return f'-108,"Parameter not allowed; expected one of {valid_values}, got \'{param}\'"'
-            except Exception:
-                return f'-108,"Invalid enum format in validation rule"'
-        elif validation == 'bool':
-            if param.upper() not in ['ON', 'OFF', '1', '0']:
-                return f'-108,"Invalid boolean; expected ON/OFF/1/0, got \'{param}\'"'
-        
-        return None
 
-    def link_stateful_commands(self):
-        """Link SET/QUERY pairs"""
+    def _stateful_pairs(self):
+        """(base name, set key, query key) of each SET/QUERY pair to link"""
         command_groups = {}
         
         for cmd in self.commands.keys():
             if cmd.startswith('*') or cmd.startswith('SYST:'):
                 continue
+            # Built-in handlers (bound methods, e.g. FORM:DATA) keep their own state
+            if isinstance(getattr(self.commands[cmd], '__self__', None), SCPIInstrument):
+                continue
                 
             if '(.+)' in cmd:
                 base_name = cmd.replace(' (.+)', '').replace('(.+)', '')
                 if base_name not in command_groups:
                     command_groups[base_name] = {}
                 command_groups[base_name]['set'] = cmd
-                validation = self.validation_rules.get(cmd)
-                command_groups[base_name]['validation'] = validation
                 
             elif cmd.endswith('?'):
                 base_name = cmd[:-1]
@@ -367,116 +1953,540 @@ class SCPIInstrument:
                     command_groups[base_name] = {}
                 command_groups[base_name]['query'] = cmd
         
-        for base_name, group in command_groups.items():
-            if 'set' in group and 'query' in group:
-                set_cmd = group['set']
-                query_cmd = group['query']
-                validation = group.get('validation')
-                
-                if base_name in self.default_values:
-                    default_value = self.default_values[base_name]
-                else:
-                    original_query_handler = self.commands[query_cmd]
-                    try:
-                        default_value = original_query_handler() if callable(original_query_handler) else "0"
-                        self.default_values[base_name] = default_value
-                    except Exception:
-                        default_value = "0"
-                        self.default_values[base_name] = default_value
-                
-                self.commands[set_cmd] = self._create_stateful_set(base_name, validation)
-                self.commands[query_cmd] = self._create_stateful_query(base_name, default_value)
+        return [(base_name, group['set'], group['query']) for base_name, group in command_groups.items()
+                if 'set' in group and 'query' in group]
+
+    def link_stateful_commands(self):
+        """Link SET/QUERY pairs"""
+        for base_name, set_cmd, query_cmd in self._stateful_pairs():
+            if base_name in self.default_values:
+                default_value = self.default_values[base_name]
+            else:
+                original_query_handler = self.commands[query_cmd]
+                try:
+                    default_value = original_query_handler() if callable(original_query_handler) else "0"
+                    self.default_values[base_name] = default_value
+                except Exception:
+                    default_value = "0"
+                    self.default_values[base_name] = default_value
+            
+            self.commands[set_cmd] = self._create_stateful_set(base_name, self.validators.get(set_cmd))
+            self.commands[query_cmd] = self._create_stateful_query(base_name, default_value)
+        self._finish_linking()
+
+    def _finish_linking(self):
+        for generator in self.trace_generators:
+            generator.bind(self)
+        self._clear_response_cache()
+        
+        if self._free_form_matcher is None:
+            self._build_free_form_matcher()
+        self._linked = True
 
-    def _create_stateful_set(self, base_name, validation=None):
+    def _create_stateful_set(self, base_name, validator=None):
         """Create SET command that stores value"""
+        key = f'{base_name}_VALUE'
+        
         def set_value(*args):
             if args:
-                key = f'{base_name}_VALUE'
-                
-                if validation:
-                    error = self._validate_generic(args[0], validation)
+                if validator:
+                    error = validator(args[0])
                     if error:
                         self.error_queue.append(error)
                         return ''
                 
                 self.state[key] = args[0]
+                if key in self._cache_readers:
+                    self._invalidate(key)
                 return 'OK'
             return ''
         return set_value
 
     def _create_stateful_query(self, base_name, default_value):
         """Create QUERY command that returns stored or default value"""
+        key = f'{base_name}_VALUE'
+        
+        @pure_query(key)
         def get_value():
-            key = f'{base_name}_VALUE'
             value = self.state.get(key, default_value)
             return str(value)
         return get_value
 
-    def process_command(self, command):
-        """Process a SCPI command and return response"""
+    def process_command(self, command, session=None):
+        """Process a SCPI command and return response
+        
+        session is the caller's SCPISession in 'session' concurrency mode.
+        """
+        if self.actor is not None:
+            return self.actor.submit(self._locked_process_command, command, session)
+        return self._locked_process_command(command, session)
+
+    def execute(self, command, session=None):
+        """Process a command and return (response, reply as byte chunks, error)
+        
+        error is the newest entry of the error queue the command ran against
+        (or None), read before any other command runs. Replies of pure queries (see pure_query) on the shared state come from
+        the reply cache without running the handler or encoding anything;
+        session-mode connections always run their commands.
+        """
+        if self.actor is not None:
+            return self.actor.submit(self._locked_execute, command, session)
+        return self._locked_execute(command, session)
+
+    def _locked_execute(self, command, session):
+        with self.lock:
+            if session is None:
+                started = time.perf_counter_ns() if self.metrics is not None else None
+                cached = self._response_cache.get(command)
+                if cached is not None:
+                    # Counted like any other command; the lookup is timed as its dispatch stage
+                    self.last_command = command
+                    self.command_count += 1
+                    response, reply, key = cached
+                    if started is not None:
+                        self._record_metrics(key, started, time.perf_counter_ns())
+                    return response, reply, self._last_error(None)
+                # A miss keeps its clock running: the lookup counts towards dispatch
+                response = self._process_command(command, cache=True, started=started)
+            else:
+                response = self._locked_process_command(command, session)
+            error = self._last_error(session)
+        return response, encode_response(response), error
+
+    def _locked_process_command(self, command, session):
+        with self.lock:
+            if session is None:
+                return self._process_command(command, cache=True)
+            
+            # Run against the session's state, then put the shared state back
+            shared = self.state, self.error_queue
+            self.state, self.error_queue = session.state, session.error_queue
+            try:
+                return self._process_command(command)
+            finally:
+                self.state, self.error_queue = shared
+
+    def _process_command(self, command, cache=False, started=None):
         self.last_command = command
         self.command_count += 1
         
+        received = command
         command = command.strip()
         if not command:
             return ''
         
-        # Handle command chains
-        if ';' in command:
-            responses = []
-            for cmd in command.split(';'):
-                response = self._process_single_command(cmd.strip())
-                if response:
-                    responses.append(response)
-            return ';'.join(responses) if responses else ''
+        if ';' not in command:
+            if command[0] == ':':
+                command = command[1:]
+            return self._process_single_command(command, received if cache else None, started)
+        
+        # Compound message: a header after ';' continues the previous header's
+        # path (SENS1:FREQ:STAR 1E9;STOP 2E9) unless it starts with ':' or '*'
+        resolved = self._resolved_headers
+        if resolved is None or len(resolved) > self.RESOLVED_HEADERS_SIZE:
+            resolved = self._resolved_headers = {}
+        process = self._process_single_command
+        lookup = resolved.get
+        responses = []
+        path = ''
+        for unit in split_program_message(command):
+            unit = unit.strip()
+            if not unit:
+                continue
+            if unit[0] == '*':
+                # Common commands neither use nor change the path
+                response = process(unit)
+            else:
+                header = unit.partition(' ')[0]
+                resolution = lookup((path, header))
+                if resolution is None:
+                    resolution = resolved[path, header] = self._resolve_header(path, header)
+                prefix, path = resolution
+                if prefix:
+                    unit = prefix + unit
+                elif prefix is None:
+                    unit = unit[1:]
+                response = process(unit)
+            if response:
+                responses.append(response)
+        if any(isinstance(response, BinaryBlock) for response in responses):
+            # Binary blocks in the chain: the writer sends the parts in turn
+            return tuple(responses)
+        return ';'.join(responses)
+
+    def _resolve_header(self, path, header):
+        """Resolve a header of a compound message against the current path
+        
+        Returns the prefix to put in front of the unit (None to strip a
+        leading ':') and the path for the next unit.
+        """
+        if header[0] == ':':
+            header = header[1:]
+            prefix = None
+        else:
+            prefix = ''
+            if path:
+                # Unknown under the path: take it from the root, as 2.3 did
+                known = self._known_headers or self._build_known_headers()
+                candidate = path + header
+                if (candidate in known or candidate.upper() in known
+                        or self._mnemonic_trie().match(candidate.upper()) is not None):
+                    prefix = path
+                    header = candidate
+        return prefix, header[:header.rfind(':') + 1]
+
+    def _build_known_headers(self):
+        """Headers of all commands, for resolving relative headers
         
-        return self._process_single_command(command)
+        Free-form patterns count with their literal header, up to the first
+        regex character; the set is rebuilt after commands are added.
+        """
+        known = set()
+        for key in self.commands:
+            known.add(self._REGEX_START.split(key.partition(' ')[0], 1)[0])
+        self._known_headers = known
+        return known
 
-    def _process_single_command(self, command):
-        """Process a single SCPI command"""
+    def _process_single_command(self, command, cache_key=None, started=None):
+        """Process a single SCPI command
+        
+        With metrics enabled, the stage times are recorded under the matched
+        command key, from started if the caller's clock is already running;
+        unknown commands share the UNDEFINED_HEADER entry. The reply of a
+        pure query is cached under cache_key, if given.
+        """
+        metrics = self.metrics
+        if metrics is not None and started is None:
+            started = time.perf_counter_ns()
         command_upper = command.upper()
         
-        # Try exact match first
-        if command_upper in self.commands:
-            try:
-                handler = self.commands[command_upper]
-                result = handler()
-                return str(result) if result is not None else ''
-            except Exception as e:
-                error_msg = f'-113,"Command execution error; {command}"'
+        # Exact match first, then "HEADER <args>" by header, then free-form patterns
+        handler = self.commands.get(command_upper)
+        key = command_upper
+        args = ()
+        if handler is None:
+            header, _, params = command_upper.partition(' ')
+            key = self._header_index.get(header)
+            if key is None or not params:
+                key, args = self._match_free_form(command_upper)
+            else:
+                args = (params,)
+            if key is None:
+                key, args = self._match_mnemonics(header, params)
+            
+            if key is None:
+                error_msg = f'-113,"Undefined header; {command}"'
                 self.error_queue.append(error_msg)
+                if metrics is not None:
+                    self._record_metrics(self.UNDEFINED_HEADER, started, time.perf_counter_ns())
+                return ''
+            handler = self.commands[key]
+        
+        if metrics is not None:
+            dispatched = time.perf_counter_ns()
+        try:
+            result = handler(*args)
+            if result is None:
                 return ''
+            if not isinstance(result, (str, BinaryBlock)):
+                result = str(result)
+            if cache_key is not None:
+                reads = getattr(handler, '_reads', None)
+                if reads is not None:
+                    self._cache_response(cache_key, result, reads, key)
+            return result
+        except Exception as e:
+            logger.error(f"Error executing '{command}': {e}")
+            error_msg = f'-113,"Command execution error; {command}"'
+            self.error_queue.append(error_msg)
+            return ''
+        finally:
+            if metrics is not None:
+                self._record_metrics(key, started, dispatched, time.perf_counter_ns())
+
+    def _mnemonic_trie(self):
+        """The MnemonicTrie over all literal headers, built on first use"""
+        trie = self._mnemonics
+        if trie is None:
+            trie = MnemonicTrie()
+            for header, target in self._mnemonic_headers:
+                trie.add(header, target)
+            self._mnemonics = trie
+        return trie
+
+    def _match_mnemonics(self, header, params):
+        """Dispatch a header given in another short/long form, or (None, ())"""
+        target = self._mnemonic_trie().match(header)
+        if target is None or target == header:
+            return None, ()
+        command = f'{target} {params}' if params else target
+        if command in self.commands:
+            return command, ()
+        key = self._header_index.get(target)
+        if key is not None and params:
+            return key, (params,)
+        return self._match_free_form(command)
+
+    def _record_metrics(self, key, started, dispatched, finished=None):
+        """Add one command's stage times to the histograms of its key
+        
+        LatencyHistogram.observe() is inlined here; this runs for every command.
+        """
+        metrics = self.metrics.get(key)
+        if metrics is None:
+            metrics = self.metrics[key] = CommandMetrics()
         
-        # Try regex matching for parameterized commands
-        for pattern, handler in self.commands.items():
+        histogram, ns = metrics.dispatch, dispatched - started
+        histogram.counts[ns.bit_length()] += 1
+        histogram.total_ns += ns
+        if finished is not None:
+            histogram, ns = metrics.handler, finished - dispatched
+            histogram.counts[ns.bit_length()] += 1
+            histogram.total_ns += ns
+
+
+class FramingPolicy:
+    """How a server decides that received bytes form a complete command
+    
+    strict    - only a \\n, \\r or \\r\\n terminator ends a command
+    eoi       - unterminated input also ends after eoi_timeout_us of silence
+    immediate - unterminated input ends as soon as it is a complete program message
+    """
+
+    MODES = ('strict', 'eoi', 'immediate')
+    DEFAULT_EOI_TIMEOUT_US = 300000
+
+    def __init__(self, mode='eoi', eoi_timeout_us=DEFAULT_EOI_TIMEOUT_US):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown framing policy '{mode}'; expected one of {list(self.MODES)}")
+        if eoi_timeout_us < 0:
+            raise ValueError(f"EOI timeout must not be negative, got {eoi_timeout_us}")
+        self.mode = mode
+        self.eoi_timeout_us = eoi_timeout_us
+
+    @classmethod
+    def from_spec(cls, spec, eoi_timeout_us=DEFAULT_EOI_TIMEOUT_US):
+        """Parse 'strict', 'immediate', 'eoi' or 'eoi:<microseconds>'"""
+        mode, _, timeout = spec.strip().lower().partition(':')
+        if timeout:
+            if mode != 'eoi':
+                raise ValueError(f"Only the eoi framing policy takes a timeout, got '{spec}'")
             try:
-                if '(' in pattern:
-                    match = re.fullmatch(pattern, command_upper)
-                    if match:
-                        args = match.groups()
-                        result = handler(*args)
-                        return str(result) if result is not None else ''
-            except Exception as e:
-                logger.error(f"Error in regex matching for '{command}': {e}")
-                continue
+                eoi_timeout_us = int(timeout)
+            except ValueError:
+                raise ValueError(f"Invalid EOI timeout in framing policy '{spec}'")
+        return cls(mode, eoi_timeout_us)
+
+    @property
+    def idle_timeout(self):
+        """Seconds of silence after which unterminated input is executed, or None"""
+        if self.mode == 'eoi':
+            return self.eoi_timeout_us / 1e6
+        return None
+
+    def __str__(self):
+        if self.mode == 'eoi':
+            return f'eoi:{self.eoi_timeout_us}'
+        return self.mode
+
+
+class SCPIFramer:
+    """Splits a client byte stream into SCPI program messages
+    
+    Received bytes are written straight into a preallocated bytearray
+    (get_buffer()/commit() suit socket.recv_into and asyncio.BufferedProtocol).
+    Consumed commands are never sliced off the front: the buffer is only
+    compacted when its free tail runs out, and each terminator scan resumes
+    where the previous one stopped, so a burst of n bytes costs O(n).
+    """
+
+    _TERMINATOR = re.compile(rb'[\r\n]')
+
+    def __init__(self, size=16384):
+        self._data = bytearray(size)
+        self._view = memoryview(self._data)
+        self._start = 0  # first byte not yet returned as a command
+        self._end = 0    # end of received data
+        self._scan = 0   # bytes before this hold no terminator
+
+    @property
+    def pending(self):
+        """True if unterminated input is buffered"""
+        return self._end > self._start
+
+    def get_buffer(self, min_size=4096):
+        """Return a writable view of at least min_size free bytes"""
+        if len(self._data) - self._end < min_size:
+            self._make_room(min_size)
+        return self._view[self._end:]
+
+    def commit(self, nbytes):
+        """Mark nbytes written into the view from get_buffer() as received"""
+        self._end += nbytes
+
+    def _make_room(self, min_size):
+        pending = self._end - self._start
+        size = len(self._data)
         
-        # Command not found
-        error_msg = f'-113,"Undefined header; {command}"'
-        self.error_queue.append(error_msg)
-        return ''
+        if self._start >= pending and size - pending >= min_size:
+            # Slide the remainder to the front; source and target don't overlap
+            self._data[:pending] = self._view[self._start:self._end]
+        else:
+            while size - pending < min_size:
+                size *= 2
+            data = bytearray(size)
+            data[:pending] = self._view[self._start:self._end]
+            self._data = data
+            self._view = memoryview(data)
+        
+        self._scan -= self._start
+        self._start = 0
+        self._end = pending
+
+    def feed(self, data, immediate=False):
+        """Append received bytes and return the complete commands"""
+        nbytes = len(data)
+        self.get_buffer(nbytes)[:nbytes] = data
+        self.commit(nbytes)
+        return self.pop_commands(immediate)
+
+    def pop_commands(self, immediate=False):
+        """Return the commands completed by received data
+        
+        With immediate=True an unterminated remainder that already forms a
+        complete program message is returned as well (see take_complete).
+        """
+        commands = []
+        data = self._data
+        end = self._end
+        search = self._TERMINATOR.search
+        
+        match = search(data, self._scan, end)
+        while match:
+            pos = match.start()
+            command = self._decode(self._start, pos)
+            
+            # \r\n is one terminator; a lone \r or \n ends a command as well
+            pos += 1
+            if data[pos - 1] == 13 and pos < end and data[pos] == 10:
+                pos += 1
+            self._start = pos
+            
+            if command:
+                commands.append(command)
+            match = search(data, pos, end)
+        
+        if self._start == end:
+            self._start = self._end = self._scan = 0
+        else:
+            self._scan = end
+            if immediate:
+                command = self.take_complete()
+                if command:
+                    commands.append(command)
+        
+        return commands
+
+    def _decode(self, start, end):
+        try:
+            return str(self._view[start:end], 'utf-8').strip()
+        except UnicodeDecodeError:
+            return ''
+
+    def flush(self):
+        """Return the unterminated remainder as a command (idle timeout)"""
+        command = self._decode(self._start, self._end)
+        self._start = self._end = self._scan = 0
+        return command
+
+    def take_complete(self):
+        """Return the unterminated remainder if it is a complete program message
+        
+        A remainder is complete when it decodes cleanly, has no open string
+        literal and does not end in a separator that announces more input.
+        Otherwise it stays buffered and '' is returned.
+        """
+        try:
+            text = str(self._view[self._start:self._end], 'utf-8')
+        except UnicodeDecodeError:
+            return ''  # possibly a multi-byte character split across reads
+        
+        command = text.strip()
+        if not command or command[-1] in ';:,#':
+            return ''
+        
+        quote = None
+        for char in command:
+            if quote:
+                if char == quote:
+                    quote = None
+            elif char == '"' or char == "'":
+                quote = char
+        if quote:
+            return ''
+        
+        self._start = self._end = self._scan = 0
+        return command
+
+
+# Most buffers a single sendmsg() accepts (IOV_MAX on Linux and macOS)
+SEND_IOV_MAX = 1024
+
+
+def send_chunks(sock, chunks):
+    """Write byte chunks to a blocking socket in order, in as few calls as possible"""
+    if len(chunks) == 1:
+        sock.sendall(chunks[0])
+        return
+    if not hasattr(sock, 'sendmsg'):
+        # No scatter/gather I/O on Windows
+        sock.sendall(b''.join(chunks))
+        return
+    
+    views = [memoryview(chunk) for chunk in chunks]
+    first = 0
+    while first < len(views):
+        sent = sock.sendmsg(views[first:first + SEND_IOV_MAX])
+        while sent:
+            length = views[first].nbytes
+            if sent >= length:
+                sent -= length
+                first += 1
+            else:
+                views[first] = views[first][sent:]
+                sent = 0
 
 
 class SCPIServer:
     """TCP server for a single SCPI instrument"""
 
-    def __init__(self, instrument, manager, host='localhost', port=5555):
+    # Seconds stop() waits for connections to finish their current commands
+    DRAIN_TIMEOUT = 2.0
+    
+    # Seconds a reply write may wait for the client to read; reads poll with
+    # their own short timeout (stop() checks, EOI flushes)
+    WRITE_TIMEOUT = 60.0
+
+    def __init__(self, instrument, manager, host='localhost', port=5555, framing=None, batch_writes=True,
+                 reuse_port=False):
         self.instrument = instrument
         self.manager = manager  # Store the manager
         self.host = host
         self.port = port
+        self.framing = framing or FramingPolicy()
+        
+        # Bind with SO_REUSEPORT so replicas in other processes share the port
+        self.reuse_port = reuse_port
+        
+        # Send the replies to one received burst together instead of one write each
+        self.batch_writes = batch_writes
+        
+        # Reply write latency, recorded when the instrument collects metrics
+        self.write_metrics = WriteMetrics() if instrument.metrics is not None else None
         self.socket = None
         self.running = False
         self.clients = []
+        self.handlers = []
         self.thread = None
         
     def start(self):
@@ -484,8 +2494,11 @@ class SCPIServer:
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.socket.bind((self.host, self.port))
             self.socket.listen(5)
+            self.port = self.socket.getsockname()[1]
             self.running = True
             
             self.thread = threading.Thread(target=self._server_loop, daemon=True)
@@ -498,25 +2511,69 @@ class SCPIServer:
             logger.error(f"Failed to start server for {self.instrument.name}: {e}")
             return False
 
-    def stop(self):
-        """Stop the TCP server"""
+    def stop(self, drain_timeout=DRAIN_TIMEOUT):
+        """Stop the TCP server, draining its connections
+        
+        The listening socket is shut down so the accept thread returns and
+        the port can be bound again at once. Clients stop reading, finish the
+        commands they already received and send those replies before their
+        connections close; connections still busy after drain_timeout seconds
+        are closed anyway.
+        """
+        self.begin_stop(drain_timeout)
+        self.finish_stop(time.monotonic() + drain_timeout)
+
+    def begin_stop(self, drain_timeout=DRAIN_TIMEOUT):
+        """First half of stop(): close the listener and start draining the clients
+        
+        Does not wait for the drain, so stopping many servers can let their
+        clients drain side by side before finish_stop() waits for each.
+        """
         self.running = False
         
+        if self.socket:
+            try:
+                # Closing alone does not wake a thread blocked in accept()
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(drain_timeout)
+        
         for client in self.clients[:]:
             try:
-                client.close()
-            except:
+                client.shutdown(socket.SHUT_RD)
+            except OSError:
                 pass
-        self.clients.clear()
+
+    def finish_stop(self, deadline):
+        """Second half of stop(): wait until deadline (time.monotonic()) for the drain, then close"""
+        for handler in self.handlers[:]:
+            handler.join(max(0.0, deadline - time.monotonic()))
         
-        if self.socket:
+        for client in self.clients[:]:
             try:
-                self.socket.close()
-            except:
+                # Wakes a handler still blocked writing to a client that does not read
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                client.close()
+            except OSError:
                 pass
+        self.clients.clear()
         
         logger.info(f"Stopped SCPI server for '{self.instrument.name}'")
 
+    def restart(self):
+        """Drain the connections and bind the port again (see stop)"""
+        self.stop()
+        return self.start()
+
     def _server_loop(self):
         """Main server loop"""
         while self.running:
@@ -529,6 +2586,7 @@ class SCPIServer:
                     args=(client_socket, address),
                     daemon=True
                 )
+                self.handlers.append(client_thread)
                 client_thread.start()
                 
             except socket.error:
@@ -536,253 +2594,456 @@ class SCPIServer:
                     logger.error(f"Server socket error for {self.instrument.name}")
                 break
 
+    def _execute(self, command, session=None):
+        """Run one received command, log it and return the reply as byte chunks"""
+        response, reply, error = self.instrument.execute(command, session)
+        text = response_text(response) if response else '(no response)'
+        
+        # Log to web dashboard
+        command_logger.log_command(
+            self.instrument.name, 
+            command, 
+            text, 
+            error
+        )
+        
+        # Queue for web clients; never blocks the instrument reply
+        dashboard = getattr(self.manager, 'web_dashboard', None)
+        if dashboard is not None:
+            dashboard.emit_command_update(self.instrument.name, command, text, error)
+        
+        return reply
+
+    def _send(self, client_socket, replies, write_times):
+        """Write replies to a client, timing the write if metrics are on
+        
+        The read loop sets its poll timeout again before every read.
+        """
+        client_socket.settimeout(self.WRITE_TIMEOUT)
+        if write_times is None:
+            send_chunks(client_socket, replies)
+            return
+        started = time.perf_counter_ns()
+        send_chunks(client_socket, replies)
+        write_times.observe(time.perf_counter_ns() - started)
+
     def _handle_client(self, client_socket, address):
         """Handle individual client connection"""
         self.clients.append(client_socket)
+        write_times = None
+        if self.write_metrics is not None:
+            write_times = self.write_metrics.connection_opened()
+        
+        try:
+            # Simulate VISA device clear; a fresh session is already clear
+            session = self.instrument.open_session()
+            if session is None:
+                self.instrument.visa_device_clear()
+            
+            framer = SCPIFramer()
+            idle_timeout = self.framing.idle_timeout
+            immediate = self.framing.mode == 'immediate'
+            last_activity = time.monotonic()
+            
+            while self.running:
+                try:
+                    # Poll at 0.1 s so stop() is noticed, sooner if an EOI flush is due
+                    timeout = 0.1
+                    if framer.pending and idle_timeout is not None:
+                        remaining = idle_timeout - (time.monotonic() - last_activity)
+                        if remaining <= 0:
+                            command = framer.flush()
+                            if command:
+                                reply = self._execute(command, session)
+                                if reply:
+                                    self._send(client_socket, reply, write_times)
+                            continue
+                        timeout = min(timeout, remaining)
+                    client_socket.settimeout(timeout)
+                    
+                    try:
+                        nbytes = client_socket.recv_into(framer.get_buffer())
+                        if not nbytes:
+                            break
+                        framer.commit(nbytes)
+                        last_activity = time.monotonic()
+                        
+                    except socket.timeout:
+                        continue
+                    
+                    # Check for terminated commands
+                    replies = []
+                    for command in framer.pop_commands(immediate):
+                        reply = self._execute(command, session)
+                        if reply:
+                            if self.batch_writes:
+                                replies.extend(reply)
+                            else:
+                                self._send(client_socket, reply, write_times)
+                    if replies:
+                        self._send(client_socket, replies, write_times)
+                    
+                except ConnectionResetError:
+                    break
+                except Exception as e:
+                    if self.running:
+                        logger.error(f"Client handling error: {e}")
+                    break
+                    
+        except Exception as e:
+            logger.error(f"Client {address} error: {e}")
+        finally:
+            client_socket.close()
+            if client_socket in self.clients:
+                self.clients.remove(client_socket)
+            if write_times is not None:
+                self.write_metrics.connection_closed(write_times)
+            try:
+                self.handlers.remove(threading.current_thread())
+            except ValueError:
+                pass
+
+
+class SCPIEventLoop:
+    """Single asyncio event loop thread shared by all async instrument servers"""
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.loop is not None and self.loop.is_running()
+
+    def start(self):
+        """Start the loop thread if it is not already running"""
+        if self.running:
+            return
+        
+        import asyncio
+        
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.call_soon(ready.set)
+            self.loop.run_forever()
+        
+        self.thread = threading.Thread(target=run, name='scpi-event-loop', daemon=True)
+        self.thread.start()
+        ready.wait()
+        logger.info("Started asyncio event loop for SCPI servers")
+
+    def run(self, coro, timeout=10):
+        """Run a coroutine on the loop from another thread and wait for its result"""
+        return self.submit(coro).result(timeout)
+
+    def submit(self, coro):
+        """Schedule a coroutine on the loop from another thread; returns its concurrent.futures.Future"""
+        import asyncio
+        
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        """Stop the loop thread"""
+        if not self.running:
+            return
+        
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        self.loop.close()
+        self.loop = None
+        logger.info("Stopped asyncio event loop for SCPI servers")
+
+
+class SCPIClientProtocol:
+    """asyncio protocol for one client connection of an AsyncSCPIServer
+    
+    asyncio is only imported in async mode, so the class the server uses,
+    with asyncio.BufferedProtocol as a base, is made by protocol_class().
+    """
+
+    _protocol_class = None
+
+    @classmethod
+    def protocol_class(cls):
+        if cls._protocol_class is None:
+            import asyncio
+            cls._protocol_class = type(cls.__name__, (cls, asyncio.BufferedProtocol), {})
+        return cls._protocol_class
+
+    def __init__(self, server):
+        self.server = server
+        self.framer = SCPIFramer()
+        self.transport = None
+        self.idle_handle = None
+        self.session = None
+        self.write_times = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.clients.append(transport)
+        if self.server.write_metrics is not None:
+            self.write_times = self.server.write_metrics.connection_opened()
+        logger.info(f"Client connected to {self.server.instrument.name} from {transport.get_extra_info('peername')}")
+        
+        # Simulate VISA device clear; a fresh session is already clear
+        self.session = self.server.instrument.open_session()
+        if self.session is None:
+            self.server.instrument.visa_device_clear()
+
+    def get_buffer(self, sizehint):
+        return self.framer.get_buffer(max(sizehint, 4096))
+
+    def buffer_updated(self, nbytes):
+        if self.idle_handle is not None:
+            self.idle_handle.cancel()
+            self.idle_handle = None
+        
+        framing = self.server.framing
+        try:
+            self.framer.commit(nbytes)
+            replies = []
+            for command in self.framer.pop_commands(framing.mode == 'immediate'):
+                reply = self.server._execute(command, self.session)
+                if reply:
+                    if self.server.batch_writes:
+                        replies.extend(reply)
+                    else:
+                        self._write(reply)
+            if replies:
+                self._write(replies)
+        except Exception as e:
+            logger.error(f"Client handling error: {e}")
+            self.transport.close()
+            return
+        
+        if self.framer.pending and framing.idle_timeout is not None:
+            self.idle_handle = self.server.event_loop.loop.call_later(framing.idle_timeout, self._idle_flush)
+
+    def _idle_flush(self):
+        self.idle_handle = None
+        command = self.framer.flush()
+        if command:
+            self._respond(command)
+
+    def _respond(self, command):
+        reply = self.server._execute(command, self.session)
+        if reply:
+            self._write(reply)
+
+    def _write(self, replies):
+        """Queue replies on the transport, timing the write if metrics are on"""
+        if self.write_times is None:
+            self.transport.writelines(replies)
+            return
+        started = time.perf_counter_ns()
+        self.transport.writelines(replies)
+        self.write_times.observe(time.perf_counter_ns() - started)
+
+    def connection_lost(self, exc):
+        if self.idle_handle is not None:
+            self.idle_handle.cancel()
+        if self.transport in self.server.clients:
+            self.server.clients.remove(self.transport)
+        if self.write_times is not None:
+            self.server.write_metrics.connection_closed(self.write_times)
+            self.write_times = None
+
+
+class AsyncSCPIServer(SCPIServer):
+    """SCPI server whose connections are served by the manager's shared event loop"""
+
+    def __init__(self, instrument, manager, host='localhost', port=5555, framing=None, batch_writes=True,
+                 reuse_port=False, event_loop=None):
+        super().__init__(instrument, manager, host, port, framing, batch_writes, reuse_port)
+        self.event_loop = event_loop
+        self.server = None
+        self.closing = None
+
+    def start(self):
+        """Start listening on the shared event loop"""
+        try:
+            self.event_loop.start()
+            self.server = self.event_loop.run(self._create_server())
+            self.port = self.server.sockets[0].getsockname()[1]
+            self.running = True
+            
+            logger.info(f"Started async SCPI server for '{self.instrument.name}' on {self.host}:{self.port}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to start server for {self.instrument.name}: {e}")
+            return False
+
+    async def _create_server(self):
+        protocol_class = SCPIClientProtocol.protocol_class()
+        return await self.event_loop.loop.create_server(
+            lambda: protocol_class(self),
+            self.host,
+            self.port,
+            reuse_address=True,
+            reuse_port=self.reuse_port or None,
+            backlog=5
+        )
+
+    def stop(self, drain_timeout=SCPIServer.DRAIN_TIMEOUT):
+        """Stop listening and close all client connections once their queued replies are written"""
+        self.begin_stop(drain_timeout)
+        self.finish_stop(time.monotonic() + drain_timeout)
+
+    def begin_stop(self, drain_timeout=SCPIServer.DRAIN_TIMEOUT):
+        """Schedule closing the server on the loop without waiting for it (see SCPIServer.begin_stop)"""
+        self.running = False
+        
+        if self.server is not None and self.event_loop.running:
+            self.closing = self.event_loop.submit(self._close_server())
+
+    def finish_stop(self, deadline):
+        """Wait until deadline (time.monotonic()) for the server to close"""
+        if self.closing is not None:
+            try:
+                self.closing.result(max(0.0, deadline - time.monotonic()))
+            except Exception as e:
+                logger.error(f"Error stopping server for {self.instrument.name}: {e!r}")
+            self.closing = None
+        self.server = None
+        self.clients.clear()
         
+        logger.info(f"Stopped SCPI server for '{self.instrument.name}'")
+
+    async def _close_server(self):
+        self.server.close()
+        for transport in self.clients[:]:
+            transport.close()
+        await self.server.wait_closed()
+
+
+_flask = None
+
+
+def load_flask():
+    """(flask, flask_socketio) if both are installed, else None; imported when a dashboard is created"""
+    global _flask
+    if _flask is None:
         try:
-            # Simulate VISA device clear
-            self.instrument.visa_device_clear()
-            
-            buffer = b''
-            last_activity = time.time()
-            
-            while self.running:
-                try:
-                    client_socket.settimeout(0.1)
-                    
-                    try:
-                        data = client_socket.recv(1024)
-                        if not data:
-                            break
-                        
-                        buffer += data
-                        last_activity = time.time()
-                        
-                    except socket.timeout:
-                        current_time = time.time()
-                        if buffer and (current_time - last_activity) > 0.3:
-                            try:
-                                command = buffer.decode('utf-8').strip()
-                                if command:
-                                    response = self.instrument.process_command(command)
-                                    
-                                    # Log to web dashboard
-                                    error = None
-                                    if self.instrument.error_queue:
-                                        error = self.instrument.error_queue[-1]
-                                    
-                                    command_logger.log_command(
-                                        self.instrument.name, 
-                                        command, 
-                                        response or '(no response)', 
-                                        error
-                                    )
-                                    
-                                    # Emit to web clients
-                                    if HAS_FLASK and hasattr(self.manager, 'web_dashboard') and self.manager.web_dashboard:
-                                        self.manager.web_dashboard.socketio.emit('command_update', {
-                                            'timestamp': time.time(),
-                                            'time_str': datetime.fromtimestamp(time.time()).strftime('%H:%M:%S'),
-                                            'instrument': self.instrument.name,
-                                            'command': command,
-                                            'response': response or '(no response)',
-                                            'error': error
-                                        })
-                                    
-                                    if response:
-                                        response_msg = response + '\n'
-                                        client_socket.sendall(response_msg.encode('utf-8'))
-                                    
-                                buffer = b''
-                                last_activity = current_time
-                            except UnicodeDecodeError:
-                                buffer = b''
-                        continue
-                    
-                    # Check for terminated commands
-                    while True:
-                        terminator_pos = -1
-                        terminator_len = 0
-                        
-                        for term, length in [(b'\r\n', 2), (b'\n', 1), (b'\r', 1)]:
-                            pos = buffer.find(term)
-                            if pos != -1:
-                                terminator_pos = pos
-                                terminator_len = length
-                                break
-                        
-                        if terminator_pos == -1:
-                            break
-                        
-                        command_bytes = buffer[:terminator_pos]
-                        buffer = buffer[terminator_pos + terminator_len:]
-                        
-                        try:
-                            command = command_bytes.decode('utf-8').strip()
-                            if command:
-                                response = self.instrument.process_command(command)
-                                
-                                # Log to web dashboard
-                                error = None
-                                if self.instrument.error_queue:
-                                    error = self.instrument.error_queue[-1]
-                                
-                                command_logger.log_command(
-                                    self.instrument.name, 
-                                    command, 
-                                    response or '(no response)', 
-                                    error
-                                )
-                                
-                                # Emit to web clients
-                                if HAS_FLASK and hasattr(self.manager, 'web_dashboard') and self.manager.web_dashboard:
-                                    self.manager.web_dashboard.socketio.emit('command_update', {
-                                        'timestamp': time.time(),
-                                        'time_str': datetime.fromtimestamp(time.time()).strftime('%H:%M:%S'),
-                                        'instrument': self.instrument.name,
-                                        'command': command,
-                                        'response': response or '(no response)',
-                                        'error': error
-                                    })
-                                
-                                if response:
-                                    response_msg = response + '\n'
-                                    client_socket.sendall(response_msg.encode('utf-8'))
-                                
-                        except UnicodeDecodeError:
-                            continue
-                    
-                except ConnectionResetError:
-                    break
-                except Exception as e:
-                    logger.error(f"Client handling error: {e}")
-                    break
-                    
-        except Exception as e:
-            logger.error(f"Client {address} error: {e}")
-        finally:
-            client_socket.close()
-            if client_socket in self.clients:
-                self.clients.remove(client_socket)
+            import flask
+            import flask_socketio
+            _flask = (flask, flask_socketio)
+        except ImportError:
+            logger.warning("Flask not installed. Web dashboard will be disabled.")
+            logger.info("Install with: pip install flask flask-socketio")
+            _flask = False
+    return _flask or None
 
 
 class WebDashboard:
     """Flask-based web dashboard for SCPI emulator"""
     
     def __init__(self, emulator_manager, host='0.0.0.0', port=8081):
-        if not HAS_FLASK:
+        flask_modules = load_flask()
+        if flask_modules is None:
             logger.error("Flask not available. Web dashboard disabled.")
             return
+        self.flask, flask_socketio = flask_modules
             
         self.manager = emulator_manager
         self.host = host
         self.port = port
         
         # Create Flask app
-        self.app = Flask(__name__)
+        self.app = self.flask.Flask(__name__)
         self.app.config['SECRET_KEY'] = 'scpi_emulator_secret_key'
-        self.socketio = SocketIO(self.app, cors_allowed_origins="*")
+        self.socketio = flask_socketio.SocketIO(self.app, cors_allowed_origins="*")
+        self.events = DashboardEventQueue(self.socketio.emit)
         
         self._setup_routes()
         self._setup_socketio()
         
     def _setup_routes(self):
         """Setup Flask routes"""
+        flask = self.flask
         
         @self.app.route('/')
         def dashboard():
-            return render_template('dashboard.html')
+            return flask.render_template('dashboard.html')
         
         @self.app.route('/api/status')
         def api_status():
             """Get system status"""
-            instruments = []
-            for inst_id, inst_data in self.manager.instruments.items():
-                instrument = inst_data['instrument']
-                port = inst_data['port']
-                server = self.manager.servers.get(inst_id)
-                
-                instruments.append({
-                    'id': inst_id,
-                    'name': instrument.name,
-                    'port': port,
-                    'running': server is not None and server.running,
-                    'clients': len(server.clients) if server else 0,
-                    'commands': instrument.command_count,
-                    'errors': len(instrument.error_queue),
-                    'state': dict(instrument.state)
-                })
+            instruments = self.manager.instrument_status()
             
-            return jsonify({
+            return flask.jsonify({
                 'instruments': instruments,
                 'stats': command_logger.get_stats(),
                 'system': {
                     'total_instruments': len(self.manager.instruments),
-                    'running_servers': len(self.manager.servers),
+                    'running_servers': sum(1 for instrument in instruments if instrument['running']),
+                    'dashboard_events': self.events.get_stats(),
                     'timestamp': time.time()
                 }
             })
         
+        @self.app.route('/metrics')
+        def metrics():
+            """Latency histograms and gauges for Prometheus scrapers"""
+            return flask.Response(render_metrics(self.manager.metric_samples()), mimetype='text/plain; version=0.0.4')
+        
         @self.app.route('/api/commands')
         def api_commands():
             """Get recent commands"""
-            return jsonify(command_logger.get_recent_entries())
+            return flask.jsonify(command_logger.get_recent_entries())
         
         @self.app.route('/api/restart/<instrument_id>', methods=['POST'])
         def api_restart_instrument(instrument_id):
             """Restart a specific instrument"""
             try:
-                if instrument_id in self.manager.servers:
-                    server = self.manager.servers[instrument_id]
-                    server.stop()
-                    time.sleep(0.5)
-                    
-                    if server.start():
-                        return jsonify({'status': 'success', 'message': f'Restarted {instrument_id}'})
-                    else:
-                        return jsonify({'status': 'error', 'message': f'Failed to restart {instrument_id}'}), 500
+                restarted = self.manager.restart_server(instrument_id)
+                if restarted is None:
+                    return flask.jsonify({'status': 'error', 'message': f'Instrument {instrument_id} not found'}), 404
+                if restarted:
+                    return flask.jsonify({'status': 'success', 'message': f'Restarted {instrument_id}'})
                 else:
-                    return jsonify({'status': 'error', 'message': f'Instrument {instrument_id} not found'}), 404
+                    return flask.jsonify({'status': 'error', 'message': f'Failed to restart {instrument_id}'}), 500
                     
             except Exception as e:
-                return jsonify({'status': 'error', 'message': str(e)}), 500
+                return flask.jsonify({'status': 'error', 'message': str(e)}), 500
         
         @self.app.route('/api/stop_all', methods=['POST'])
         def api_stop_all():
             """Stop all instruments"""
             try:
                 self.manager.stop_all_servers()
-                return jsonify({'status': 'success', 'message': 'All servers stopped'})
+                return flask.jsonify({'status': 'success', 'message': 'All servers stopped'})
             except Exception as e:
-                return jsonify({'status': 'error', 'message': str(e)}), 500
+                return flask.jsonify({'status': 'error', 'message': str(e)}), 500
         
         @self.app.route('/api/start_all', methods=['POST'])
         def api_start_all():
             """Start all instruments"""
             try:
                 if self.manager.start_all_servers():
-                    return jsonify({'status': 'success', 'message': 'All servers started'})
+                    return flask.jsonify({'status': 'success', 'message': 'All servers started'})
                 else:
-                    return jsonify({'status': 'error', 'message': 'Failed to start some servers'}), 500
+                    return flask.jsonify({'status': 'error', 'message': 'Failed to start some servers'}), 500
             except Exception as e:
-                return jsonify({'status': 'error', 'message': str(e)}), 500
+                return flask.jsonify({'status': 'error', 'message': str(e)}), 500
             
         @self.app.route('/api/send_command/<instrument_id>', methods=['POST'])
         def api_send_command(instrument_id):
             try:
-                if instrument_id not in self.manager.servers:
-                    return jsonify({'status': 'error', 'message': f'Instrument {instrument_id} not found'}), 404
-                command = request.json.get('command', '').strip()
+                command = flask.request.json.get('command', '').strip()
                 if not command:
-                    return jsonify({'status': 'error', 'message': 'No command provided'}), 400
-                server = self.manager.servers[instrument_id]
-                response = server.instrument.process_command(command)
-                error = server.instrument.error_queue[-1] if server.instrument.error_queue else None
-                self.manager.web_dashboard.emit_command_update(server.instrument.name, command, response or '(no response)', error)
-                return jsonify({'status': 'success', 'message': 'Command sent', 'response': response, 'error': error})
+                    return flask.jsonify({'status': 'error', 'message': 'No command provided'}), 400
+                result = self.manager.send_command(instrument_id, command)
+                if result is None:
+                    return flask.jsonify({'status': 'error', 'message': f'Instrument {instrument_id} not found'}), 404
+                name, response, error = result
+                self.manager.web_dashboard.emit_command_update(name, command, response or '(no response)', error)
+                return flask.jsonify({'status': 'success', 'message': 'Command sent', 'response': response, 'error': error})
             except Exception as e:
-                return jsonify({'status': 'error', 'message': str(e)}), 500
+                return flask.jsonify({'status': 'error', 'message': str(e)}), 500
 
 
     
@@ -798,23 +3059,18 @@ class WebDashboard:
             logger.info("Web client disconnected")
     
     def emit_command_update(self, instrument_name, command, response, error=None):
-        """Emit real-time command update to web clients"""
-        if hasattr(self, 'socketio'):
-            self.socketio.emit('command_update', {
-                'timestamp': time.time(),
-                'instrument': instrument_name,
-                'command': command,
-                'response': response,
-                'error': error
-            })
+        """Queue a real-time command update for web clients"""
+        if hasattr(self, 'events'):
+            self.events.publish(instrument_name, command, response, error)
     
     def start(self):
         """Start the web dashboard"""
-        if not HAS_FLASK:
+        if not hasattr(self, 'app'):
             logger.warning("Flask not available. Web dashboard not started.")
             return False
             
         try:
+            create_dashboard_template()
             logger.info(f"Starting web dashboard on http://{self.host}:{self.port}")
             
             # Start in a separate thread
@@ -829,6 +3085,7 @@ class WebDashboard:
                 daemon=True
             )
             dashboard_thread.start()
+            self.events.start()
             
             # Give it a moment to start
             time.sleep(1)
@@ -839,16 +3096,112 @@ class WebDashboard:
             logger.error(f"Failed to start web dashboard: {e}")
             return False
 
+    def stop(self):
+        """Stop publishing command events; the Flask server thread is a daemon and ends with the process"""
+        self.events.stop()
+
+
+def run_in_parallel(function, items, threads=32):
+    """function(item) for every item, in order, run on up to threads threads
+    
+    For calls that mostly wait, such as control calls to worker processes.
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [function(item) for item in items]
+    from concurrent.futures import ThreadPoolExecutor
+    
+    with ThreadPoolExecutor(max_workers=min(threads, len(items))) as pool:
+        return list(pool.map(function, items))
+
+
+class DefinitionWatcher:
+    """Polls a configuration file and reloads it into a manager when it changes
+    
+    A change is applied once the file's size and mtime have stayed the same
+    for one poll, so a file that is still being written is not read half way.
+    """
+
+    def __init__(self, manager, file_path, port_start=5555, interval=1.0, keep_state=True):
+        self.manager = manager
+        self.file_path = file_path
+        self.port_start = port_start
+        self.interval = interval
+        self.keep_state = keep_state
+        self.loaded = self._stat()
+        self._stopped = threading.Event()
+        self.thread = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.file_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='definition-watcher', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        pending = None
+        while not self._stopped.wait(self.interval):
+            current = self._stat()
+            if current is None or current == self.loaded:
+                pending = None
+            elif current != pending:
+                pending = current
+            else:
+                self.loaded = current
+                pending = None
+                try:
+                    self.manager.reload_from_file(self.file_path, self.port_start, self.keep_state)
+                except Exception as e:
+                    logger.error(f"Error reloading {self.file_path}: {e}")
+
 
 class SCPIEmulatorManager:
     """Manages multiple SCPI instrument emulators with web dashboard"""
 
-    def __init__(self):
+    def __init__(self, server_mode='thread', framing=None, batch_writes=True, concurrency='lock', metrics=True,
+                 error_queue_depth=ErrorQueue.DEFAULT_DEPTH, replicas=1):
         self.instruments = {}
         self.servers = {}
         self.running = False
+        self.host = 'localhost'
         self.web_dashboard = None
         
+        # Framing policy for instruments without a Framing column entry
+        self.framing = framing or FramingPolicy()
+        self.batch_writes = batch_writes
+        
+        # Concurrency mode for instruments without a Concurrency column entry
+        self.concurrency = concurrency
+        
+        # Record per-command stage and socket write latencies for /metrics
+        self.metrics = metrics
+        
+        # Entries each instrument's error queue holds before reporting overflow
+        self.error_queue_depth = error_queue_depth
+        
+        # Processes serving each instrument without a Replicas column entry
+        self.replicas = replicas
+        
+        # Instrument ids a worker process serves out of the file; None for all
+        self.shard = None
+        
+        # Whether replicas are served by separate worker processes; only then
+        # can a client land on any replica and needs 'session' concurrency
+        self.spread_replicas = False
+        self.watcher = None
+        
+        # 'thread': one thread per client, 'async': one event loop for all ports
+        self.server_mode = server_mode
+        self.event_loop = SCPIEventLoop() if server_mode == 'async' else None
+        
         # Register signal handlers
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
@@ -856,86 +3209,159 @@ class SCPIEmulatorManager:
     def _signal_handler(self, signum, frame):
         """Handle shutdown signals"""
         logger.info("Received shutdown signal, stopping servers...")
-        self.stop_all_servers()
+        self.shutdown()
         sys.exit(0)
 
-    def load_from_file(self, file_path, port_start=5555):
-        """Load instrument definitions from Excel or CSV file"""
+    def shutdown(self):
+        """Stop the file watcher, all servers and the web dashboard's event publisher"""
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        self.stop_all_servers()
+        if self.web_dashboard is not None:
+            self.web_dashboard.stop()
+
+    def _read_definitions(self, file_path, port_start):
+        """Instrument definitions of a configuration file, streamed
+        
+        Yields (instrument_id, settings, rows, table) per instrument: settings
+        holds its name, port, framing, concurrency and replicas, rows its
+        (command, response, validation) tuples, table its compiled command
+        table when read from a snapshot, else None. Raises ValueError when
+        the file cannot be read.
+        """
+        file_path_obj = Path(file_path)
+        
+        if not file_path_obj.exists():
+            raise ValueError(f"File not found: {file_path}")
+        
+        # Stream rows based on file type
+        if file_path_obj.suffix.lower() not in ('.csv', '.xlsx', '.xls'):
+            raise ValueError(f"Unsupported file type: {file_path_obj.suffix}")
+        
+        # A compiled snapshot (--compile) replaces parsing the source;
+        # a stale one is rebuilt first
+        snapshot_path = DefinitionSnapshot.path_for(file_path)
         try:
-            file_path_obj = Path(file_path)
-            
-            if not file_path_obj.exists():
-                logger.error(f"File not found: {file_path}")
-                return False
+            definitions = DefinitionSnapshot.open_definitions(file_path)
+        except ValueError as e:
+            logger.info(f"Recompiling {snapshot_path.name}: {e}")
+            try:
+                DefinitionSnapshot.compile(file_path)
+                definitions = DefinitionSnapshot.open_definitions(file_path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not recompile {snapshot_path}: {e}")
+                definitions = None
+        if definitions is not None:
+            logger.info(f"Reading compiled snapshot {snapshot_path}")
+        else:
+            logger.info(f"Processing rows from {file_path}")
+            definitions = ((row_num, first, rows, None) for row_num, first, rows
+                           in DefinitionSnapshot.iter_source_definitions(file_path))
+        
+        current_port = port_start
+        
+        for row_num, first, rows, table in definitions:
+            equipment_name = first['Equipment']
+            instrument_id = equipment_name.lower().replace(' ', '_').replace('-', '_')
             
-            # Read data based on file type
-            if file_path_obj.suffix.lower() in ['.xlsx', '.xls']:
-                data = ExcelReader.read_excel_as_csv(file_path)
-            elif file_path_obj.suffix.lower() == '.csv':
-                data = ExcelReader.read_csv(file_path)
+            if first.get('Port'):
+                try:
+                    port = int(first['Port'])
+                except ValueError:
+                    port = current_port
+                    current_port += 1
             else:
-                logger.error(f"Unsupported file type: {file_path_obj.suffix}")
-                return False
-            
-            if not data:
-                logger.error("No data found in file")
-                return False
+                port = current_port
+                current_port += 1
             
-            # Validate required columns
-            required_cols = ['Equipment', 'Command', 'Response']
-            if not all(col in data[0].keys() for col in required_cols):
-                available_cols = list(data[0].keys())
-                logger.error(f"File missing required columns: {required_cols}")
-                logger.error(f"Available columns: {available_cols}")
-                return False
+            framing = self.framing
+            if first.get('Framing'):
+                try:
+                    framing = FramingPolicy.from_spec(first['Framing'], self.framing.eoi_timeout_us)
+                except ValueError as e:
+                    logger.warning(f"Row {row_num}: {e}; using '{self.framing}'")
             
-            has_port_col = 'Port' in data[0].keys()
-            has_validation_col = 'Validation' in data[0].keys()
+            concurrency = self.concurrency
+            if first.get('Concurrency'):
+                concurrency = first['Concurrency'].lower()
+                if concurrency not in SCPIInstrument.CONCURRENCY_MODES:
+                    logger.warning(f"Row {row_num}: Unknown concurrency mode '{concurrency}'; "
+                                   f"using '{self.concurrency}'")
+                    concurrency = self.concurrency
             
-            self.instruments.clear()
-            current_instrument = None
-            current_port = port_start
-            commands_added = 0
+            replicas = self.replicas
+            if first.get('Replicas'):
+                try:
+                    replicas = int(first['Replicas'])
+                    if replicas < 1:
+                        raise ValueError
+                except ValueError:
+                    logger.warning(f"Row {row_num}: Invalid replica count '{first['Replicas']}'; "
+                                   f"using {self.replicas}")
+                    replicas = self.replicas
+            if replicas > 1:
+                if not hasattr(socket, 'SO_REUSEPORT'):
+                    logger.warning(f"Row {row_num}: SO_REUSEPORT is not available; serving "
+                                   f"{equipment_name} from one process")
+                    replicas = 1
+                elif self.spread_replicas and concurrency != 'session':
+                    # A client may land on any replica: keep its state with its connection
+                    concurrency = 'session'
             
-            logger.info(f"Processing {len(data)} rows from {file_path}")
+            settings = {
+                'name': equipment_name,
+                'port': port,
+                'framing': framing,
+                'concurrency': concurrency,
+                'replicas': replicas
+            }
             
-            for row_num, row in enumerate(data, 1):
-                equipment_name = row.get('Equipment', '').strip()
-                if equipment_name:
-                    instrument_id = equipment_name.lower().replace(' ', '_').replace('-', '_')
-                    
-                    if has_port_col and row.get('Port', '').strip():
-                        try:
-                            port = int(row['Port'])
-                        except ValueError:
-                            port = current_port
-                            current_port += 1
-                    else:
-                        port = current_port
-                        current_port += 1
-                    
-                    current_instrument = SCPIInstrument(equipment_name, instrument_id)
-                    self.instruments[instrument_id] = {
-                        'instrument': current_instrument,
-                        'port': port
-                    }
-                    
-                    logger.info(f"Row {row_num}: Created instrument: {equipment_name} (Port: {port})")
-
-                if (current_instrument and 
-                    row.get('Command', '').strip() and row.get('Response', '').strip()):
-                    
-                    command = row['Command'].strip()
-                    response = row['Response'].strip()
-                    validation = row.get('Validation','').strip() if has_validation_col else None
+            logger.info(f"Row {row_num}: Created instrument: {equipment_name} (Port: {port})")
+            yield instrument_id, settings, rows, table
 
-                    current_instrument.add_command(command, response, validation)
-                    commands_added += 1
+    def _build_instrument(self, instrument_id, settings, rows, table=None):
+        """Instrument data of one definition from _read_definitions()"""
+        instrument = SCPIInstrument(settings['name'], instrument_id, settings['concurrency'], self.metrics,
+                                    self.error_queue_depth)
+        if table is not None:
+            instrument.restore_table(table, rows)
+        else:
+            for command, response, validation in rows:
+                instrument.add_command(command, response, validation)
             
             # Link stateful commands
-            for instrument_id, instrument_data in self.instruments.items():
-                instrument = instrument_data['instrument']
-                instrument.link_stateful_commands()
+            instrument.link_stateful_commands()
+        return {
+            'instrument': instrument,
+            'port': settings['port'],
+            'framing': settings['framing'],
+            'concurrency': settings['concurrency'],
+            'replicas': settings['replicas'],
+            # Compared by reload_from_file() to find changed command tables
+            'rows': tuple(rows)
+        }
+
+    def load_from_file(self, file_path, port_start=5555):
+        """Load instrument definitions from Excel or CSV file
+        
+        The new instruments replace the loaded ones in one step; a file that
+        cannot be read leaves the loaded instruments alone.
+        """
+        try:
+            instruments = {}
+            commands_added = 0
+            
+            with gc_paused():
+                for instrument_id, settings, rows, table in self._read_definitions(file_path, port_start):
+                    instruments[instrument_id] = self._build_instrument(instrument_id, settings, rows, table)
+                    commands_added += len(rows)
+            
+            # Swap in the new instruments in one step, and stop the actor
+            # threads of the ones they replace
+            replaced, self.instruments = self.instruments, instruments
+            for inst_data in replaced.values():
+                inst_data['instrument'].set_concurrency('lock')
             
             if self.instruments:
                 logger.info(f"Successfully loaded {len(self.instruments)} instruments with {commands_added} commands")
@@ -943,25 +3369,138 @@ class SCPIEmulatorManager:
             else:
                 logger.error("No valid instruments found in file")
                 return False
-                
+        
+        except ValueError as e:
+            logger.error(str(e))
+            return False
         except Exception as e:
             logger.error(f"Error loading file: {e}")
             return False
 
-    def start_all_servers(self, host='localhost'):
-        """Start TCP servers for all instruments"""
-        success_count = 0
+    def reload_from_file(self, file_path, port_start=5555, keep_state=True):
+        """Apply the current contents of a configuration file to the loaded instruments
+        
+        Instruments whose rows changed get their new command table through
+        SCPIInstrument.replace_commands() while clients stay connected; a new
+        port or framing restarts the instrument's server, and instruments
+        added to or removed from the file are started or stopped. Returns the
+        instrument ids per kind of change plus the seconds taken, or None when
+        the file cannot be read, in which case nothing changes.
+        """
+        start = time.perf_counter()
+        try:
+            # Read everything first so a broken file leaves the instruments alone
+            with gc_paused():
+                definitions = {instrument_id: (settings, rows, table) for instrument_id, settings, rows, table
+                               in self._read_definitions(file_path, port_start)}
+        except Exception as e:
+            logger.error(f"Not reloading {file_path}: {e}")
+            return None
+        if not definitions:
+            logger.error(f"Not reloading {file_path}: no valid instruments found")
+            return None
+        
+        # Changes go into a copy that replaces self.instruments in one step, so
+        # the dashboard can iterate the instruments while a reload runs
+        summary = {'added': [], 'removed': [], 'changed': [], 'restarted': [], 'skipped': []}
+        instruments = dict(self.instruments)
+        for inst_id in [inst_id for inst_id in instruments if inst_id not in definitions]:
+            self._stop_server(inst_id)
+            instruments.pop(inst_id)['instrument'].set_concurrency('lock')
+            summary['removed'].append(inst_id)
         
-        for inst_id, inst_data in self.instruments.items():
+        for inst_id, (settings, rows, table) in definitions.items():
+            inst_data = instruments.get(inst_id)
+            if inst_data is None:
+                # A shard only serves the instruments it was given at start
+                if self.shard is not None:
+                    summary['skipped'].append(inst_id)
+                    continue
+                instruments[inst_id] = self._build_instrument(inst_id, settings, rows, table)
+                summary['added'].append(inst_id)
+                continue
+            
             instrument = inst_data['instrument']
-            port = inst_data['port']
+            rows = tuple(rows)
+            changed = False
+            if rows != inst_data['rows']:
+                instrument.replace_commands(rows, keep_state)
+                inst_data['rows'] = rows
+                changed = True
+            if settings['concurrency'] != inst_data['concurrency']:
+                instrument.set_concurrency(settings['concurrency'])
+                inst_data['concurrency'] = settings['concurrency']
+                changed = True
+            if changed:
+                summary['changed'].append(inst_id)
             
-            server = SCPIServer(instrument, self, host, port)
-            if server.start():
-                self.servers[inst_id] = server
-                success_count += 1
-            else:
-                logger.error(f"Failed to start server for {instrument.name}")
+            if settings['replicas'] != inst_data['replicas']:
+                logger.warning(f"{instrument.name}: replica count changes apply when the emulator is restarted")
+            
+            if settings['port'] != inst_data['port'] or str(settings['framing']) != str(inst_data['framing']):
+                inst_data['port'] = settings['port']
+                inst_data['framing'] = settings['framing']
+                summary['restarted'].append(inst_id)
+        self.instruments = instruments
+        
+        if self.running:
+            for inst_id in summary['added']:
+                self._start_server(inst_id)
+        for inst_id in summary['restarted']:
+            if inst_id in self.servers:
+                self._stop_server(inst_id)
+                self._start_server(inst_id)
+        
+        summary['seconds'] = time.perf_counter() - start
+        changes = ', '.join(f"{len(summary[kind])} {kind}" for kind in ('added', 'removed', 'changed', 'restarted')
+                            if summary[kind])
+        logger.info(f"Reloaded {file_path} in {summary['seconds'] * 1000:.1f} ms: {changes or 'no changes'}")
+        return summary
+
+    def watch_file(self, file_path, port_start=5555, interval=1.0, keep_state=True):
+        """Reload file_path whenever it changes (see DefinitionWatcher)"""
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.watcher = DefinitionWatcher(self, file_path, port_start, interval, keep_state)
+        self.watcher.start()
+        logger.info(f"Watching {file_path} for changes every {interval:g}s")
+
+    def _start_server(self, inst_id):
+        """Start the TCP server of one instrument; returns whether it started"""
+        inst_data = self.instruments[inst_id]
+        instrument = inst_data['instrument']
+        port = inst_data['port']
+        framing = inst_data.get('framing', self.framing)
+        reuse_port = inst_data.get('reuse_port', False)
+        if inst_data.get('replicas', 1) > 1 and not reuse_port:
+            logger.warning(f"{instrument.name}: replicas need worker processes (--replicas or --workers); "
+                           f"serving it from this process only")
+        
+        if self.event_loop is not None:
+            server = AsyncSCPIServer(instrument, self, self.host, port, framing, self.batch_writes, reuse_port,
+                                     event_loop=self.event_loop)
+        else:
+            server = SCPIServer(instrument, self, self.host, port, framing, self.batch_writes, reuse_port)
+        if server.start():
+            self.servers[inst_id] = server
+            return True
+        logger.error(f"Failed to start server for {instrument.name}")
+        return False
+
+    def _stop_server(self, inst_id):
+        """Stop the TCP server of one instrument, if it has one"""
+        server = self.servers.pop(inst_id, None)
+        if server is not None:
+            server.stop()
+
+    def start_all_servers(self, host='localhost'):
+        """Start TCP servers for all instruments"""
+        self.host = host
+        if self.event_loop is not None:
+            self.event_loop.start()
+        
+        # One by one: binding a port takes microseconds, far less than a thread hand-off
+        success_count = sum(self._start_server(inst_id) for inst_id in list(self.instruments))
         
         if success_count > 0:
             self.running = True
@@ -972,17 +3511,73 @@ class SCPIEmulatorManager:
             return False
 
     def stop_all_servers(self):
-        """Stop all TCP servers"""
-        for server in self.servers.values():
-            server.stop()
+        """Stop all TCP servers
         
+        Every server stops listening and starts draining its clients first;
+        then the drains, which run side by side, are waited for with one
+        deadline, so the slowest drain bounds the time taken, not their sum.
+        """
+        servers = list(self.servers.values())
         self.servers.clear()
+        for server in servers:
+            server.begin_stop()
+        deadline = time.monotonic() + SCPIServer.DRAIN_TIMEOUT
+        for server in servers:
+            server.finish_stop(deadline)
         self.running = False
+        
+        if self.event_loop is not None:
+            self.event_loop.stop()
         logger.info("All servers stopped")
 
+    def instrument_status(self):
+        """Status of every loaded instrument, for the dashboard"""
+        instruments = []
+        for inst_id, inst_data in list(self.instruments.items()):
+            instrument = inst_data['instrument']
+            server = self.servers.get(inst_id)
+            instruments.append({
+                'id': inst_id,
+                'name': instrument.name,
+                'port': inst_data['port'],
+                'running': server is not None and server.running,
+                'clients': len(server.clients) if server else 0,
+                'commands': instrument.command_count,
+                'errors': len(instrument.error_queue),
+                'state': dict(instrument.state)
+            })
+        return instruments
+
+    def restart_server(self, instrument_id):
+        """Drain and rebind one instrument's server; returns None if it has none running
+        
+        The other instruments' servers are not touched.
+        """
+        server = self.servers.get(instrument_id)
+        if server is None:
+            return None
+        return server.restart()
+
+    def send_command(self, instrument_id, command):
+        """Run a command on a served instrument outside any client connection
+        
+        Returns (instrument name, reply text, newest error), or None if the
+        instrument has no server.
+        """
+        server = self.servers.get(instrument_id)
+        if server is None:
+            return None
+        instrument = server.instrument
+        response, _, error = instrument.execute(command)
+        return instrument.name, response_text(response), error
+
+    def metric_samples(self):
+        """Samples of every /metrics family (see metric_samples)"""
+        return metric_samples(self)
+
     def start_web_dashboard(self, host='0.0.0.0', port=8081):
         """Start the web dashboard"""
-        if not HAS_FLASK:
+        if load_flask() is None:
             logger.warning("Flask not available. Cannot start web dashboard.")
             return False
             
@@ -1013,8 +3608,7 @@ class SCPIEmulatorManager:
                 command = parts[0].lower()
                 
                 if command == 'quit':
-                    if self.running:
-                        self.stop_all_servers()
+                    self.shutdown()
                     break
                 
                 elif command == 'load':
@@ -1046,9 +3640,10 @@ class SCPIEmulatorManager:
                 
                 elif command == 'status':
                     if self.running:
-                        print(f"✅ Running {len(self.servers)} servers:")
-                        for inst_id, server in self.servers.items():
-                            print(f"   {server.instrument.name}: {server.host}:{server.port}")
+                        running = [status for status in self.instrument_status() if status['running']]
+                        print(f"✅ Running {len(running)} servers:")
+                        for status in running:
+                            print(f"   {status['name']}: {self.host}:{status['port']}")
                         
                         if self.web_dashboard:
                             print(f"   Web dashboard: http://localhost:8081")
@@ -1064,14 +3659,360 @@ class SCPIEmulatorManager:
                     
             except KeyboardInterrupt:
                 print("\n👋 Shutting down...")
-                if self.running:
-                    self.stop_all_servers()
+                self.shutdown()
                 break
             except EOFError:
                 print("\n👋 Goodbye!")
-                if self.running:
-                    self.stop_all_servers()
+                self.shutdown()
+                break
+
+
+class WorkerEventQueue(DashboardEventQueue):
+    """DashboardEventQueue of a worker process: batches go to the parent unformatted"""
+
+    def _drain(self):
+        batch = []
+        popleft = self.events.popleft
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(popleft())
+            except IndexError:
+                break
+        if batch:
+            try:
+                self.emit('events', batch)
+                self.published += len(batch)
+            except Exception as e:
+                logger.error(f"Failed to send command events to the parent: {e}")
+        return len(batch)
+
+
+class WorkerChannel:
+    """A worker process's end of its pipe to the parent
+
+    Stands in for the web dashboard in the worker: command events are queued
+    without blocking (WorkerEventQueue) and sent to the parent in batches,
+    next to the replies to control calls. Pipe writes are serialized by a lock.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.queue = WorkerEventQueue(self._send_events)
+
+    def send(self, message):
+        with self.lock:
+            self.conn.send(message)
+
+    def _send_events(self, event, batch):
+        self.send((event, batch))
+
+    def emit_command_update(self, instrument_name, command, response, error=None):
+        self.queue.publish(instrument_name, command, response, error)
+
+
+def run_worker(conn, index, file_path, port_start, options, instrument_ids, replicated_ids):
+    """Entry point of a --workers process
+
+    Loads the same file as the parent and keeps the instruments in
+    instrument_ids; those in replicated_ids are bound with SO_REUSEPORT next
+    to their other replicas. Then serves control calls from the parent until
+    told to exit or the pipe closes.
+    """
+    configure_logging()
+    manager = SCPIEmulatorManager(**options)
+    manager.spread_replicas = True
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl+C
+    channel = WorkerChannel(conn)
+    if not manager.load_from_file(file_path, port_start):
+        channel.send(('ready', None))
+        return
+
+    manager.shard = set(instrument_ids)
+    for inst_id in list(manager.instruments):
+        if inst_id not in manager.shard:
+            manager.instruments.pop(inst_id)['instrument'].set_concurrency('lock')
+    for inst_id in replicated_ids:
+        manager.instruments[inst_id].update(reuse_port=True, replica=index)
+    manager.web_dashboard = channel
+    channel.queue.start()
+    channel.send(('ready', list(manager.instruments)))
+
+    calls = {
+        'start': manager.start_all_servers,
+        'stop': manager.stop_all_servers,
+        'status': manager.instrument_status,
+        'restart': manager.restart_server,
+        'send': manager.send_command,
+        'metrics': manager.metric_samples,
+        'reload': manager.reload_from_file,
+    }
+    while True:
+        try:
+            call_id, name, args = conn.recv()
+        except (EOFError, OSError):
+            break
+        if name == 'exit':
+            break
+        try:
+            result = (True, calls[name](*args))
+        except Exception as e:
+            result = (False, f"{type(e).__name__}: {e}")
+        channel.send(('reply', call_id, result))
+
+    manager.stop_all_servers()
+    channel.queue.stop()
+
+
+class WorkerProcess:
+    """The parent's handle on one --workers process
+
+    call() sends a control call and waits for its reply; a reader thread
+    matches replies to calls and hands command events to the manager.
+    """
+
+    def __init__(self, manager, index, file_path, port_start, options, instrument_ids, replicated_ids):
+        import multiprocessing
+        
+        context = multiprocessing.get_context('spawn')
+        self.index = index
+        self.manager = manager
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=run_worker, name=f'scpi-worker-{index}', daemon=True,
+                                       args=(child_conn, index, file_path, port_start, options,
+                                             instrument_ids, replicated_ids))
+        self.process.start()
+        child_conn.close()
+
+        self.lock = threading.Lock()  # guards pipe writes and the call table
+        self.calls = {}
+        self.next_call = 0
+        self.instrument_ids = None
+        self.ready = threading.Event()
+        self.reader = threading.Thread(target=self._read, name=f'scpi-worker-{index}-reader', daemon=True)
+        self.reader.start()
+
+    def _read(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
                 break
+            kind = message[0]
+            if kind == 'events':
+                self.manager.log_worker_events(message[1])
+            elif kind == 'reply':
+                call = self.calls.pop(message[1], None)
+                if call is not None:
+                    call[1] = message[2]
+                    call[0].set()
+            elif kind == 'ready':
+                self.instrument_ids = message[1]
+                self.ready.set()
+
+        # The worker is gone: fail whatever is still waiting
+        self.ready.set()
+        for done, _ in list(self.calls.values()):
+            done.set()
+
+    def call(self, name, *args, timeout=30):
+        """Run a manager method in the worker and return its result"""
+        call = [threading.Event(), None]
+        with self.lock:
+            call_id = self.next_call
+            self.next_call += 1
+            self.calls[call_id] = call
+            try:
+                self.conn.send((call_id, name, args))
+            except OSError:
+                call[0].set()
+        if not call[0].wait(timeout):
+            self.calls.pop(call_id, None)
+            raise RuntimeError(f"Worker {self.index} did not answer '{name}' within {timeout}s")
+        if call[1] is None:
+            raise RuntimeError(f"Worker {self.index} has exited")
+        ok, result = call[1]
+        if not ok:
+            raise RuntimeError(f"Worker {self.index}: {result}")
+        return result
+
+    def stop(self):
+        """Ask the worker to stop its servers and exit"""
+        try:
+            with self.lock:
+                self.conn.send((None, 'exit', ()))
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class ShardedEmulatorManager(SCPIEmulatorManager):
+    """Serves the instruments from --workers processes, one shard each
+
+    Each worker loads the same file and keeps its share of the instruments,
+    so it owns their state and ports outright and no handler is ever
+    pickled; the instruments' commands run on as many cores as there are
+    workers. An instrument with n replicas is kept by n workers, which all
+    bind its port with SO_REUSEPORT and let the kernel spread connections
+    over them (there are at least as many workers as the largest replica
+    count). This process keeps its own copy of the definitions, forwards
+    dashboard control calls to the workers owning the instrument and feeds
+    the workers' command events into command_logger and the dashboard.
+
+    Workers are started with the 'spawn' method, which re-runs this file;
+    run it as a script (python server-py-ver2.3.py ...) to use them.
+    """
+
+    def __init__(self, workers, **options):
+        super().__init__(**options)
+        self.spread_replicas = True
+        self.worker_count = workers
+        self.options = options
+        self.workers = []
+        self.owners = {}
+
+    def load_from_file(self, file_path, port_start=5555):
+        if not super().load_from_file(file_path, port_start):
+            return False
+        # The copies here only describe the instruments; no actor threads needed
+        for inst_data in self.instruments.values():
+            inst_data['instrument'].set_concurrency('lock')
+
+        self.stop_workers()
+        replicated = {inst_id: inst_data['replicas'] for inst_id, inst_data in self.instruments.items()
+                      if inst_data['replicas'] > 1}
+        others = [inst_id for inst_id in self.instruments if inst_id not in replicated]
+        count = max([min(self.worker_count, len(others))] + list(replicated.values()))
+        
+        # Replicas go to the first workers, everything else round-robin
+        assignments = [others[index::count] for index in range(count)]
+        for inst_id, replicas in replicated.items():
+            for index in range(replicas):
+                assignments[index].append(inst_id)
+        
+        self.workers = [WorkerProcess(self, index, str(file_path), port_start, self.options, instrument_ids,
+                                      [inst_id for inst_id in instrument_ids if inst_id in replicated])
+                        for index, instrument_ids in enumerate(assignments)]
+        for worker in self.workers:
+            worker.ready.wait()
+            if worker.instrument_ids is None:
+                logger.error(f"Worker {worker.index} failed to load {file_path}")
+                self.stop_workers()
+                return False
+            for inst_id in worker.instrument_ids:
+                self.owners.setdefault(inst_id, []).append(worker)
+        self.shard = set(self.owners)
+        logger.info(f"Sharded {len(self.instruments)} instruments across {count} worker processes"
+                    + (f" ({len(replicated)} replicated)" if replicated else ""))
+        return True
+
+    def reload_from_file(self, file_path, port_start=5555, keep_state=True):
+        # The copies here are updated first; each worker then applies the
+        # file to the instruments it owns
+        summary = super().reload_from_file(file_path, port_start, keep_state)
+        if summary is None:
+            return None
+        for inst_data in self.instruments.values():
+            inst_data['instrument'].set_concurrency('lock')
+        for inst_id in summary['removed']:
+            self.owners.pop(inst_id, None)
+        for inst_id in summary['skipped']:
+            logger.warning(f"{inst_id}: instruments are sharded when the workers start; "
+                           f"restart the emulator to serve it")
+        
+        start = time.perf_counter()
+        self._call_workers('reload', str(file_path), port_start, keep_state)
+        elapsed = time.perf_counter() - start
+        summary['seconds'] += elapsed
+        logger.info(f"Applied the reload in {len(self.workers)} worker processes in {elapsed * 1000:.1f} ms")
+        return summary
+
+    def stop_workers(self):
+        """Stop every worker process"""
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+        self.owners.clear()
+        self.running = False
+
+    def log_worker_events(self, events):
+        """Record command events executed in a worker (called by its reader thread)"""
+        dashboard = self.web_dashboard
+        for timestamp, instrument_name, command, response, error in events:
+            command_logger.log_command(instrument_name, command, response, error, timestamp)
+            if dashboard is not None:
+                dashboard.emit_command_update(instrument_name, command, response, error)
+
+    def _call_workers(self, name, *args):
+        """Results of a call on every worker, skipping workers that fail; the workers run it side by side"""
+        def call(worker):
+            try:
+                return True, worker.call(name, *args)
+            except RuntimeError as e:
+                logger.error(str(e))
+                return False, None
+        return [result for ok, result in run_in_parallel(call, self.workers) if ok]
+
+    def start_all_servers(self, host='localhost'):
+        """Start the TCP servers of every worker's instruments"""
+        self.host = host
+        started = sum(1 for result in self._call_workers('start', host) if result)
+        self.running = started > 0
+        if self.running:
+            logger.info(f"Started SCPI servers in {started} of {len(self.workers)} worker processes")
+        else:
+            logger.error("Failed to start any servers")
+        return self.running
+
+    def stop_all_servers(self):
+        """Stop the TCP servers of every worker"""
+        self._call_workers('stop')
+        self.running = False
+        logger.info("All servers stopped")
+
+    def instrument_status(self):
+        # Replicas add up; their shared state is the first replica's
+        reported = {}
+        for statuses in self._call_workers('status'):
+            for status in statuses:
+                total = reported.get(status['id'])
+                if total is None:
+                    reported[status['id']] = status
+                    continue
+                total['running'] = total['running'] or status['running']
+                for key in ('clients', 'commands', 'errors'):
+                    total[key] += status[key]
+        return [reported.get(status['id'], status) for status in super().instrument_status()]
+
+    def restart_server(self, instrument_id):
+        workers = self.owners.get(instrument_id)
+        if workers is None:
+            return None
+        # One replica at a time, so the others keep serving the port meanwhile
+        results = [worker.call('restart', instrument_id) for worker in workers]
+        return all(results)
+
+    def send_command(self, instrument_id, command):
+        # Runs on the first replica, against its shared (non-session) state
+        workers = self.owners.get(instrument_id)
+        if workers is None:
+            return None
+        return workers[0].call('send', instrument_id, command)
+
+    def metric_samples(self):
+        # Workers own disjoint instruments, and replicas carry a replica label
+        samples = {}
+        for worker_samples in self._call_workers('metrics'):
+            for name, lines in worker_samples.items():
+                samples.setdefault(name, []).extend(lines)
+        dashboard = self.web_dashboard
+        if dashboard is not None and hasattr(dashboard, 'events'):
+            samples.setdefault('scpi_queue_depth', []).append(
+                f'scpi_queue_depth{{queue="dashboard_events"}} {len(dashboard.events.events)}')
+        return samples
 
 
 def create_example_csv():
@@ -1192,12 +4133,17 @@ def create_dashboard_template():
                 });
         }
         
-        socket.on('command_update', function(data) {
+        function appendCommand(data) {
             const commands = document.getElementById('commands');
             const newCommand = document.createElement('div');
             newCommand.innerHTML = `[${data.instrument}] ${data.command} → ${data.response}`;
             commands.appendChild(newCommand);
             commands.scrollTop = commands.scrollHeight;
+        }
+        
+        socket.on('command_update', appendCommand);
+        socket.on('command_batch', function(batch) {
+            batch.events.forEach(appendCommand);
         });
         
         // Refresh status every 5 seconds
@@ -1220,7 +4166,6 @@ def main():
     print("SCPI Equipment Emulator - VERSION 2.3")
     print("🌐 NEW: Web Dashboard with real-time monitoring!")
     print("=" * 60)
-    create_dashboard_template()
     parser = argparse.ArgumentParser(
         description='SCPI Equipment Emulator v2.3 - LabVIEW Compatible with Web Dashboard'
     )
@@ -1231,27 +4176,88 @@ def main():
     parser.add_argument('--web-port', type=int, default=8081, help='Web dashboard port (default: 8081)')
     parser.add_argument('--port', '-p', type=int, default=5555, help='Starting port for instruments (default: 5555)')
     parser.add_argument('--host', default='localhost', help='Server host (default: localhost)')
+    parser.add_argument('--server-mode', choices=['thread', 'async'], default='thread',
+                        help='Client handling: thread per client, or one asyncio loop for all ports (default: thread)')
+    parser.add_argument('--framing', choices=FramingPolicy.MODES, default='eoi',
+                        help='Default framing policy for unterminated commands (default: eoi)')
+    parser.add_argument('--eoi-timeout-us', type=int, default=FramingPolicy.DEFAULT_EOI_TIMEOUT_US,
+                        help='Idle time in microseconds before the eoi policy runs an unterminated command (default: 300000)')
+    parser.add_argument('--no-write-batching', action='store_true',
+                        help='Send every reply as soon as it is ready instead of once per received burst')
+    parser.add_argument('--concurrency', choices=SCPIInstrument.CONCURRENCY_MODES, default='lock',
+                        help='Default sharing of an instrument between clients: lock, actor or session (default: lock)')
+    parser.add_argument('--error-queue-depth', type=int, default=ErrorQueue.DEFAULT_DEPTH,
+                        help='Errors an instrument queues before reporting -350 Queue overflow (default: 20)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processes to spread the instruments across, each serving its own shard (default: 1)')
+    parser.add_argument('--replicas', type=int, default=1,
+                        help='Processes serving each instrument on its shared port via SO_REUSEPORT; '
+                             'replicated instruments keep state per connection (default: 1)')
+    parser.add_argument('--no-metrics', action='store_true',
+                        help='Do not record the latency histograms served on /metrics')
+    parser.add_argument('--watch', action='store_true',
+                        help='Reload the --load file into the running instruments whenever it changes')
+    parser.add_argument('--watch-interval', type=float, default=1.0,
+                        help='Seconds between checks of the watched file (default: 1)')
+    parser.add_argument('--watch-reset-state', action='store_true',
+                        help='Clear the settings and error queue of instruments changed by a reload')
+    parser.add_argument('--compile', action='store_true',
+                        help='Write a snapshot of the --load file that later loads skip parsing with')
     parser.add_argument('--create-example', action='store_true', help='Create example CSV file')
     parser.add_argument('--interactive', '-i', action='store_true', help='Start interactive mode')
     parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose logging')
     
     args = parser.parse_args()
     
-    if args.verbose:
-        logging.getLogger().setLevel(logging.DEBUG)
+    if args.eoi_timeout_us < 0:
+        parser.error('--eoi-timeout-us must not be negative')
+    if args.error_queue_depth < 1:
+        parser.error('--error-queue-depth must be at least 1')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.replicas < 1:
+        parser.error('--replicas must be at least 1')
+    if args.replicas > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        parser.error('--replicas needs SO_REUSEPORT, which this platform does not provide')
+    if args.compile and not args.load:
+        parser.error('--compile needs --load')
+    if args.watch and not args.load:
+        parser.error('--watch needs --load')
+    if args.watch_interval <= 0:
+        parser.error('--watch-interval must be positive')
     
     if args.create_example:
         create_example_csv()
         return
     
-    # Create dashboard template
-    create_dashboard_template()
+    configure_logging(args.verbose)
     
     # Create emulator manager
-    manager = SCPIEmulatorManager()
+    options = dict(
+        server_mode=args.server_mode,
+        framing=FramingPolicy(args.framing, args.eoi_timeout_us),
+        batch_writes=not args.no_write_batching,
+        concurrency=args.concurrency,
+        metrics=not args.no_metrics,
+        error_queue_depth=args.error_queue_depth,
+        replicas=args.replicas
+    )
+    if args.workers > 1 or args.replicas > 1:
+        manager = ShardedEmulatorManager(args.workers, **options)
+    else:
+        manager = SCPIEmulatorManager(**options)
     
     # Load file if provided
     if args.load:
+        if args.compile:
+            start = time.perf_counter()
+            try:
+                snapshot_path = DefinitionSnapshot.compile(args.load)
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not compile {args.load}: {e}")
+                sys.exit(1)
+            print(f"📦 Compiled {args.load} into {snapshot_path} in {time.perf_counter() - start:.2f}s")
+        
         if not manager.load_from_file(args.load, args.port):
             sys.exit(1)
         
@@ -1264,23 +4270,28 @@ def main():
         if args.web:
             if not manager.start_web_dashboard('0.0.0.0', args.web_port):
                 logger.warning("Failed to start web dashboard")
+        
+        if args.watch:
+            manager.watch_file(args.load, args.port, args.watch_interval, not args.watch_reset_state)
     
     # Start interactive mode
     if args.interactive or (not args.load and not args.create_example):
         manager.interactive_mode()
-    elif args.load and (args.start or args.web):
+    elif args.load and (args.start or args.web or args.watch):
         print(f"\n🚀 SCPI Emulator running!")
         if manager.running:
             print(f"📡 Instruments available on ports {args.port}+")
         if args.web:
             print(f"🌐 Web dashboard: http://localhost:{args.web_port}")
+        if args.watch:
+            print(f"👀 Reloading {args.load} when it changes")
         print("\nPress Ctrl+C to stop...")
         
         try:
             while True:
                 time.sleep(1)
         except KeyboardInterrupt:
-            manager.stop_all_servers()
+            manager.shutdown()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file